@@ -1,13 +1,16 @@
 import os
 
 from aws_cdk import (
+    ArnFormat,
     Duration,
     Stack,
     aws_dynamodb as dynamodb_,
     aws_lambda as lambda_,
+    aws_lambda_event_sources as lambda_event_sources_,
     aws_apigatewayv2 as apigw_,
     aws_events as events_,
     aws_events_targets as events_targets_,
+    aws_iam as iam_,
 )
 from aws_cdk.aws_apigatewayv2_integrations import HttpLambdaIntegration
 from aws_cdk.aws_apigatewayv2_authorizers import (
@@ -23,8 +26,27 @@ print(os.environ)
 
 TABLE_NAME = os.environ["TABLE_NAME"]
 TABLE_GSI_NAME = os.environ["TABLE_GSI_NAME"]
+TABLE_SHARDED_GSI_NAME = os.environ["TABLE_SHARDED_GSI_NAME"]
+# empty leaves the pending expiry GSI out: CloudFormation creates at most one
+# GSI per update of an existing table, so it is added by a deployment of its own
+TABLE_PENDING_GSI_NAME = os.environ.get("TABLE_PENDING_GSI_NAME") or ""
+STATUS_SHARD_COUNT = os.environ.get("STATUS_SHARD_COUNT") or "0"
 ADMIN_API_KEY = os.environ["ADMIN_API_KEY"]
+PAGINATION_TOKEN_SECRET = os.environ["PAGINATION_TOKEN_SECRET"]
+SCAN_TOTAL_SEGMENTS = os.environ.get("SCAN_TOTAL_SEGMENTS") or "4"
+ITEM_CACHE_SIZE = os.environ.get("ITEM_CACHE_SIZE") or "1024"
+ITEM_CACHE_TTL_SECONDS = os.environ.get("ITEM_CACHE_TTL_SECONDS") or "30"
+SCHEDULER_MAX_WORKERS = os.environ.get("SCHEDULER_MAX_WORKERS") or "10"
+SCHEDULER_WCU_PER_SECOND = os.environ.get("SCHEDULER_WCU_PER_SECOND") or "0"
+SCHEDULER_MAX_CONTINUATIONS = os.environ.get("SCHEDULER_MAX_CONTINUATIONS") or "5"
 CRON_DURATION_MINUTES = int(os.environ["CRON_DURATION_MINUTES"] or 60)
+# `cron` polls the GSI only, `stream` also expires invitations as their
+# TTL expiry timers are deleted, the cron run is then a backstop sweep
+EXPIRY_MODE = os.environ.get("EXPIRY_MODE") or "cron"
+# `compact` writes new invitations with an epoch `created_date` under a short name
+ITEM_FORMAT = os.environ.get("ITEM_FORMAT") or "standard"
+# `time` prefixes new codes with their creation time, so they sort by it
+CODE_FORMAT = os.environ.get("CODE_FORMAT") or "random"
 
 
 class AppStack(Stack):
@@ -45,6 +67,12 @@ class AppStack(Stack):
                 name="code",
                 type=dynamodb_.AttributeType.STRING,
             ),
+            # expiry timers, see EXPIRY_MODE
+            time_to_live_attribute="expires_at",
+            # keys are enough, a timer's key is the invitation's key
+            stream=(
+                dynamodb_.StreamViewType.KEYS_ONLY if EXPIRY_MODE == "stream" else None
+            ),
         )
         invitation_table.add_global_secondary_index(
             index_name=TABLE_GSI_NAME,
@@ -57,6 +85,34 @@ class AppStack(Stack):
                 type=dynamodb_.AttributeType.STRING,
             ),
         )
+        # write-sharded variant of the GSI above, e.g. `unconfirmed#07`,
+        # spreads a status over STATUS_SHARD_COUNT partitions
+        invitation_table.add_global_secondary_index(
+            index_name=TABLE_SHARDED_GSI_NAME,
+            partition_key=dynamodb_.Attribute(
+                name="status_shard",
+                type=dynamodb_.AttributeType.STRING,
+            ),
+            sort_key=dynamodb_.Attribute(
+                name="expiry_date",
+                type=dynamodb_.AttributeType.STRING,
+            ),
+        )
+
+        # sparse GSI of live invitations only: `pending_shard` is set on
+        # create and removed once confirmed, invalidated or expired
+        if TABLE_PENDING_GSI_NAME:
+            invitation_table.add_global_secondary_index(
+                index_name=TABLE_PENDING_GSI_NAME,
+                partition_key=dynamodb_.Attribute(
+                    name="pending_shard",
+                    type=dynamodb_.AttributeType.STRING,
+                ),
+                sort_key=dynamodb_.Attribute(
+                    name="expiry_date",
+                    type=dynamodb_.AttributeType.STRING,
+                ),
+            )
 
         # main Lambda for logical processing
         invitation_fn = lambda_.Function(
@@ -71,6 +127,16 @@ class AppStack(Stack):
             environment={
                 "TABLE_NAME": TABLE_NAME,
                 "TABLE_GSI_NAME": TABLE_GSI_NAME,
+                "TABLE_SHARDED_GSI_NAME": TABLE_SHARDED_GSI_NAME,
+                "TABLE_PENDING_GSI_NAME": TABLE_PENDING_GSI_NAME,
+                "STATUS_SHARD_COUNT": STATUS_SHARD_COUNT,
+                "PAGINATION_TOKEN_SECRET": PAGINATION_TOKEN_SECRET,
+                "SCAN_TOTAL_SEGMENTS": SCAN_TOTAL_SEGMENTS,
+                "ITEM_CACHE_SIZE": ITEM_CACHE_SIZE,
+                "ITEM_CACHE_TTL_SECONDS": ITEM_CACHE_TTL_SECONDS,
+                "EXPIRY_MODE": EXPIRY_MODE,
+                "ITEM_FORMAT": ITEM_FORMAT,
+                "CODE_FORMAT": CODE_FORMAT,
             },
         )
         invitation_table.grant_read_write_data(invitation_fn)
@@ -126,6 +192,18 @@ class AppStack(Stack):
             integration=invitation_integration,
             authorizer=api_key_authorizer,
         )
+        http_api.add_routes(
+            path="/invitation/bulk",
+            methods=[apigw_.HttpMethod.PUT],
+            integration=invitation_integration,
+            authorizer=api_key_authorizer,
+        )
+        http_api.add_routes(
+            path="/invitation/stats",
+            methods=[apigw_.HttpMethod.GET],
+            integration=invitation_integration,
+            authorizer=api_key_authorizer,
+        )
 
         # cron job Lambda that converts expired invitation status
         scheduler_fn = lambda_.Function(
@@ -140,9 +218,32 @@ class AppStack(Stack):
             environment={
                 "TABLE_NAME": TABLE_NAME,
                 "TABLE_GSI_NAME": TABLE_GSI_NAME,
+                "TABLE_SHARDED_GSI_NAME": TABLE_SHARDED_GSI_NAME,
+                "TABLE_PENDING_GSI_NAME": TABLE_PENDING_GSI_NAME,
+                "STATUS_SHARD_COUNT": STATUS_SHARD_COUNT,
+                "SCHEDULER_MAX_WORKERS": SCHEDULER_MAX_WORKERS,
+                "SCHEDULER_WCU_PER_SECOND": SCHEDULER_WCU_PER_SECOND,
+                "SCHEDULER_MAX_CONTINUATIONS": SCHEDULER_MAX_CONTINUATIONS,
             },
         )
         invitation_table.grant_read_write_data(scheduler_fn)
+        # expiry batches are PartiQL updates, not covered by read/write data
+        invitation_table.grant(scheduler_fn, "dynamodb:PartiQLUpdate")
+        # self-continuation once a run checkpoints before its timeout
+        # ARN is built from the name, `grant_invoke` on itself would be circular
+        scheduler_fn.add_to_role_policy(
+            iam_.PolicyStatement(
+                actions=["lambda:InvokeFunction"],
+                resources=[
+                    self.format_arn(
+                        service="lambda",
+                        resource="function",
+                        resource_name="InvitationCronService",
+                        arn_format=ArnFormat.COLON_RESOURCE_NAME,
+                    )
+                ],
+            )
+        )
         rule = events_.Rule(
             self,
             "InvitationCronServiceRule",
@@ -151,3 +252,60 @@ class AppStack(Stack):
             ),
         )
         rule.add_target(target=events_targets_.LambdaFunction(scheduler_fn))
+        # daily recount of the per-status counters the stats endpoint serves
+        counters_rule = events_.Rule(
+            self,
+            "InvitationCountersReconcileRule",
+            schedule=events_.Schedule.rate(duration=Duration.days(1)),
+        )
+        counters_rule.add_target(
+            target=events_targets_.LambdaFunction(
+                scheduler_fn,
+                event=events_.RuleTargetInput.from_object(
+                    {"job": "reconcile_counters"}
+                ),
+            )
+        )
+
+        if EXPIRY_MODE == "stream":
+            # expires invitations as DynamoDB TTL deletes their expiry timers
+            expiry_stream_fn = lambda_.Function(
+                self,
+                id="InvitationExpiryStreamFn",
+                function_name="InvitationExpiryStreamService",
+                runtime=lambda_.Runtime.PYTHON_3_10,
+                code=lambda_.Code.from_asset("lambdas/scheduler"),
+                handler="stream.handler",
+                memory_size=256,
+                timeout=Duration.seconds(60),
+                environment={
+                    "TABLE_NAME": TABLE_NAME,
+                    "STATUS_SHARD_COUNT": STATUS_SHARD_COUNT,
+                },
+            )
+            invitation_table.grant_read_write_data(expiry_stream_fn)
+            invitation_table.grant(expiry_stream_fn, "dynamodb:PartiQLUpdate")
+            expiry_stream_fn.add_event_source(
+                lambda_event_sources_.DynamoEventSource(
+                    invitation_table,
+                    starting_position=lambda_.StartingPosition.TRIM_HORIZON,
+                    batch_size=100,
+                    max_batching_window=Duration.seconds(5),
+                    retry_attempts=10,
+                    report_batch_item_failures=True,
+                    # only TTL deletions invoke the function, other writes are free
+                    filters=[
+                        lambda_.FilterCriteria.filter(
+                            {
+                                "eventName": lambda_.FilterRule.is_equal("REMOVE"),
+                                "userIdentity": {
+                                    "type": lambda_.FilterRule.is_equal("Service"),
+                                    "principalId": lambda_.FilterRule.is_equal(
+                                        "dynamodb.amazonaws.com"
+                                    ),
+                                },
+                            }
+                        )
+                    ],
+                )
+            )
@@ -1,62 +1,241 @@
 from datetime import datetime, timezone
 import os
+import time
 import traceback
+from typing import Union
 
 from .schemas import (
     Invitation,
     InvitationStatus,
 )
 from .queries import (
-    get_all,
-    query,
-    query_by_gsi,
-    update,
+    get,
+    get_change_version,
+    get_counters,
+    get_page,
+    get_parallel_page,
+    query_page,
+    query_by_gsi_merged_page,
+    update_status,
+    bulk_update_status,
+    query_latest,
+    key_filter,
+    domain_filter,
+    status_filter,
     create,
+    batch_create,
 )
 from .utils import (
     generate_code,
     generate_invitation,
     build_response,
+    build_not_modified_response,
+    build_etag,
+    matching_etag,
+    parse_limit,
+    is_valid_email,
+    parse_date,
+    parse_fields,
+    encode_next_token,
+    decode_next_token,
+    get_status_shard_count,
+    expiry_timers_enabled,
+    compact_items_enabled,
+    time_ordered_codes_enabled,
+    effective_status,
+    with_effective_status,
+    MAX_BULK_INVITATIONS,
+    MAX_BULK_CONFIRMATIONS,
 )
 
 
-def review_all_invitations(table, query_params: dict):
+def review_all_invitations(table, query_params: dict, if_none_match: str = None):
+    """
+    List invitations, answering a conditional GET whose `If-None-Match`
+    still matches with a 304 after a single read of the change version.
+    With `latest=true`, only the newest invitation of `email` (with one of
+    the `invite_status`) is returned, see `query_latest`.
+    """
     print(f"{query_params=}")
     invite_status = query_params.get("invite_status")
+    # comma-separated, e.g. `unconfirmed,expired`, empty pieces are dropped
+    invite_statuses = invite_status and list(
+        dict.fromkeys(x.strip() for x in invite_status.split(",") if x.strip())
+    )
     email = query_params.get("email")
     code = query_params.get("code")
+    expiring_before = query_params.get("expiring_before")
+    expiring_after = query_params.get("expiring_after")
+    order = query_params.get("order")
+    latest = query_params.get("latest") == "true"
+    total_segments = int(os.environ.get("SCAN_TOTAL_SEGMENTS") or 1)
+    shard_count = get_status_shard_count()
+
+    if invite_status is None and (expiring_before or expiring_after or order):
+        message = (
+            "'expiring_before', 'expiring_after' and 'order' need 'invite_status'."
+        )
+        return build_response(
+            status_code=422,
+            success=False,
+            message=message,
+        )
+
+    if latest and (email is None or code is not None):
+        message = "'latest' needs 'email' and no 'code'."
+        return build_response(
+            status_code=422,
+            success=False,
+            message=message,
+        )
+
+    if order not in (None, "asc", "desc"):
+        message = "'order' must be 'asc' or 'desc'."
+        return build_response(
+            status_code=422,
+            success=False,
+            message=message,
+        )
+
+    known_statuses = {x.value for x in InvitationStatus}
+    if invite_status is not None and (
+        not invite_statuses or not set(invite_statuses) <= known_statuses
+    ):
+        message = (
+            f"'invite_status' must be a comma-separated list of "
+            f"{', '.join(sorted(known_statuses))}."
+        )
+        return build_response(
+            status_code=422,
+            success=False,
+            message=message,
+        )
 
+    # cursor is only valid for the same set of filters it was issued for
+    scope = (
+        f"{invite_status}|{email}|{code}|{expiring_before}|{expiring_after}|{order}"
+        f"|{latest}|{total_segments}|{shard_count}"
+    )
     try:
-        if invite_status is not None:
-            # fast query by invite status
-            data = query_by_gsi(
+        limit = parse_limit(query_params.get("limit"))
+        start_key = decode_next_token(query_params.get("next_token"), scope)
+        parse_date(expiring_before)
+        parse_date(expiring_after)
+        fields = parse_fields(query_params.get("fields"))
+    except ValueError as e:
+        message = (
+            f"Invalid 'limit', 'next_token', 'expiring_before', 'expiring_after' "
+            f"or 'fields'. Err: {e}"
+        )
+        return build_response(
+            status_code=422,
+            success=False,
+            message=message,
+        )
+
+    now = datetime.now(timezone.utc)
+    now_utc = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+    etag_scope = f"{scope}|{limit}|{query_params.get('next_token')}|{fields}"
+    # statuses as of now are worked out from these two, whatever is returned
+    read_fields = fields and [*fields, "invite_status", "expiry_date"]
+    try:
+        # read before the listing, a write in between only makes the ETag stale
+        version = get_change_version(table)
+        etag = matching_etag(if_none_match, version, etag_scope, int(now.timestamp()))
+        if etag is not None:
+            return build_not_modified_response(etag)
+
+        if latest:
+            # newest first by code, narrowed by status as of now and expiry range
+            filter_expr = None
+            if invite_status is not None:
+                filter_expr = status_filter(
+                    [
+                        phase
+                        for x in invite_statuses
+                        for phase in __status_phases(
+                            x, now_utc, expiring_before, expiring_after
+                        )
+                    ]
+                )
+            item = None
+            if invite_status is None or filter_expr is not None:
+                item = query_latest(table, email, filter_expr, fields=read_fields)
+            data, last_key = ([item] if item else []), None
+        elif invite_status is not None and email is not None and code is not None:
+            # point read, then filter by status as of now and expiry range
+            item = get(table, email, code, min_version=version)
+            data = [
+                x
+                for x in with_effective_status([item] if item else [], now_utc)
+                if x["invite_status"] in invite_statuses
+                and (expiring_before is None or x["expiry_date"] < expiring_before)
+                and (expiring_after is None or x["expiry_date"] >= expiring_after)
+            ]
+            last_key = None
+        elif invite_status is not None:
+            # email/code are filtered by DynamoDB, only matches are returned,
+            # except for the ones expired since the first page of the cursor
+            data, last_key = __query_status_page(
                 table=table,
-                gsi_name=os.environ["TABLE_GSI_NAME"],
-                invite_status=invite_status,
+                invite_statuses=invite_statuses,
+                shard_count=shard_count,
+                limit=limit,
+                start_key=start_key,
+                now=now_utc,
+                expiring_before=expiring_before,
+                expiring_after=expiring_after,
+                filter_expr=key_filter(email, code),
+                descending=order == "desc",
+                fields=read_fields,
             )
-            if email or code:
-                data = [
-                    d
-                    for d in data
-                    if (d["email"] == email if email else True)
-                    and (d["code"] == code if code else True)
-                ]
+            data = [
+                x
+                for x in with_effective_status(data, now_utc)
+                if x["invite_status"] in invite_statuses
+            ]
+        elif email is not None and code is not None:
+            # point read, both key attributes are known
+            item = get(table, email, code, min_version=version)
+            data, last_key = ([item] if item else []), None
         elif email is not None:
             # if email is supplied, but no filter by invite_status
-            data = query(
+            data, last_key = query_page(
                 table=table,
                 email=email,
                 code=code,
+                limit=limit,
+                start_key=start_key,
+                fields=read_fields,
+            )
+        elif total_segments > 1:
+            # parallel segmented scan if neither invite_status nor email is given
+            data, last_key = get_parallel_page(
+                table=table,
+                limit=limit,
+                total_segments=total_segments,
+                start_keys=start_key,
+                fields=read_fields,
             )
         else:
-            # slow scan-all if neither invite_status nor email is given
-            data = get_all(table)
+            # slow scan if neither invite_status nor email is given
+            data, last_key = get_page(
+                table=table,
+                limit=limit,
+                start_key=start_key,
+                fields=read_fields,
+            )
 
         return build_response(
             status_code=200,
             success=True,
             message=None,
-            data=data,
+            # statuses as of now, even where the scheduler has not caught up yet
+            data=__select(with_effective_status(data, now_utc), fields),
+            next_token=encode_next_token(last_key, scope),
+            etag=build_etag(
+                version, __next_expiry(table, now_utc, shard_count), etag_scope
+            ),
         )
 
     except Exception as e:
@@ -72,6 +251,152 @@ def review_all_invitations(table, query_params: dict):
         )
 
 
+def __select(items: list[dict], fields: Union[None, list]) -> list[dict]:
+    """
+    `items` with only `fields`, all of them if None.
+    """
+    if fields is None:
+        return items
+    return [{k: x[k] for k in fields} for x in items]
+
+
+def __next_expiry(table, now: str, shard_count: int = 0) -> int:
+    """
+    Epoch second up to which statuses as of `now` hold, without any write:
+    the earliest expiry_date of an unexpired unconfirmed invitation,
+    0 if there is none. Read on the status GSI in use, see `__query_status_page`.
+    """
+    items, _ = __query_status_page(
+        table=table,
+        invite_statuses=[InvitationStatus.UNCONFIRMED],
+        shard_count=shard_count,
+        limit=1,
+        now=now,
+        fields=["expiry_date"],
+    )
+    if not items:
+        return 0
+    expiry_date = datetime.strptime(items[0]["expiry_date"], "%Y-%m-%dT%H:%M:%SZ")
+    return int(expiry_date.replace(tzinfo=timezone.utc).timestamp())
+
+
+def __status_phases(
+    invite_status: str,
+    now: str,
+    expiring_before: str = None,
+    expiring_after: str = None,
+) -> list[tuple]:
+    """
+    GSI queries, as (invite_status, expiry_before, expiry_after), that together
+    return the invitations whose effective status is `invite_status` as of `now`,
+    with `expiring_after` <= expiry_date < `expiring_before`.
+    A phase whose range is empty is kept, so cursors stay valid as `now` moves.
+    """
+    if invite_status == InvitationStatus.UNCONFIRMED:
+        phases = [(InvitationStatus.UNCONFIRMED.value, None, now)]
+    elif invite_status == InvitationStatus.EXPIRED:
+        # converted ones, and the ones the scheduler has not converted yet
+        phases = [
+            (InvitationStatus.EXPIRED.value, None, None),
+            (InvitationStatus.UNCONFIRMED.value, now, None),
+        ]
+    else:
+        phases = [(invite_status, None, None)]
+
+    return [
+        (
+            status,
+            min((x for x in (before, expiring_before) if x is not None), default=None),
+            max((x for x in (after, expiring_after) if x is not None), default=None),
+        )
+        for status, before, after in phases
+    ]
+
+
+def __query_status_page(
+    table,
+    invite_statuses: list,
+    shard_count: int,
+    limit: int,
+    start_key: dict = None,
+    now: str = None,
+    expiring_before: str = None,
+    expiring_after: str = None,
+    filter_expr=None,
+    descending: bool = False,
+    fields: list = None,
+) -> tuple[list[dict], Union[None, dict]]:
+    """
+    Query a single page of invitations whose effective status is one of
+    `invite_statuses`, by expiry_date (descending if `descending`), narrowed
+    by `filter_expr` and reading only `fields`.
+    The `__status_phases` of every status, and every shard of those, are
+    GSI partitions queried concurrently and merged by expiry_date.
+    `start_key` is the cursor of the previous page, or None to start over.
+    It holds one key per partition and the `now` of the first page, which
+    later pages keep: DynamoDB rejects a start key outside the key condition.
+    return (items, next_start_key), the latter is None when all are done
+    """
+    if start_key:
+        now, start_key = start_key["now"], start_key["keys"]
+
+    partitions = []
+    for invite_status in invite_statuses:
+        for status, expiry_before, expiry_after in __status_phases(
+            invite_status, now, expiring_before, expiring_after
+        ):
+            if shard_count:
+                partitions.extend(
+                    (f"{status}#{shard:02d}", expiry_before, expiry_after)
+                    for shard in range(shard_count)
+                )
+            else:
+                partitions.append((status, expiry_before, expiry_after))
+
+    items, last_keys = query_by_gsi_merged_page(
+        table=table,
+        gsi_name=os.environ[
+            "TABLE_SHARDED_GSI_NAME" if shard_count else "TABLE_GSI_NAME"
+        ],
+        partition_key="status_shard" if shard_count else "invite_status",
+        partitions=partitions,
+        limit=limit,
+        start_keys=start_key,
+        filter_expr=filter_expr,
+        descending=descending,
+        fields=fields,
+    )
+    return items, last_keys and {"now": now, "keys": last_keys}
+
+
+def review_invitation_stats(table):
+    """
+    Invitation count of every status from the maintained counters, without
+    reading any invitation. Unconfirmed invitations past their expiry_date
+    count as unconfirmed until the scheduler expires them.
+    """
+    try:
+        counts = get_counters(table)
+        return build_response(
+            status_code=200,
+            success=True,
+            message="Invitation stats",
+            data={**counts, "total": sum(counts.values())},
+        )
+
+    except Exception as e:
+        traceback.print_exc()
+
+        message = f"Error getting invitation stats. Err: {e}"
+        print(message)
+
+        return build_response(
+            status_code=500,
+            success=False,
+            message=message,
+        )
+
+
 def create_new_invitation(table, request_body: dict):
     print(f"{request_body=}")
 
@@ -87,12 +412,18 @@ def create_new_invitation(table, request_body: dict):
     email = request_body["email"]
     data = generate_invitation(
         email=email,
-        code=generate_code(),
+        code=generate_code(time_ordered=time_ordered_codes_enabled()),
     )
     print(f"new invitation data={data}")
 
     try:
-        create_sucess = create(table, data)
+        create_sucess = create(
+            table,
+            data,
+            shard_count=get_status_shard_count(),
+            with_expiry_timer=expiry_timers_enabled(),
+            compact=compact_items_enabled(),
+        )
         message = "Invitation created!"
         print(message)
 
@@ -117,7 +448,112 @@ def create_new_invitation(table, request_body: dict):
         )
 
 
-def confirm_invitation(table, request_body: dict):
+def create_new_invitations(table, request_body: dict):
+    emails = request_body.get("emails")
+    print(f"bulk create of {len(emails) if isinstance(emails, list) else 0} emails")
+
+    if (
+        not isinstance(emails, list)
+        or not emails
+        or not all(isinstance(x, str) for x in emails)
+    ):
+        message = "'emails' must be a non-empty list of emails."
+        return build_response(
+            status_code=422,
+            success=False,
+            message=message,
+        )
+
+    if len(emails) > MAX_BULK_INVITATIONS:
+        message = f"At most {MAX_BULK_INVITATIONS} emails per request."
+        return build_response(
+            status_code=422,
+            success=False,
+            message=message,
+        )
+
+    invalid = [x for x in emails if not is_valid_email(x)]
+    if invalid:
+        message = f"{len(invalid)} invalid emails, e.g. {invalid[:5]}."
+        return build_response(
+            status_code=422,
+            success=False,
+            message=message,
+        )
+
+    time_ordered = time_ordered_codes_enabled()
+    invitations = [
+        generate_invitation(email=x, code=generate_code(time_ordered=time_ordered))
+        for x in emails
+    ]
+
+    try:
+        results = batch_create(
+            table,
+            invitations,
+            shard_count=get_status_shard_count(),
+            with_expiry_timer=expiry_timers_enabled(),
+            compact=compact_items_enabled(),
+        )
+        created = sum(results)
+        message = f"{created} of {len(invitations)} invitations created!"
+        print(message)
+
+        return build_response(
+            status_code=200,
+            success=created == len(invitations),
+            message=message,
+            data=[
+                {**x.__dict__, "success": success}
+                for x, success in zip(invitations, results)
+            ],
+        )
+
+    except Exception as e:
+        traceback.print_exc()
+
+        message = f"Error generating invitations. Err: {e}"
+        print(message)
+
+        return build_response(
+            status_code=500,
+            success=False,
+            message=message,
+            data=None,
+        )
+
+
+def __unchanged_message(
+    code: str, item: Union[None, dict], now: str
+) -> tuple[int, str]:
+    """
+    Status code and message for an invitation a conditional status update
+    left unchanged, given the item as it was (None if it does not exist).
+    """
+    if item is None:
+        return 404, f"Invite code: {code} is invalid or does not exist."
+
+    invite_status = effective_status(item["invite_status"], item["expiry_date"], now)
+    if invite_status == InvitationStatus.EXPIRED:
+        return 200, f"Invite code: {code} already expired."
+    if invite_status == InvitationStatus.CONFIRMED:
+        return 200, f"Invite code: {code} already confirmed."
+    if invite_status == InvitationStatus.INVALIDATED:
+        return 200, f"Invite code: {code} is invalidated."
+    return 200, f"Invite code: {code} is {invite_status}."
+
+
+def __transition_invitation(
+    table,
+    request_body: dict,
+    to_status: InvitationStatus,
+    action: str,
+):
+    """
+    Move an unconfirmed, unexpired invitation to `to_status` in a single
+    conditional write, the checks run in DynamoDB instead of a prior read,
+    so concurrent requests cannot both succeed.
+    """
     print(f"{request_body=}")
 
     try:
@@ -135,54 +571,193 @@ def confirm_invitation(table, request_body: dict):
     status_code = 200
 
     try:
-        data = query(table, email, code)
-        invitation = Invitation(**data[0]) if len(data) > 0 else None
-        if invitation is None or invitation.email != email:
-            message = f"Invite code: {code} is invalid or does not exist."
-            status_code = 404
+        updated, invitation = update_status(
+            table=table,
+            email=email,
+            code=code,
+            from_status=InvitationStatus.UNCONFIRMED,
+            to_status=to_status,
+            not_expired_at=now_utc,
+            shard_count=get_status_shard_count(),
+        )
+        if updated:
+            message = f"Invitate code: {code} status changed to {to_status.value}."
+        else:
+            status_code, message = __unchanged_message(code, invitation, now_utc)
+        # same payload either way, without storage-only attributes
+        if invitation is not None:
+            invitation = Invitation.from_item(invitation).__dict__
 
-        elif (
-            invitation.expiry_date < now_utc
-            or invitation.invite_status == InvitationStatus.EXPIRED
-        ):
-            message = f"Invite code: {code} already expired."
+        print(message)
+        print(invitation)
 
-        elif invitation.invite_status == InvitationStatus.CONFIRMED:
-            message = f"Invite code: {code} already confirmed."
+        return build_response(
+            status_code=status_code,
+            success=True,
+            message=message,
+            data=invitation,
+        )
 
-        elif invitation.invite_status == InvitationStatus.INVALIDATED:
-            message = f"Invite code: {code} is invalidated."
+    except Exception as e:
+        traceback.print_exc()
 
-        elif invitation.invite_status == InvitationStatus.EXPIRED:
-            message = f"Invite code: {code} already status."
+        message = f"Error {action} invitation. Err: {e}"
+        print(message)
 
-        else:
-            payload = {"invite_status": InvitationStatus.CONFIRMED}
-            invitation = update(
-                table=table,
-                email=email,
-                code=code,
-                payload=payload,
+        return build_response(
+            status_code=500,
+            success=False,
+            message=message,
+        )
+
+
+def confirm_invitation(table, request_body: dict):
+    return __transition_invitation(
+        table, request_body, InvitationStatus.CONFIRMED, "confirming"
+    )
+
+
+def invalidate_invitation(table, request_body: dict):
+    return __transition_invitation(
+        table, request_body, InvitationStatus.INVALIDATED, "invalidating"
+    )
+
+
+def __domain_keys(
+    table, email_domain: str, now: str, limit: int, start_key: dict = None
+) -> tuple[list[dict], Union[None, dict]]:
+    """
+    Keys of a page of the unconfirmed, unexpired invitations of an email
+    domain, whose emails are filtered by DynamoDB.
+    return (keys, next_start_key), the latter is None on the last page
+    """
+    email_domain = email_domain.lower()
+    items, last_key = __query_status_page(
+        table=table,
+        invite_statuses=[InvitationStatus.UNCONFIRMED],
+        shard_count=get_status_shard_count(),
+        limit=limit,
+        start_key=start_key,
+        now=now,
+        filter_expr=domain_filter(email_domain),
+        fields=["email", "code", "expiry_date"],
+    )
+    suffix = f"@{email_domain}"
+    keys = [
+        {"email": x["email"], "code": x["code"]}
+        for x in items
+        if x["email"].lower().endswith(suffix)
+    ]
+    return keys, last_key
+
+
+def __bulk_transition_invitations(
+    table,
+    request_body: dict,
+    to_status: InvitationStatus,
+    allow_filter: bool,
+    max_keys: int,
+):
+    """
+    `__transition_invitation` of many invitations, given as `keys`
+    (a list of at most `max_keys` email and code) or, if `allow_filter`,
+    as an `email_domain`, one page of at most `max_keys` per request:
+    the response's `next_token` is passed back for the next page.
+    With `transactional`, every group of up to 25 keys is all-or-nothing.
+    """
+    keys = request_body.get("keys")
+    email_domain = request_body.get("email_domain") if allow_filter else None
+    transactional = bool(request_body.get("transactional", False))
+    print(
+        f"bulk {to_status.value} of {email_domain or len(keys or [])} {transactional=}"
+    )
+
+    now_utc = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    t0 = time.time()
+    scope = f"{to_status.value}|{email_domain}|{get_status_shard_count()}"
+    last_key = None
+    try:
+        if email_domain is not None:
+            if not isinstance(email_domain, str) or not email_domain:
+                raise ValueError("'email_domain' must be a domain, e.g. gmail.com.")
+            keys, last_key = __domain_keys(
+                table,
+                email_domain,
+                now_utc,
+                limit=max_keys,
+                start_key=decode_next_token(request_body.get("next_token"), scope),
             )
-            message = f"Invitate code: {code} status changed to confirmed."
+        elif (
+            not isinstance(keys, list)
+            or not keys
+            or not all(
+                isinstance(x, dict)
+                and isinstance(x.get("email"), str)
+                and isinstance(x.get("code"), str)
+                for x in keys
+            )
+        ):
+            raise ValueError("'keys' must be a non-empty list of email and code.")
+        if len(keys) > max_keys:
+            raise ValueError(f"At most {max_keys} invitations per request.")
 
-        if isinstance(invitation, Invitation):
-            invitation = invitation.__dict__
+    except ValueError as e:
+        return build_response(
+            status_code=422,
+            success=False,
+            message=str(e),
+        )
 
-        print(message)
-        print(invitation)
+    try:
+        outcomes = bulk_update_status(
+            table=table,
+            keys=keys,
+            from_status=InvitationStatus.UNCONFIRMED,
+            to_status=to_status,
+            not_expired_at=now_utc,
+            shard_count=get_status_shard_count(),
+            transactional=transactional,
+        )
+
+        results = []
+        for key, outcome in zip(keys, outcomes):
+            code = key["code"]
+            if outcome["updated"]:
+                message = f"Invitate code: {code} status changed to {to_status.value}."
+            elif outcome["reason"] == "ConditionalCheckFailed":
+                _, message = __unchanged_message(code, outcome["item"], now_utc)
+            elif outcome["reason"] == "TransactionCancelled":
+                message = (
+                    f"Invite code: {code} unchanged, its transaction was cancelled."
+                )
+            else:
+                message = f"Invite code: {code} failed. Err: {outcome['reason']}"
+            results.append(
+                {
+                    "email": key["email"],
+                    "code": code,
+                    "success": outcome["updated"],
+                    "message": message,
+                }
+            )
+
+        updated = sum(x["success"] for x in results)
+        latency_ms = round((time.time() - t0) * 1000)
+        message = f"{updated} of {len(keys)} invitations {to_status.value}."
+        print(f"{message} took {latency_ms}ms")
 
         return build_response(
-            status_code=status_code,
+            status_code=200,
             success=True,
             message=message,
-            data=invitation,
+            data={"results": results, "updated": updated, "latency_ms": latency_ms},
+            next_token=encode_next_token(last_key, scope),
         )
 
     except Exception as e:
         traceback.print_exc()
 
-        message = f"Error confirming invitation. Err: {e}"
+        message = f"Error updating invitations. Err: {e}"
         print(message)
 
         return build_response(
@@ -192,11 +767,22 @@ def confirm_invitation(table, request_body: dict):
         )
 
 
-def invalidate_invitation(table, request_body: dict):
-    print(f"{request_body=}")
+def confirm_invitations(table, request_body: dict):
+    # protected route (PUT /invitation/bulk), only explicit keys
+    return __bulk_transition_invitations(
+        table,
+        request_body,
+        InvitationStatus.CONFIRMED,
+        allow_filter=False,
+        max_keys=MAX_BULK_CONFIRMATIONS,
+    )
+
 
-    return build_response(
-        status_code=200,
-        success=True,
-        message="Not implemented.",
+def invalidate_invitations(table, request_body: dict):
+    return __bulk_transition_invitations(
+        table,
+        request_body,
+        InvitationStatus.INVALIDATED,
+        allow_filter=True,
+        max_keys=MAX_BULK_INVITATIONS,
     )
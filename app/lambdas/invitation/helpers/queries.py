@@ -1,24 +1,346 @@
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+import heapq
+import math
+import os
+import random
+import threading
+import time
+from typing import Callable, Union
+import zlib
 
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, ConditionExpressionBuilder, Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 from botocore.exceptions import ClientError
 
-from .schemas import Invitation
+from .clients import get_client
+from .schemas import (
+    Invitation,
+    InvitationStatus,
+    COMPACT_CREATED_DATE,
+    COUNTER_CODE,
+    COUNTER_EMAIL_PREFIX,
+    COUNTER_SHARD_COUNT,
+    CHANGE_VERSION_ATTRIBUTE,
+    META_EMAIL,
+    PENDING_GSI_READY_CODE,
+    TIMER_EMAIL_PREFIX,
+    TIMER_TTL_ATTRIBUTE,
+    TIME_ORDERED_CODE_BOUND,
+    from_storage_item,
+    to_compact_item,
+)
+from .utils import LRUCache, TokenBucket
 
 
 # TODO table type hinting
 
+# max put/delete requests per BatchWriteItem call
+BATCH_WRITE_LIMIT = 25
+# writes per TransactWriteItems call, i.e. per all-or-nothing group
+TRANSACT_WRITE_LIMIT = 25
+# sort key prefix of migration checkpoints, under META_EMAIL
+MIGRATION_CODE_PREFIX = "migration#"
+
+# read-through cache of point reads, per warm container
+# kept in step with this container's writes, other writers show up within the TTL
+ITEM_CACHE = LRUCache(
+    max_size=int(os.environ.get("ITEM_CACHE_SIZE") or 1024),
+    ttl_seconds=float(os.environ.get("ITEM_CACHE_TTL_SECONDS") or 30),
+)
+
+# keep service bookkeeping items (META_EMAIL, expiry timers) out of
+# invitation listings, their partition keys all start with `#`
+NOT_META = ~Attr("email").begins_with(META_EMAIL[0])
+
+__serializer = TypeSerializer()
+__deserializer = TypeDeserializer()
+
+
+def decode_item(item: dict) -> dict:
+    """
+    Decode a low-level DynamoDB item. Invitation attributes are plain strings,
+    so `{"S": value}` is unwrapped directly, any other item falls back to
+    the generic TypeDeserializer. Compact items come back in the standard format.
+    """
+    try:
+        return from_storage_item(
+            {
+                k: v["N"] if k == COMPACT_CREATED_DATE else v["S"]
+                for k, v in item.items()
+            }
+        )
+    except KeyError:
+        return from_storage_item(
+            {k: __deserializer.deserialize(v) for k, v in item.items()}
+        )
+
+
+def encode_item(item: dict) -> dict:
+    return {k: __serializer.serialize(v) for k, v in item.items()}
+
+
+def __projected(fields: Union[None, list], *keys: str) -> Union[None, list]:
+    """
+    Attributes to read for `fields`: those plus the table key and `keys`,
+    the attributes paging relies on. None reads whole items.
+    """
+    if fields is None:
+        return None
+    return sorted({*fields, "email", "code", *keys})
+
+
+def __read(
+    table,
+    operation: str,
+    decoder: Callable[[dict], dict] = decode_item,
+    fields: list = None,
+    **kwargs,
+) -> dict:
+    """
+    `table.query` or `table.scan` (`operation`) through the low-level client:
+    same kwargs and response as the resource, but items are decoded by
+    `decoder` instead of the resource's generic per-attribute walk.
+    With `fields`, only those attributes are read (ProjectionExpression).
+    """
+    builder = ConditionExpressionBuilder()
+    names, values = {}, {}
+    if fields is not None:
+        if "created_date" in fields:
+            # stored under its short name in the compact format
+            fields = [*fields, COMPACT_CREATED_DATE]
+        projection = {f"#p{i}": name for i, name in enumerate(fields)}
+        kwargs["ProjectionExpression"] = ", ".join(projection)
+        names.update(projection)
+    for name, is_key_condition in (
+        ("KeyConditionExpression", True),
+        ("FilterExpression", False),
+    ):
+        if kwargs.get(name) is None:
+            continue
+        expr = builder.build_expression(kwargs[name], is_key_condition=is_key_condition)
+        kwargs[name] = expr.condition_expression
+        names.update(expr.attribute_name_placeholders)
+        values.update(expr.attribute_value_placeholders)
+    if names:
+        kwargs["ExpressionAttributeNames"] = names
+    if values:
+        kwargs["ExpressionAttributeValues"] = encode_item(values)
+    if kwargs.get("ExclusiveStartKey"):
+        kwargs["ExclusiveStartKey"] = encode_item(kwargs["ExclusiveStartKey"])
+
+    client = get_client("dynamodb")
+    resp = getattr(client, operation)(TableName=table.name, **kwargs)
+    resp["Items"] = [decoder(x) for x in resp.get("Items", [])]
+    if "LastEvaluatedKey" in resp:
+        resp["LastEvaluatedKey"] = decode_item(resp["LastEvaluatedKey"])
+    return resp
+
+
+def status_shard(invite_status: str, email: str, code: str, shard_count: int) -> str:
+    """
+    Partition key of the sharded status GSI, e.g. `unconfirmed#07`.
+    The shard only depends on the item key, so writers need no prior read.
+    """
+    invite_status = getattr(invite_status, "value", invite_status)
+    shard = zlib.crc32(f"{email}#{code}".encode()) % shard_count
+    return f"{invite_status}#{shard:02d}"
+
+
+def pending_shard(email: str, code: str, shard_count: int = 0) -> str:
+    """
+    Partition key of the sparse pending expiry GSI, e.g. `pending#03`.
+    Only unconfirmed invitations carry it, so the index holds nothing else.
+    """
+    return status_shard("pending", email, code, max(shard_count, 1))
+
+
+def __start_key(partition_key: str, item: dict) -> dict:
+    """
+    ExclusiveStartKey on a GSI partitioned by `partition_key` and sorted by
+    expiry_date, positioned right after `item`.
+    """
+    return {k: item[k] for k in (partition_key, "expiry_date", "email", "code")}
+
+
+def __expiry_condition(
+    expr,
+    expiry_before: str = None,
+    expiry_after: str = None,
+):
+    """
+    Narrow a GSI key condition to `expiry_after` <= expiry_date < `expiry_before`,
+    either bound is optional.
+    """
+    if expiry_before is not None and expiry_after is not None:
+        # BETWEEN is inclusive, dates are whole seconds
+        last = datetime.strptime(expiry_before, "%Y-%m-%dT%H:%M:%SZ")
+        last = (last - timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        expr &= Key("expiry_date").between(expiry_after, last)
+    elif expiry_before is not None:
+        expr &= Key("expiry_date").lt(expiry_before)
+    elif expiry_after is not None:
+        expr &= Key("expiry_date").gte(expiry_after)
+    return expr
+
+
+def __counter_key(shard: int) -> dict:
+    return {"email": f"{COUNTER_EMAIL_PREFIX}{shard:02d}", "code": COUNTER_CODE}
+
+
+def add_to_counters(table, deltas: dict, version: int = 0):
+    """
+    Atomically ADD `deltas` (invite_status -> change) to the per-status
+    counters, and `version` to the table change version, on one random
+    counter shard. Zero changes are left out.
+    """
+    deltas = {getattr(k, "value", k): v for k, v in deltas.items() if v}
+    if version:
+        deltas[CHANGE_VERSION_ATTRIBUTE] = version
+    if not deltas:
+        return
+
+    try:
+        table.update_item(
+            Key=__counter_key(random.randrange(COUNTER_SHARD_COUNT)),
+            UpdateExpression="ADD "
+            + ", ".join(f"#s{i} :s{i}" for i in range(len(deltas))),
+            ExpressionAttributeNames={f"#s{i}": k for i, k in enumerate(deltas)},
+            ExpressionAttributeValues={
+                f":s{i}": v for i, v in enumerate(deltas.values())
+            },
+        )
+
+    except ClientError as e:
+        print(f"Failed to update counters. Err: {e}")
+        raise
+
+
+def __record_change(table, deltas: dict = None, max_retries: int = 3):
+    # bump the change version and count status changes after the write
+    # they follow, which stands either way: counter drift is fixed by the
+    # scheduler's reconciliation, but a lost bump hides the write behind
+    # 304s until the next one, so it is retried and reported
+    for attempt in range(max_retries + 1):
+        try:
+            add_to_counters(table, deltas or {}, version=1)
+            return
+        except ClientError as e:
+            error = e
+            if attempt < max_retries:
+                time.sleep(min(0.05 * 2**attempt, 1))
+    print(
+        f"ERROR: Failed to bump the change version, conditional GETs may answer "
+        f"304 with stale data until the next write. {deltas=} Err: {error}"
+    )
+
+
+def __counter_items(table, consistent: bool = False) -> list[dict]:
+    keys = [encode_item(__counter_key(i)) for i in range(COUNTER_SHARD_COUNT)]
+    items = []
+    try:
+        client = get_client("dynamodb")
+        while keys:
+            resp = client.batch_get_item(
+                RequestItems={table.name: {"Keys": keys, "ConsistentRead": consistent}}
+            )
+            items.extend(decode_item(x) for x in resp["Responses"].get(table.name, []))
+            keys = resp.get("UnprocessedKeys", {}).get(table.name, {}).get("Keys", [])
+        return items
+
+    except ClientError as e:
+        print(f"Failed to get counters. Err: {e}")
+        raise
+
+
+def get_counters(table) -> dict:
+    """
+    Invitation count of every status, summed over the counter shards.
+    """
+    counts = {x.value: 0 for x in InvitationStatus}
+    for item in __counter_items(table):
+        for k, v in item.items():
+            if k not in ("email", "code", CHANGE_VERSION_ATTRIBUTE):
+                counts[k] = counts.get(k, 0) + int(v)
+    return counts
+
+
+def get_change_version(table) -> int:
+    """
+    Change version of the table, bumped after every write to invitations.
+    Strongly consistent, so it reflects every write acknowledged before.
+    """
+    return sum(
+        int(x.get(CHANGE_VERSION_ATTRIBUTE, 0))
+        for x in __counter_items(table, consistent=True)
+    )
+
+
+def key_filter(email: str = None, code: str = None):
+    """
+    FilterExpression condition on the table key attributes, for GSI queries,
+    None when neither is given.
+    """
+    conditions = [
+        Attr(name).eq(value)
+        for name, value in (("email", email), ("code", code))
+        if value is not None
+    ]
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return conditions[0] & conditions[1]
+
+
+def domain_filter(email_domain: str):
+    """
+    FilterExpression condition on emails at `email_domain`, e.g. `gmail.com`.
+    Also matches longer domains such as `gmail.com.au`, check the suffix.
+    """
+    return Attr("email").contains(f"@{email_domain}")
+
+
+def status_filter(phases: list[tuple]):
+    """
+    FilterExpression condition matching any of `phases`, given as
+    (invite_status, expiry_before, expiry_after), either bound optional.
+    None if every phase has an empty range.
+    """
+    condition = None
+    for status, expiry_before, expiry_after in phases:
+        if (
+            expiry_before is not None
+            and expiry_after is not None
+            and expiry_after >= expiry_before
+        ):
+            continue
+        phase = __expiry_condition(
+            Attr("invite_status").eq(status), expiry_before, expiry_after
+        )
+        condition = phase if condition is None else condition | phase
+    return condition
+
+
+def get_all(table, total_segments: int = 1, fields: list = None) -> list[Invitation]:
+    """
+    Scan the whole table. With `total_segments` > 1, the segments are
+    scanned concurrently and merged in segment order.
+    With `fields`, items only carry those and the table key attributes.
+    """
+    if total_segments > 1:
+        return __parallel_scan(table, total_segments, fields)
 
-def get_all(table) -> list[Invitation]:
     data = []
     done = False
     start_key = None
-    scan_kwargs = {}
+    scan_kwargs = {"FilterExpression": NOT_META, "fields": __projected(fields)}
     try:
         while not done:
             if start_key:
                 scan_kwargs["ExclusiveStartKey"] = start_key
-            response = table.scan(**scan_kwargs)
+            response = __read(table, "scan", **scan_kwargs)
             data.extend(response.get("Items", []))
             start_key = response.get("LastEvaluatedKey", None)
             done = start_key is None
@@ -29,7 +351,88 @@ def get_all(table) -> list[Invitation]:
         print(f"Failed to scan table. Err: {e}")
 
 
-def query(table, email: str, code: str = None) -> list[Invitation]:
+def __scan_segment(
+    table, segment: int, total_segments: int, fields: list = None
+) -> list[Invitation]:
+    data = []
+    scan_kwargs = {
+        "Segment": segment,
+        "TotalSegments": total_segments,
+        "FilterExpression": NOT_META,
+        "fields": __projected(fields),
+    }
+    while True:
+        response = __read(table, "scan", **scan_kwargs)
+        data.extend(response.get("Items", []))
+        start_key = response.get("LastEvaluatedKey")
+        if start_key is None:
+            return data
+        scan_kwargs["ExclusiveStartKey"] = start_key
+
+
+def __parallel_scan(
+    table, total_segments: int, fields: list = None
+) -> list[Invitation]:
+    try:
+        with ThreadPoolExecutor(max_workers=total_segments) as executor:
+            # `map` yields in submission order, so merge order is stable
+            segments = executor.map(
+                partial(
+                    __scan_segment,
+                    table,
+                    total_segments=total_segments,
+                    fields=fields,
+                ),
+                range(total_segments),
+            )
+            return [item for segment in segments for item in segment]
+
+    except ClientError as e:
+        print(f"Failed to scan table. Err: {e}")
+
+
+def __cache_key(table, email: str, code: str) -> tuple:
+    return (table.name, email, code)
+
+
+def __cache_invalidate(table, email: str, code: str):
+    """
+    Drop the key of a local write from ITEM_CACHE. The change version the
+    write lands in is not known here, so the item is not cached as written:
+    no read could be served it, see `get`.
+    """
+    ITEM_CACHE.invalidate(__cache_key(table, email, code))
+
+
+def get(table, email: str, code: str, min_version: int = None) -> Union[None, dict]:
+    """
+    Point read of one invitation with GetItem, through ITEM_CACHE.
+    With `min_version`, a change version read before this call, a cached
+    item is only served if it was read at that version or later, so it is
+    no older than anything an ETag of that version stands for.
+    return the item, or None if it does not exist
+    """
+    cache_key = __cache_key(table, email, code)
+    entry = ITEM_CACHE.get(cache_key)
+    if entry is not None:
+        version, item = entry
+        if min_version is None or (version is not None and version >= min_version):
+            return dict(item)
+
+    try:
+        resp = table.get_item(Key={"email": email, "code": code})
+
+    except ClientError as e:
+        print(f"Failed to get table item. Err: {e}")
+        raise
+
+    item = from_storage_item(resp.get("Item"))
+    if item is not None:
+        ITEM_CACHE.put(cache_key, (min_version, dict(item)))
+    return item
+
+
+def query(table, email: str, code: str = None, fields: list = None) -> list[Invitation]:
     data = []
     start_key = None
     try:
@@ -37,14 +440,20 @@ def query(table, email: str, code: str = None) -> list[Invitation]:
         if code is not None:
             expr &= Key("code").eq(code)
 
-        resp = table.query(
+        resp = __read(
+            table,
+            "query",
+            fields=__projected(fields),
             KeyConditionExpression=expr,
         )
         data.extend(resp["Items"])
         start_key = resp.get("LastEvaluatedKey")
 
         while start_key:
-            resp = table.query(
+            resp = __read(
+                table,
+                "query",
+                fields=__projected(fields),
                 KeyConditionExpression=expr,
                 ExclusiveStartKey=start_key,
             )
@@ -57,12 +466,71 @@ def query(table, email: str, code: str = None) -> list[Invitation]:
         print(f"Failed to query table. Err: {e}")
 
 
-def query_by_gsi(table, gsi_name: str, invite_status: str) -> list[Invitation]:
+def query_latest(
+    table, email: str, filter_expr=None, fields: list = None
+) -> Union[None, dict]:
+    """
+    Newest invitation of `email` matching `filter_expr`, None if there is none.
+    Time-ordered codes sort by creation, so the newest one is the first read
+    backwards from TIME_ORDERED_CODE_BOUND: one Query with Limit=1 when
+    unfiltered. Legacy codes carry no order, they are only read, and compared
+    by created_date, when no time-ordered code of the email matches.
+    """
+    newest_first = {
+        "KeyConditionExpression": Key("email").eq(email)
+        & Key("code").lt(TIME_ORDERED_CODE_BOUND),
+        "ScanIndexForward": False,
+        "fields": __projected(fields, "created_date"),
+    }
+    if filter_expr is not None:
+        newest_first["FilterExpression"] = filter_expr
+    else:
+        newest_first["Limit"] = 1
+    legacy = {
+        "KeyConditionExpression": Key("email").eq(email)
+        & Key("code").gte(TIME_ORDERED_CODE_BOUND),
+        "fields": __projected(fields, "created_date"),
+    }
+    if filter_expr is not None:
+        legacy["FilterExpression"] = filter_expr
+
+    try:
+        while True:
+            resp = __read(table, "query", **newest_first)
+            if resp["Items"]:
+                return resp["Items"][0]
+            if "LastEvaluatedKey" not in resp:
+                break
+            newest_first["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+        data = []
+        while True:
+            resp = __read(table, "query", **legacy)
+            data.extend(resp["Items"])
+            if "LastEvaluatedKey" not in resp:
+                break
+            legacy["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+        return max(data, key=lambda x: x["created_date"], default=None)
+
+    except ClientError as e:
+        print(f"Failed to query table. Err: {e}")
+        raise
+
+
+def query_by_gsi(
+    table,
+    gsi_name: str,
+    invite_status: str,
+    fields: list = None,
+) -> list[Invitation]:
     data = []
     start_key = None
     try:
         expr = Key("invite_status").eq(invite_status)
-        resp = table.query(
+        resp = __read(
+            table,
+            "query",
+            fields=__projected(fields, "invite_status", "expiry_date"),
             IndexName=gsi_name,
             KeyConditionExpression=expr,
         )
@@ -70,7 +538,10 @@ def query_by_gsi(table, gsi_name: str, invite_status: str) -> list[Invitation]:
         start_key = resp.get("LastEvaluatedKey")
 
         while start_key:
-            resp = table.query(
+            resp = __read(
+                table,
+                "query",
+                fields=__projected(fields, "invite_status", "expiry_date"),
                 IndexName=gsi_name,
                 KeyConditionExpression=expr,
                 ExclusiveStartKey=start_key,
@@ -84,8 +555,246 @@ def query_by_gsi(table, gsi_name: str, invite_status: str) -> list[Invitation]:
         print(f"Failed to query table. Err: {e}")
 
 
-def update(table, email: str, code: str, payload: dict) -> Union[None, Invitation]:
-    update_expr, expr_attr_value = __generate_update_expr(payload)
+def get_page(
+    table,
+    limit: int,
+    start_key: dict = None,
+    fields: list = None,
+) -> tuple[list[Invitation], Union[None, dict]]:
+    """
+    Scan a single page of at most `limit` items, starting after `start_key`.
+    return (items, last_evaluated_key), the latter is None on the last page
+    """
+    scan_kwargs = {
+        "Limit": limit,
+        "FilterExpression": NOT_META,
+        "fields": __projected(fields),
+    }
+    if start_key:
+        scan_kwargs["ExclusiveStartKey"] = start_key
+
+    try:
+        resp = __read(table, "scan", **scan_kwargs)
+        return resp.get("Items", []), resp.get("LastEvaluatedKey")
+
+    except ClientError as e:
+        print(f"Failed to scan table. Err: {e}")
+        raise
+
+
+def get_parallel_page(
+    table,
+    limit: int,
+    total_segments: int,
+    start_keys: list = None,
+    fields: list = None,
+) -> tuple[list[Invitation], Union[None, list]]:
+    """
+    Scan a single page of roughly `limit` items, split over `total_segments`
+    segments scanned concurrently.
+    `start_keys` holds one entry per segment: the segment's LastEvaluatedKey,
+    or None once the segment is exhausted. Pass None to start a fresh scan.
+    return (items, next_start_keys), the latter is None when all segments are done
+    """
+    if start_keys is None:
+        start_keys = [{}] * total_segments
+    if len(start_keys) != total_segments:
+        raise ValueError(f"Expected {total_segments} segment keys.")
+
+    # spread `limit` over as many unfinished segments as it allows,
+    # the remaining segments are picked up by the following pages
+    active = [i for i, key in enumerate(start_keys) if key is not None][:limit]
+    segment_limit = limit // max(len(active), 1)
+
+    def scan_segment(segment: int):
+        start_key = start_keys[segment]
+        if segment not in active:
+            return [], start_key
+
+        scan_kwargs = {
+            "Segment": segment,
+            "TotalSegments": total_segments,
+            "Limit": segment_limit,
+            "FilterExpression": NOT_META,
+            "fields": __projected(fields),
+        }
+        if start_key:
+            scan_kwargs["ExclusiveStartKey"] = start_key
+        resp = __read(table, "scan", **scan_kwargs)
+        return resp.get("Items", []), resp.get("LastEvaluatedKey")
+
+    try:
+        with ThreadPoolExecutor(max_workers=total_segments) as executor:
+            results = list(executor.map(scan_segment, range(total_segments)))
+
+    except ClientError as e:
+        print(f"Failed to scan table. Err: {e}")
+        raise
+
+    data = [item for items, _ in results for item in items]
+    next_start_keys = [last_key for _, last_key in results]
+    if all(last_key is None for last_key in next_start_keys):
+        next_start_keys = None
+    return data, next_start_keys
+
+
+def query_page(
+    table,
+    email: str,
+    code: str = None,
+    limit: int = None,
+    start_key: dict = None,
+    fields: list = None,
+) -> tuple[list[Invitation], Union[None, dict]]:
+    """
+    Query a single page of invitations by email (and code).
+    return (items, last_evaluated_key), the latter is None on the last page
+    """
+    expr = Key("email").eq(email)
+    if code is not None:
+        expr &= Key("code").eq(code)
+
+    query_kwargs = {"KeyConditionExpression": expr, "fields": __projected(fields)}
+    if limit:
+        query_kwargs["Limit"] = limit
+    if start_key:
+        query_kwargs["ExclusiveStartKey"] = start_key
+
+    try:
+        resp = __read(table, "query", **query_kwargs)
+        return resp["Items"], resp.get("LastEvaluatedKey")
+
+    except ClientError as e:
+        print(f"Failed to query table. Err: {e}")
+        raise
+
+
+def query_by_gsi_merged_page(
+    table,
+    gsi_name: str,
+    partition_key: str,
+    partitions: list[tuple],
+    limit: int,
+    start_keys: list = None,
+    filter_expr=None,
+    descending: bool = False,
+    fields: list = None,
+) -> tuple[list[Invitation], Union[None, list]]:
+    """
+    Query a single page of invitations over several partitions of a GSI
+    sorted by expiry_date, merged by expiry_date (descending if `descending`).
+    `partitions` are (partition_key value, expiry_before, expiry_after), each
+    within `expiry_after` <= expiry_date < `expiry_before`, either bound optional.
+    Every partition is queried concurrently for at most `limit` items and the
+    sorted results are merged with a streaming heap merge, so the first
+    `limit` items across partitions are found without reading them all.
+    `start_keys` holds one entry per partition: where to continue from,
+    or None once the partition is exhausted. Pass None to start from the top.
+    return (items, next_start_keys), the latter is None when all partitions are done
+    """
+    if start_keys is None:
+        start_keys = [{}] * len(partitions)
+    if len(start_keys) != len(partitions):
+        raise ValueError(f"Expected {len(partitions)} partition keys.")
+
+    def query_partition(partition: int):
+        start_key = start_keys[partition]
+        value, expiry_before, expiry_after = partitions[partition]
+        if start_key is None or (
+            expiry_before is not None
+            and expiry_after is not None
+            and expiry_after >= expiry_before
+        ):
+            # exhausted, or nothing in range
+            return [], None
+
+        query_kwargs = {
+            "IndexName": gsi_name,
+            "KeyConditionExpression": __expiry_condition(
+                Key(partition_key).eq(value), expiry_before, expiry_after
+            ),
+            "ScanIndexForward": not descending,
+            # the index key, to merge by expiry_date and continue each partition
+            "fields": __projected(fields, partition_key, "expiry_date"),
+        }
+        if filter_expr is not None:
+            # Limit counts items before the filter, read whole pages instead
+            query_kwargs["FilterExpression"] = filter_expr
+        else:
+            query_kwargs["Limit"] = limit
+        if start_key:
+            query_kwargs["ExclusiveStartKey"] = start_key
+        resp = __read(table, "query", **query_kwargs)
+        return resp["Items"], resp.get("LastEvaluatedKey")
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(partitions), 1)) as executor:
+            results = list(executor.map(query_partition, range(len(partitions))))
+
+    except ClientError as e:
+        print(f"Failed to query table. Err: {e}")
+        raise
+
+    merged = heapq.merge(
+        *[
+            [(partition, item) for item in items]
+            for partition, (items, _) in enumerate(results)
+        ],
+        key=lambda x: x[1]["expiry_date"],
+        reverse=descending,
+    )
+    # a partition that stopped short of `limit` items (filtered out, or past
+    # 1 MB) has only been read up to its last evaluated key, items of the
+    # other partitions beyond it wait for the next page
+    bounds = [last_key["expiry_date"] for _, last_key in results if last_key]
+    bound = (min if not descending else max)(bounds) if bounds else None
+    page = []
+    for partition_item in merged:
+        expiry_date = partition_item[1]["expiry_date"]
+        if len(page) == limit:
+            break
+        if bound is not None and (
+            expiry_date < bound if descending else expiry_date > bound
+        ):
+            break
+        page.append(partition_item)
+
+    # each partition continues right after the last of its items on this page
+    next_start_keys = list(start_keys)
+    emitted = {}
+    for partition, item in page:
+        emitted[partition] = emitted.get(partition, 0) + 1
+        next_start_keys[partition] = __start_key(partition_key, item)
+    for partition, (items, last_key) in enumerate(results):
+        fully_emitted = emitted.get(partition, 0) == len(items)
+        if start_keys[partition] is not None and fully_emitted:
+            next_start_keys[partition] = last_key
+
+    if all(key is None for key in next_start_keys):
+        next_start_keys = None
+    return [item for _, item in page], next_start_keys
+
+
+def update(
+    table,
+    email: str,
+    code: str,
+    payload: dict,
+    shard_count: int = 0,
+) -> Union[None, Invitation]:
+    remove = []
+    if "invite_status" in payload:
+        if shard_count:
+            payload = {
+                **payload,
+                "status_shard": status_shard(
+                    payload["invite_status"], email, code, shard_count
+                ),
+            }
+        # resolved invitations leave the sparse pending expiry GSI
+        if payload["invite_status"] != InvitationStatus.UNCONFIRMED:
+            remove.append("pending_shard")
+    update_expr, expr_attr_value = __generate_update_expr(payload, remove=remove)
 
     try:
         resp = table.update_item(
@@ -95,8 +804,11 @@ def update(table, email: str, code: str, payload: dict) -> Union[None, Invitatio
             ReturnValues="ALL_NEW",
             ConditionExpression="attribute_exists(email) AND attribute_exists(code)",
         )
+        item = from_storage_item(resp["Attributes"])
+        __cache_invalidate(table, email, code)
+        __record_change(table)
         #  TODO convert to `Invitation`?
-        return resp["Attributes"]
+        return item
 
     except ClientError as e:
         if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
@@ -106,27 +818,685 @@ def update(table, email: str, code: str, payload: dict) -> Union[None, Invitatio
             print(f"Failed to update table item. Err: {e}")
 
 
-def create(table, payload: Invitation):
+def __status_update_kwargs(
+    email: str,
+    code: str,
+    from_status: str,
+    to_status: str,
+    not_expired_at: str = None,
+    shard_count: int = 0,
+) -> dict:
+    """
+    Key and expressions of a conditional status transition, see `update_status`.
+    """
+    update_expr = "SET invite_status=:to_status"
+    condition_expr = "invite_status = :from_status"
+    expr_attr_value = {
+        ":to_status": getattr(to_status, "value", to_status),
+        ":from_status": getattr(from_status, "value", from_status),
+    }
+    if shard_count:
+        update_expr += ", status_shard=:status_shard"
+        expr_attr_value[":status_shard"] = status_shard(
+            to_status, email, code, shard_count
+        )
+    if to_status != InvitationStatus.UNCONFIRMED:
+        # resolved invitations leave the sparse pending expiry GSI
+        update_expr += " REMOVE pending_shard"
+    if not_expired_at is not None:
+        condition_expr += " AND expiry_date >= :now"
+        expr_attr_value[":now"] = not_expired_at
+
+    return {
+        "Key": {"email": email, "code": code},
+        "UpdateExpression": update_expr,
+        "ConditionExpression": condition_expr,
+        "ExpressionAttributeValues": expr_attr_value,
+        "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+    }
+
+
+def __deserialize(item: Union[None, dict]) -> Union[None, dict]:
+    # items in error responses are not deserialized by the resource,
+    # unlike the ones in successful responses
+    return None if item is None else decode_item(item)
+
+
+def update_status(
+    table,
+    email: str,
+    code: str,
+    from_status: str,
+    to_status: str,
+    not_expired_at: str = None,
+    shard_count: int = 0,
+) -> tuple[bool, Union[None, dict]]:
+    """
+    Move an invitation from `from_status` to `to_status` in one conditional
+    UpdateItem, also requiring expiry_date >= `not_expired_at` if given.
+    A failed condition returns the item as it was, so callers can tell
+    why without a prior read.
+    return (updated, item): the updated item, or the unchanged item
+    (None if it does not exist) when the condition failed
+    """
+    updated, item = __update_status(
+        table, email, code, from_status, to_status, not_expired_at, shard_count
+    )
+    if updated:
+        __record_change(table, {from_status: -1, to_status: 1})
+    return updated, item
+
+
+def __update_status(
+    table,
+    email: str,
+    code: str,
+    from_status: str,
+    to_status: str,
+    not_expired_at: str = None,
+    shard_count: int = 0,
+) -> tuple[bool, Union[None, dict]]:
+    # `update_status` without counting the transition
     try:
+        resp = table.update_item(
+            **__status_update_kwargs(
+                email, code, from_status, to_status, not_expired_at, shard_count
+            ),
+            ReturnValues="ALL_NEW",
+        )
+        item = from_storage_item(resp["Attributes"])
+        __cache_invalidate(table, email, code)
+        return True, item
+
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            print(f"Failed to update table item. Err: {e}")
+            __cache_invalidate(table, email, code)
+            raise
+
+        # the item as it is now, no second read needed
+        item = __deserialize(e.response.get("Item"))
+        __cache_invalidate(table, email, code)
+        return False, item
+
+
+def bulk_update_status(
+    table,
+    keys: list[dict],
+    from_status: str,
+    to_status: str,
+    not_expired_at: str = None,
+    shard_count: int = 0,
+    transactional: bool = False,
+    max_workers: int = 8,
+) -> list[dict]:
+    """
+    `update_status` of many invitations, in chunks of TRANSACT_WRITE_LIMIT
+    keys processed concurrently. With `transactional`, each chunk is applied
+    all-or-nothing in one TransactWriteItems call.
+    return per key {"updated", "item", "reason"}, in the order of `keys`:
+    `reason` is None when updated, "ConditionalCheckFailed" with the unchanged
+    `item` (None if it does not exist), "TransactionCancelled" for keys rolled
+    back with their chunk, or the error code of a failed request
+    """
+    chunks = [
+        keys[i : i + TRANSACT_WRITE_LIMIT]
+        for i in range(0, len(keys), TRANSACT_WRITE_LIMIT)
+    ]
+    apply_chunk = partial(
+        __transact_update_status if transactional else __update_status_chunk,
+        table,
+        from_status=from_status,
+        to_status=to_status,
+        not_expired_at=not_expired_at,
+        shard_count=shard_count,
+    )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(apply_chunk, chunks)
+        outcomes = [outcome for outcomes in results for outcome in outcomes]
+
+    # one counter update for the whole request
+    updated = sum(x["updated"] for x in outcomes)
+    if updated:
+        __record_change(table, {from_status: -updated, to_status: updated})
+    return outcomes
+
+
+def __update_status_chunk(table, keys: list[dict], **kwargs) -> list[dict]:
+    outcomes = []
+    for key in keys:
+        try:
+            updated, item = __update_status(table, key["email"], key["code"], **kwargs)
+            reason = None if updated else "ConditionalCheckFailed"
+            outcomes.append({"updated": updated, "item": item, "reason": reason})
+        except ClientError as e:
+            outcomes.append(
+                {"updated": False, "item": None, "reason": e.response["Error"]["Code"]}
+            )
+    return outcomes
+
+
+def __transact_update_status(table, keys: list[dict], **kwargs) -> list[dict]:
+    for key in keys:
+        __cache_invalidate(table, key["email"], key["code"])
+
+    try:
+        table.meta.client.transact_write_items(
+            TransactItems=[
+                {
+                    "Update": {
+                        "TableName": table.name,
+                        **__status_update_kwargs(key["email"], key["code"], **kwargs),
+                    }
+                }
+                for key in keys
+            ]
+        )
+        return [{"updated": True, "item": None, "reason": None} for _ in keys]
+
+    except ClientError as e:
+        error_code = e.response["Error"]["Code"]
+        print(f"Failed to transact update table items. Err: {e}")
+        reasons = e.response.get("CancellationReasons")
+        if error_code != "TransactionCanceledException" or not reasons:
+            return [
+                {"updated": False, "item": None, "reason": error_code} for _ in keys
+            ]
+
+        # reasons are in the same order as the keys
+        outcomes = []
+        for reason in reasons:
+            code = reason.get("Code", "None")
+            outcomes.append(
+                {
+                    "updated": False,
+                    "item": __deserialize(reason.get("Item")),
+                    "reason": "TransactionCancelled" if code == "None" else code,
+                }
+            )
+        return outcomes
+
+
+def expiry_timer(email: str, code: str, expiry_date: str) -> dict:
+    """
+    Companion item of an unconfirmed invitation, deleted by DynamoDB TTL
+    once `expiry_date` has passed. The deletion lands on the table stream,
+    where the expiry stream processor of the scheduler picks it up.
+    """
+    expires_at = datetime.strptime(expiry_date, "%Y-%m-%dT%H:%M:%SZ")
+    return {
+        "email": f"{TIMER_EMAIL_PREFIX}{email}",
+        "code": code,
+        TIMER_TTL_ATTRIBUTE: int(expires_at.replace(tzinfo=timezone.utc).timestamp()),
+    }
+
+
+def __item_for_create(
+    payload: Invitation,
+    shard_count: int = 0,
+    compact: bool = False,
+) -> dict:
+    """
+    Table item of a new invitation, with its GSI shard keys,
+    in the compact storage format if `compact`.
+    """
+    item = to_compact_item(payload.__dict__) if compact else payload.__dict__
+    if shard_count:
+        item = {
+            **item,
+            "status_shard": status_shard(
+                payload.invite_status, payload.email, payload.code, shard_count
+            ),
+        }
+    if payload.invite_status == InvitationStatus.UNCONFIRMED:
+        item = {
+            **item,
+            "pending_shard": pending_shard(payload.email, payload.code, shard_count),
+        }
+    return item
+
+
+def create(
+    table,
+    payload: Invitation,
+    shard_count: int = 0,
+    with_expiry_timer: bool = False,
+    compact: bool = False,
+):
+    item = __item_for_create(payload, shard_count, compact)
+
+    try:
+        if with_expiry_timer and payload.invite_status == InvitationStatus.UNCONFIRMED:
+            # both items in one BatchWriteItem round trip, unprocessed ones are resent
+            with table.batch_writer() as batch:
+                batch.put_item(Item=item)
+                batch.put_item(
+                    Item=expiry_timer(payload.email, payload.code, payload.expiry_date)
+                )
+            __cache_invalidate(table, payload.email, payload.code)
+            __record_change(table, {payload.invite_status: 1})
+            return True
+
         resp = table.put_item(
-            Item=payload.__dict__,
+            Item=item,
             ReturnValues="NONE",
         )
+        __cache_invalidate(table, payload.email, payload.code)
+        __record_change(table, {payload.invite_status: 1})
         return resp["ResponseMetadata"]["HTTPStatusCode"] == 200
 
     except ClientError as e:
         print(f"Failed to create new table item. Err: {e}")
 
 
-def __generate_update_expr(payload: dict):
+def batch_create(
+    table,
+    payloads: list[Invitation],
+    shard_count: int = 0,
+    with_expiry_timer: bool = False,
+    compact: bool = False,
+    max_retries: int = 5,
+    max_workers: int = 8,
+) -> list[bool]:
+    """
+    Write many new invitations with BatchWriteItem, BATCH_WRITE_LIMIT
+    requests per call and up to `max_workers` calls in flight.
+    Unprocessed items are resent with backoff, up to `max_retries` times.
+    return whether each of `payloads` was written, in the same order
+    """
+    requests = [
+        {"PutRequest": {"Item": __item_for_create(payload, shard_count, compact)}}
+        for payload in payloads
+    ]
+    if with_expiry_timer:
+        requests += [
+            {"PutRequest": {"Item": expiry_timer(x.email, x.code, x.expiry_date)}}
+            for x in payloads
+            if x.invite_status == InvitationStatus.UNCONFIRMED
+        ]
+    chunks = [
+        requests[i : i + BATCH_WRITE_LIMIT]
+        for i in range(0, len(requests), BATCH_WRITE_LIMIT)
+    ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            partial(__batch_write, table, max_retries=max_retries), chunks
+        )
+        failed = {(x["email"], x["code"]) for items in results for x in items}
+
+    written = [(x.email, x.code) not in failed for x in payloads]
+    deltas = {}
+    for payload, success in zip(payloads, written):
+        if success:
+            deltas[payload.invite_status] = deltas.get(payload.invite_status, 0) + 1
+    if deltas:
+        __record_change(table, deltas)
+    return written
+
+
+def __batch_write(table, requests: list[dict], max_retries: int) -> list[dict]:
+    """
+    Send one chunk of BatchWriteItem put requests, resending unprocessed ones.
+    return items that could not be written
+    """
+    pending = requests
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            time.sleep(0.05 * 2**attempt)
+
+        try:
+            resp = table.meta.client.batch_write_item(
+                RequestItems={table.name: pending}
+            )
+            pending = resp.get("UnprocessedItems", {}).get(table.name, [])
+
+        except ClientError as e:
+            # whole request failed (e.g. throttled), resend as is
+            print(f"Failed to batch write table items. Err: {e}")
+
+        if not pending:
+            break
+
+    if pending:
+        print(f"Failed to write {len(pending)} items after {max_retries} retries.")
+    return [x["PutRequest"]["Item"] for x in pending]
+
+
+def backfill_status_shards(
+    table,
+    shard_count: int,
+    total_segments: int = 4,
+    wcu_per_second: float = 0,
+) -> int:
+    """
+    Set `status_shard` on every invitation written before sharding was on
+    (or with a different shard count), so the sharded GSI sees all of them.
+    Safe to re-run, items that are already correct are skipped.
+    return number of items updated
+    """
+
+    def transform(item: dict) -> dict:
+        return {
+            "status_shard": status_shard(
+                item["invite_status"], item["email"], item["code"], shard_count
+            )
+        }
+
+    stats = migrate(
+        table,
+        f"status_shards#{shard_count}",
+        transform,
+        total_segments=total_segments,
+        wcu_per_second=wcu_per_second,
+    )
+    return stats["updated"]
+
+
+def backfill_pending_shards(
+    table,
+    shard_count: int = 0,
+    total_segments: int = 4,
+    wcu_per_second: float = 0,
+) -> int:
+    """
+    Set `pending_shard` on every unconfirmed invitation written before the
+    pending expiry GSI existed, and drop it from resolved ones.
+    Once every item is done, the PENDING_GSI_READY_CODE marker switches the
+    scheduler over to the pending expiry GSI, which until then would miss
+    the invitations not backfilled yet.
+    Safe to re-run, items that are already correct are skipped.
+    return number of items updated
+    """
+
+    def transform(item: dict) -> dict:
+        if item["invite_status"] != InvitationStatus.UNCONFIRMED:
+            return {"pending_shard": None}
+        return {
+            "pending_shard": pending_shard(item["email"], item["code"], shard_count)
+        }
+
+    stats = migrate(
+        table,
+        f"pending_shards#{shard_count}",
+        transform,
+        total_segments=total_segments,
+        wcu_per_second=wcu_per_second,
+    )
+    try:
+        table.put_item(
+            Item={
+                "email": META_EMAIL,
+                "code": PENDING_GSI_READY_CODE,
+                "shard_count": shard_count,
+            }
+        )
+
+    except ClientError as e:
+        print(f"Failed to mark the pending expiry GSI ready. Err: {e}")
+        raise
+    return stats["updated"]
+
+
+def compact_items(table, total_segments: int = 4, wcu_per_second: float = 0) -> int:
+    """
+    Rewrite every invitation in the compact storage format, see
+    COMPACT_CREATED_DATE. Safe to re-run, compact items are skipped.
+    return number of items updated
+    """
+
+    def transform(item: dict) -> dict:
+        if "created_date" not in item:
+            return {}
+        compact = to_compact_item({"created_date": item["created_date"]})
+        return {"created_date": None, **compact}
+
+    stats = migrate(
+        table,
+        "compact_items",
+        transform,
+        total_segments=total_segments,
+        wcu_per_second=wcu_per_second,
+    )
+    return stats["updated"]
+
+
+def __migration_key(name: str) -> dict:
+    return {"email": META_EMAIL, "code": f"{MIGRATION_CODE_PREFIX}{name}"}
+
+
+def get_migration_checkpoint(table, name: str) -> Union[None, dict]:
+    """
+    Get the scan position left behind by an unfinished run of migration `name`.
+    """
+    try:
+        resp = table.get_item(Key=__migration_key(name), ConsistentRead=True)
+        return resp.get("Item")
+
+    except ClientError as e:
+        print(f"Failed to get migration checkpoint. Err: {e}")
+        raise
+
+
+def put_migration_checkpoint(table, name: str, checkpoint: dict):
+    try:
+        table.put_item(Item={**checkpoint, **__migration_key(name)})
+
+    except ClientError as e:
+        print(f"Failed to put migration checkpoint. Err: {e}")
+        raise
+
+
+def delete_migration_checkpoint(table, name: str):
+    try:
+        table.delete_item(Key=__migration_key(name))
+
+    except ClientError as e:
+        print(f"Failed to delete migration checkpoint. Err: {e}")
+        raise
+
+
+def __decode_stored_item(item: dict) -> dict:
+    # migrations see items as stored, whatever their format
+    return {k: __deserializer.deserialize(v) for k, v in item.items()}
+
+
+def __write_units(item: dict) -> int:
+    # 1 WCU per started KB, attribute names and values as their string length
+    size = sum(len(k) + len(str(v)) for k, v in item.items())
+    return max(1, math.ceil(size / 1024))
+
+
+def __migration_update_kwargs(item: dict, changes: dict) -> dict:
+    """
+    UpdateItem kwargs applying `changes` to `item` (None removes the
+    attribute), conditional on `item` being unchanged since it was read.
+    """
+    names, values, conditions = {}, {}, []
+    for i, (k, v) in enumerate(item.items()):
+        names[f"#a{i}"] = k
+        values[f":a{i}"] = v
+        conditions.append(f"#a{i} = :a{i}")
+
+    set_exprs, remove_exprs = [], []
+    for i, (k, v) in enumerate(changes.items()):
+        names[f"#c{i}"] = k
+        if k not in item:
+            conditions.append(f"attribute_not_exists(#c{i})")
+        if v is None:
+            remove_exprs.append(f"#c{i}")
+        else:
+            values[f":c{i}"] = v
+            set_exprs.append(f"#c{i} = :c{i}")
+
+    update_expr = []
+    if set_exprs:
+        update_expr.append("SET " + ", ".join(set_exprs))
+    if remove_exprs:
+        update_expr.append("REMOVE " + ", ".join(remove_exprs))
+    return {
+        "Key": {"email": item["email"], "code": item["code"]},
+        "UpdateExpression": " ".join(update_expr),
+        "ConditionExpression": " AND ".join(conditions),
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": values,
+        "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+    }
+
+
+def __migrate_item(
+    table,
+    item: dict,
+    transform: Callable[[dict], dict],
+    rate_limiter: TokenBucket,
+    max_retries: int,
+) -> tuple[str, float]:
+    """
+    Apply `transform` to one stored item, see `migrate`.
+    return (outcome, seconds spent waiting for the WCU budget)
+    """
+    waited = 0.0
+    for _ in range(max_retries + 1):
+        changes = {k: v for k, v in (transform(item) or {}).items() if item.get(k) != v}
+        if not changes:
+            return "unchanged", waited
+
+        waited += rate_limiter.acquire(__write_units({**item, **changes}))
+        try:
+            table.update_item(**__migration_update_kwargs(item, changes))
+            return "updated", waited
+
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            # written meanwhile, transform the item as it is now
+            item = e.response.get("Item")
+
+        if item is None:
+            return "deleted", waited
+        item = __decode_stored_item(item)
+
+    return "conflicts", waited
+
+
+def migrate(
+    table,
+    name: str,
+    transform: Callable[[dict], dict],
+    total_segments: int = 4,
+    wcu_per_second: float = 0,
+    page_size: int = None,
+    max_retries: int = 3,
+) -> dict:
+    """
+    Online migration of every invitation: a parallel scan of `total_segments`
+    segments applying the attribute changes `transform` returns for each
+    item, as stored (None removes an attribute, unchanged values are skipped).
+    Each write is conditional on the item being unchanged since it was read.
+    An item written meanwhile is transformed again as it is now, up to
+    `max_retries` times, so `transform` must only derive from the item.
+    Writes, checkpoints included, are capped at `wcu_per_second` (0 for no cap).
+    The position of every segment is checkpointed under `name` after each
+    page, so a failed or interrupted run resumes where it left off.
+    The checkpoint is removed once every segment is done.
+    return stats, including items scanned per second
+    """
+    checkpoint = get_migration_checkpoint(table, name)
+    if checkpoint:
+        total_segments = int(checkpoint["total_segments"])
+        segments = checkpoint["segments"]
+        print(
+            f"Resuming migration {name} with "
+            f"{sum(x['done'] for x in segments)}/{total_segments} segments done"
+        )
+    else:
+        segments = [{"start_key": None, "done": False} for _ in range(total_segments)]
+
+    stats = {
+        "scanned": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "deleted": 0,
+        "conflicts": 0,
+        "rate_limited_seconds": 0.0,
+    }
+    rate_limiter = TokenBucket(rate=wcu_per_second)
+    lock = threading.Lock()
+    t0 = time.time()
+
+    def migrate_segment(segment: int):
+        state = segments[segment]
+        scan_kwargs = {
+            "Segment": segment,
+            "TotalSegments": total_segments,
+            "FilterExpression": NOT_META & Attr("invite_status").exists(),
+        }
+        if page_size:
+            scan_kwargs["Limit"] = page_size
+
+        while not state["done"]:
+            if state["start_key"]:
+                scan_kwargs["ExclusiveStartKey"] = state["start_key"]
+            resp = __read(table, "scan", decoder=__decode_stored_item, **scan_kwargs)
+            outcomes = [
+                __migrate_item(table, item, transform, rate_limiter, max_retries)
+                for item in resp["Items"]
+            ]
+            waited = rate_limiter.acquire(1)
+
+            with lock:
+                stats["scanned"] += len(outcomes)
+                for outcome, item_waited in outcomes:
+                    stats[outcome] += 1
+                    stats["rate_limited_seconds"] += item_waited
+                stats["rate_limited_seconds"] += waited
+
+                state["start_key"] = resp.get("LastEvaluatedKey")
+                state["done"] = state["start_key"] is None
+                # under the lock, so an older position never overwrites a newer one
+                put_migration_checkpoint(
+                    table,
+                    name,
+                    {"total_segments": total_segments, "segments": segments},
+                )
+                elapsed = time.time() - t0
+                print(
+                    f"Migration {name}: {stats['scanned']} scanned, "
+                    f"{stats['updated']} updated, "
+                    f"{stats['scanned'] / max(elapsed, 1e-9):.1f} items/s, "
+                    f"{sum(x['done'] for x in segments)}/{total_segments} segments done"
+                )
+
+    try:
+        with ThreadPoolExecutor(max_workers=total_segments) as executor:
+            list(executor.map(migrate_segment, range(total_segments)))
+
+    except ClientError as e:
+        print(f"Failed to migrate table items. Err: {e}")
+        raise
+
+    delete_migration_checkpoint(table, name)
+    if stats["updated"]:
+        add_to_counters(table, {}, version=1)
+    stats["elapsed"] = time.time() - t0
+    stats["items_per_second"] = stats["scanned"] / max(stats["elapsed"], 1e-9)
+    print(f"Migration {name} done, {stats=}")
+    return stats
+
+
+def __generate_update_expr(payload: dict, remove: list = None):
     """
     Given key-value pairs, generate UpdateExpression
     and ExpressionAttributeValues for DynamoDB update_item
+    Attributes listed in `remove` are dropped from the item.
     """
     update_expr_list = []
     expr_attr_value = {}
     for k, v in payload.items():
         update_expr_list.append(f"{k}=:{k}")
         expr_attr_value[f":{k}"] = v
-    update_expr = "SET " + ", ".join(update_expr_list)
+    update_expr = "SET " + ", ".join(update_expr_list) if update_expr_list else ""
+    if remove:
+        update_expr = f"{update_expr} REMOVE {', '.join(remove)}".strip()
     return update_expr, expr_attr_value
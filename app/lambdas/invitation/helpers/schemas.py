@@ -1,6 +1,34 @@
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
-from dataclasses import dataclass
+from typing import Union
+from dataclasses import dataclass, fields
+
+# partition key reserved for service bookkeeping items (e.g. scheduler watermark)
+# `#` never appears in a valid email, so it cannot clash with an invitation
+META_EMAIL = "#meta"
+# sort key, under META_EMAIL, of the marker `backfill_pending_shards` leaves
+# once done, the scheduler only reads the pending expiry GSI after it
+PENDING_GSI_READY_CODE = "pending_gsi#ready"
+# partition key prefix of expiry timers, e.g. `#timer#abc@gmail.com`
+# the timer of an invitation is deleted by DynamoDB TTL at its expiry
+TIMER_EMAIL_PREFIX = "#timer#"
+# TTL attribute of expiry timers, epoch seconds
+TIMER_TTL_ATTRIBUTE = "expires_at"
+# partition key prefix of the per-status invitation counters, e.g. `#counter#03`
+# increments go to a random one of COUNTER_SHARD_COUNT items, reads sum them all
+COUNTER_EMAIL_PREFIX = "#counter#"
+COUNTER_CODE = "counter"
+COUNTER_SHARD_COUNT = 8
+# counter attribute summed into the table change version, see `add_to_counters`
+CHANGE_VERSION_ATTRIBUTE = "version"
+# compact storage format (opt-in, ITEM_FORMAT=compact): `created_date` is stored
+# as epoch seconds under this short name. Every other invitation attribute is
+# part of the table or a GSI key schema, so it keeps its name and string type.
+COMPACT_CREATED_DATE = "cd"
+# time-ordered codes (opt-in, CODE_FORMAT=time) start with their creation time in
+# Crockford base32, whose first digit is 0-9 until the year 2318. Legacy codes
+# are letters only, so every time-ordered code sorts below this bound.
+TIME_ORDERED_CODE_BOUND = ":"
 
 
 class InvitationStatus(str, Enum):
@@ -25,3 +53,38 @@ class Invitation:
 
         if not isinstance(self.expiry_date, str):
             self.expiry_date = self.expiry_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    @classmethod
+    def from_item(cls, item: dict) -> "Invitation":
+        """
+        Build from a table item, ignoring storage-only attributes
+        such as `status_shard`.
+        """
+        return cls(**{f.name: item[f.name] for f in fields(cls)})
+
+
+def to_compact_item(item: dict) -> dict:
+    """
+    Compact storage form of a table item, see COMPACT_CREATED_DATE.
+    """
+    item = dict(item)
+    created_date = datetime.strptime(item.pop("created_date"), "%Y-%m-%dT%H:%M:%SZ")
+    item[COMPACT_CREATED_DATE] = int(
+        created_date.replace(tzinfo=timezone.utc).timestamp()
+    )
+    return item
+
+
+def from_storage_item(item: Union[None, dict]) -> Union[None, dict]:
+    """
+    Table item in either storage format, with the `Invitation` attributes.
+    Items written before the compact format was turned on are returned as is.
+    """
+    if item is None or COMPACT_CREATED_DATE not in item:
+        return item
+    item = dict(item)
+    created_date = datetime.fromtimestamp(
+        int(item.pop(COMPACT_CREATED_DATE)), timezone.utc
+    )
+    item["created_date"] = created_date.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return item
@@ -1,17 +1,154 @@
+import base64
+from collections import OrderedDict
+import dataclasses
 from datetime import datetime, timezone, timedelta
+import hashlib
+import hmac
 import json
+import os
 import random
+import re
 import string
-from typing import Any
+import threading
+import time
+from typing import Any, Hashable, Union
 
 from .schemas import (
     Invitation,
     InvitationStatus,
 )
 
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+# max emails per bulk create request, keeps it within the Lambda timeout
+MAX_BULK_INVITATIONS = 20_000
+# max keys per bulk confirm request, one code guess per key
+MAX_BULK_CONFIRMATIONS = 1_000
+# a cheap sanity check rather than RFC 5322, `#` is kept for reserved partitions
+EMAIL_PATTERN = re.compile(r"[^@\s#]+@[^@\s#]+\.[^@\s#]+")
+MAX_EMAIL_LENGTH = 254
+# Crockford base32, digits sort before letters
+TIME_CODE_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+# epoch milliseconds fit in 9 base32 digits until the year 3084
+TIME_CODE_PREFIX_LENGTH = 9
 
-def generate_code(length=8) -> str:
-    return "".join(random.choices(string.ascii_letters, k=length))
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, e.g. to keep writes under a WCU budget.
+    `rate` tokens are added per second, up to `capacity`, and may go
+    negative for requests larger than `capacity`.
+    A non-positive `rate` disables limiting.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Block until `tokens` are available and take them.
+        return seconds spent waiting
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        # a request larger than the bucket would never fit: it goes once the
+        # bucket is full and is charged in full, the debt is waited out by
+        # the following requests, so the rate holds either way
+        needed = min(tokens, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return waited
+                wait = (needed - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class LRUCache:
+    """
+    Thread-safe, bounded LRU cache whose entries expire after `ttl_seconds`.
+    Lives as long as the warm Lambda container, a `max_size` of 0 disables it.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        return the cached value, or None if absent or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def generate_code(length=8, time_ordered: bool = False) -> str:
+    """
+    Random code of `length` letters. With `time_ordered`, prefixed by
+    `time_code_prefix`, so an email's codes sort by creation time.
+    """
+    code = "".join(random.choices(string.ascii_letters, k=length))
+    if time_ordered:
+        return time_code_prefix() + code
+    return code
+
+
+def time_code_prefix(now: datetime = None) -> str:
+    """
+    Time-sortable code prefix, ULID-style: epoch milliseconds of `now`
+    as TIME_CODE_PREFIX_LENGTH Crockford base32 digits.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+    ms = int(now.timestamp() * 1000)
+    digits = []
+    for _ in range(TIME_CODE_PREFIX_LENGTH):
+        ms, digit = divmod(ms, len(TIME_CODE_ALPHABET))
+        digits.append(TIME_CODE_ALPHABET[digit])
+    return "".join(reversed(digits))
 
 
 def generate_invitation(
@@ -29,17 +166,225 @@ def generate_invitation(
     )
 
 
+def effective_status(invite_status: str, expiry_date: str, now: str = None) -> str:
+    """
+    Status as of `now` (default: current time): unconfirmed invitations past
+    their expiry_date are expired, whether or not the scheduler converted them yet.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if invite_status == InvitationStatus.UNCONFIRMED and expiry_date < now:
+        return InvitationStatus.EXPIRED.value
+    return invite_status
+
+
+def with_effective_status(items: list[dict], now: str = None) -> list[dict]:
+    """
+    Copy of `items` with `invite_status` replaced by `effective_status`.
+    """
+    if now is None:
+        now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return [
+        {
+            **x,
+            "invite_status": effective_status(
+                x["invite_status"], x["expiry_date"], now
+            ),
+        }
+        for x in items
+    ]
+
+
+def get_status_shard_count() -> int:
+    """
+    Number of write shards of the status GSI, 0 when sharding is off.
+    """
+    return int(os.environ.get("STATUS_SHARD_COUNT") or 0)
+
+
+def expiry_timers_enabled() -> bool:
+    """
+    Whether new invitations get a TTL expiry timer for the stream processor,
+    i.e. EXPIRY_MODE is `stream` rather than the default `cron`.
+    """
+    return os.environ.get("EXPIRY_MODE", "cron") == "stream"
+
+
+def compact_items_enabled() -> bool:
+    """
+    Whether new invitations are written in the compact storage format,
+    i.e. ITEM_FORMAT is `compact` rather than the default `standard`.
+    """
+    return os.environ.get("ITEM_FORMAT", "standard") == "compact"
+
+
+def time_ordered_codes_enabled() -> bool:
+    """
+    Whether new invitations get time-ordered codes, see `time_code_prefix`,
+    i.e. CODE_FORMAT is `time` rather than the default `random`.
+    """
+    return os.environ.get("CODE_FORMAT", "random") == "time"
+
+
+def parse_limit(limit: Union[None, str]) -> int:
+    """
+    Parse `limit` query param into a page size within [1, MAX_PAGE_LIMIT].
+    Raise ValueError if it is not a positive integer.
+    """
+    if limit is None:
+        return DEFAULT_PAGE_LIMIT
+
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError(f"limit must be positive, got {limit}")
+    return min(limit, MAX_PAGE_LIMIT)
+
+
+def is_valid_email(email: str) -> bool:
+    return len(email) <= MAX_EMAIL_LENGTH and EMAIL_PATTERN.fullmatch(email) is not None
+
+
+def parse_date(date: Union[None, str]) -> Union[None, str]:
+    """
+    Validate a date query param in the stored format, e.g. `2024-01-31T00:00:00Z`.
+    Dates are compared as strings in key conditions, so unpadded input that
+    `strptime` accepts, e.g. `2024-1-5T0:0:0Z`, is rejected too.
+    Raise ValueError if it is not one.
+    """
+    if date is not None:
+        parsed = datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ")
+        if parsed.strftime("%Y-%m-%dT%H:%M:%SZ") != date:
+            raise ValueError(f"{date!r} is not zero-padded, e.g. 2024-01-31T00:00:00Z")
+    return date
+
+
+def parse_fields(fields: Union[None, str]) -> Union[None, list]:
+    """
+    Parse `fields` query param, comma-separated `Invitation` attributes,
+    into a list in the given order, None for whole items.
+    Raise ValueError on an unknown or missing field.
+    """
+    if fields is None:
+        return None
+
+    known = [f.name for f in dataclasses.fields(Invitation)]
+    parsed = [x.strip() for x in fields.split(",")]
+    unknown = [x for x in parsed if x not in known]
+    if unknown:
+        raise ValueError(f"unknown fields {unknown}, expected some of {known}")
+    return list(dict.fromkeys(parsed))
+
+
+def __b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def __b64decode(encoded: str) -> bytes:
+    return base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4))
+
+
+def __sign(payload: str) -> str:
+    secret = os.environ["PAGINATION_TOKEN_SECRET"].encode()
+    digest = hmac.new(secret, payload.encode(), hashlib.sha256).digest()
+    return __b64encode(digest)
+
+
+def encode_next_token(start_key: Union[None, dict], scope: str) -> Union[None, str]:
+    """
+    Encode DynamoDB `LastEvaluatedKey` into an opaque, signed cursor.
+    `scope` binds the cursor to the query it was issued for,
+    so it cannot be replayed against a different listing.
+    """
+    if not start_key:
+        return None
+
+    payload = __b64encode(
+        json.dumps({"k": start_key, "s": scope}, separators=(",", ":")).encode()
+    )
+    return f"{payload}.{__sign(payload)}"
+
+
+def decode_next_token(token: Union[None, str], scope: str) -> Union[None, dict]:
+    """
+    Verify and decode a cursor from `encode_next_token` into `ExclusiveStartKey`.
+    Raise ValueError if the cursor is malformed, tampered or out of scope.
+    """
+    if not token:
+        return None
+
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature, __sign(payload)):
+            raise ValueError("signature mismatch")
+        decoded = json.loads(__b64decode(payload))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid next_token. Err: {e}")
+
+    if decoded.get("s") != scope:
+        raise ValueError("Invalid next_token. Err: issued for a different query")
+    return decoded["k"]
+
+
+def __etag_digest(scope: str) -> str:
+    return hashlib.sha256(scope.encode()).hexdigest()[:16]
+
+
+def build_etag(version: int, fresh_until: int, scope: str) -> str:
+    """
+    ETag of a listing: the table change version it was read at, the epoch
+    second up to which its statuses as of now hold (0 for no limit) and a
+    digest of the request `scope` it answers.
+    """
+    return f'"{version}-{fresh_until}-{__etag_digest(scope)}"'
+
+
+def matching_etag(
+    if_none_match: Union[None, str],
+    version: int,
+    scope: str,
+    now: int,
+) -> Union[None, str]:
+    """
+    return the ETag of `if_none_match` that still describes the listing of
+    `scope` at table change `version` as of epoch second `now`, if any
+    """
+    if not if_none_match:
+        return None
+
+    digest = __etag_digest(scope)
+    for etag in if_none_match.split(","):
+        etag = etag.strip()
+        try:
+            tag_version, fresh_until, tag_digest = (
+                etag.removeprefix("W/").strip('"').split("-")
+            )
+            if (
+                int(tag_version) == version
+                and tag_digest == digest
+                and (int(fresh_until) == 0 or now <= int(fresh_until))
+            ):
+                return etag
+        except ValueError:
+            # not one of ours
+            continue
+    return None
+
+
 def build_response(
     status_code: int,
     success: bool,
     message: str,
     data: Any = None,
+    next_token: str = None,
+    etag: str = None,
 ):
     body = {
         "success": success,
         "message": message,
         "data": data,
     }
+    if next_token is not None:
+        body["next_token"] = next_token
     response = {
         "statusCode": status_code,
         "headers": {
@@ -50,4 +395,23 @@ def build_response(
         },
         "body": json.dumps(body),
     }
+    if etag is not None:
+        response["headers"]["ETag"] = etag
+        response["headers"]["Access-Control-Expose-Headers"] = "ETag"
     return response
+
+
+def build_not_modified_response(etag: str):
+    """
+    304 to a conditional GET whose `If-None-Match` matched `etag`, no body.
+    """
+    return {
+        "statusCode": 304,
+        "headers": {
+            "Access-Control-Allow-Headers": "*",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "OPTIONS,POST,GET,PUT,DELETE",
+            "Access-Control-Expose-Headers": "ETag",
+            "ETag": etag,
+        },
+    }
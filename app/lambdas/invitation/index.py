@@ -2,14 +2,7 @@ import json
 import os
 import traceback
 
-import boto3
-
-from helpers.controllers import (
-    review_all_invitations,
-    create_new_invitation,
-    confirm_invitation,
-    invalidate_invitation,
-)
+from helpers.clients import get_table
 from helpers.utils import build_response
 
 TABLE_NAME = os.environ["TABLE_NAME"]
@@ -27,28 +20,51 @@ def handler(event, context):
         )
 
     http_method = res_ctx["method"]
-    # http_path = res_ctx["path"]
+    http_path = res_ctx.get("path", "")
 
     query_params = event.get("queryStringParameters", {})
     request_body = json.loads(event.get("body", "{}"))
 
-    dynamodb = boto3.resource("dynamodb")
-    table = dynamodb.Table(TABLE_NAME)
-
     try:
+        if http_method not in ("GET", "POST", "PUT", "DELETE"):
+            raise NotImplementedError()
+
+        # loaded by the first request that needs them rather than at cold
+        # start, boto3 behind them is most of the import time
+        from helpers import controllers
+
+        table = get_table(TABLE_NAME)
+
         if http_method == "GET":
-            return review_all_invitations(table, query_params)
+            if http_path.endswith("/stats"):
+                return controllers.review_invitation_stats(table)
+            # HTTP API lowercases header names
+            headers = event.get("headers") or {}
+            return controllers.review_all_invitations(
+                table, query_params, if_none_match=headers.get("if-none-match")
+            )
 
         if http_method == "POST":
-            return create_new_invitation(table, request_body)
+            if "emails" in request_body:
+                return controllers.create_new_invitations(table, request_body)
+            return controllers.create_new_invitation(table, request_body)
 
         if http_method == "PUT":
-            return confirm_invitation(table, request_body)
+            if http_path.endswith("/bulk"):
+                return controllers.confirm_invitations(table, request_body)
+            if "keys" in request_body:
+                # PUT /invitation is public, bulk confirm is an admin operation
+                return build_response(
+                    status_code=422,
+                    success=False,
+                    message="Use PUT /invitation/bulk to confirm many invitations.",
+                )
+            return controllers.confirm_invitation(table, request_body)
 
         if http_method == "DELETE":
-            return invalidate_invitation(table, request_body)
-
-        raise NotImplementedError()
+            if "keys" in request_body or "email_domain" in request_body:
+                return controllers.invalidate_invitations(table, request_body)
+            return controllers.invalidate_invitation(table, request_body)
 
     except Exception as e:
         traceback.print_exc()
@@ -0,0 +1,80 @@
+"""
+Module-level registry of AWS clients, built on first use and reused by
+every warm invocation of the container, along with their connection pools.
+boto3 itself is only imported then, it dominates the cold start.
+"""
+import os
+import threading
+
+# one connection per concurrent batch writer, plus the GSI reader
+MAX_POOL_CONNECTIONS = int(os.environ.get("SCHEDULER_MAX_WORKERS") or 10) + 1
+
+__registry = {}
+__lock = threading.Lock()
+
+
+def __config():
+    from botocore.config import Config
+
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+        connect_timeout=5,
+        read_timeout=10,
+        # client side rate limiting when throttled, few attempts as the scheduler
+        # retries with its own backoff and needs to see throttling to back off
+        retries={"mode": "adaptive", "max_attempts": 2},
+    )
+
+
+def __get_or_create(key: tuple, create):
+    item = __registry.get(key)
+    if item is None:
+        with __lock:
+            item = __registry.get(key)
+            if item is None:
+                item = __registry[key] = create()
+    return item
+
+
+def get_client(service_name: str):
+    """
+    Low-level client of `service_name`, e.g. `lambda`.
+    """
+
+    def create():
+        import boto3
+
+        return boto3.client(service_name, config=__config())
+
+    return __get_or_create(("client", service_name), create)
+
+
+def get_table(table_name: str):
+    """
+    DynamoDB `Table` resource of `table_name`.
+    """
+
+    def create():
+        import boto3
+
+        return boto3.resource("dynamodb", config=__config())
+
+    resource = __get_or_create(("resource", "dynamodb"), create)
+    return __get_or_create(("table", table_name), lambda: resource.Table(table_name))
+
+
+def set_table(table_name: str, table):
+    """
+    Test hook: make `get_table` return `table`, e.g. a moto-backed one.
+    """
+    with __lock:
+        __registry[("table", table_name)] = table
+
+
+def reset():
+    """
+    Drop every cached client, e.g. between tests.
+    """
+    with __lock:
+        __registry.clear()
@@ -1,88 +1,344 @@
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 from functools import partial
 import queue
 import threading
 import time
-from typing import Generator
+from typing import Callable, Generator
 
 from .queries import (
+    add_to_counters,
+    count_by_gsi,
+    get_counters,
     query_by_gsi,
-    update,
+    query_by_sharded_gsi,
+    query_pending_expiry,
+    pending_gsi_ready,
+    get_watermark,
+    put_watermark,
+    get_checkpoint,
+    put_checkpoint,
+    delete_checkpoint,
+    batch_update_status,
+    BATCH_UPDATE_LIMIT,
 )
 from .schemas import (
     Invitation,
     InvitationStatus,
 )
+from .utils import (
+    AdaptiveConcurrency,
+    TokenBucket,
+    parse_expiry_timer_removal,
+)
+
+# pages buffered between the GSI reader and the writers, bounds memory use
+MAX_QUEUED_PAGES = 4
+# a write of an item up to 1 KB consumes 1 WCU
+WCU_PER_ITEM = 1
+# GSI page size, also bounds the pending work a checkpoint has to hold
+PAGE_SIZE = 500
+# stop taking new work once less than this is left before the Lambda timeout
+SAFETY_MARGIN_MS = 10_000
 
 
 def send_to_queue(
     data_queue: queue.Queue,
-    items_generator: Generator[Invitation, None, None],
+    items_generator: Generator[tuple[list[Invitation], dict], None, None],
+    stats: dict,
+    should_stop: Callable[[], bool],
+    pending: list[dict] = None,
 ):
-    for items in items_generator:
-        data_queue.put(items)
+    try:
+        # leftovers of a previous run go first
+        if pending:
+            data_queue.put(pending)
+
+        for items, last_key in items_generator:
+            stats["read"] += len(items)
+            data_queue.put(items)
+
+            if last_key and should_stop():
+                # the next run continues the query from here
+                stats["resume_key"] = last_key
+                break
+
+    except Exception as e:
+        stats["errors"].append(e)
+
+    finally:
+        # signal no more items
+        data_queue.put(None)
+
 
-    # signal no more items
-    data_queue.put(None)
+def to_keys(items: list[Invitation]) -> list[dict]:
+    return [{"email": x["email"], "code": x["code"]} for x in items]
 
 
-def update_expired_status(table, item: Invitation):
-    return update(
+def update_expired_status(
+    table,
+    items: list[Invitation],
+    shard_count: int = 0,
+) -> dict:
+    t0 = time.time()
+    result = batch_update_status(
         table=table,
-        email=item["email"],
-        code=item["code"],
-        payload={"invite_status": InvitationStatus.EXPIRED},
+        items=items,
+        from_status=InvitationStatus.UNCONFIRMED,
+        to_status=InvitationStatus.EXPIRED,
+        shard_count=shard_count,
     )
+    result["latency"] = time.time() - t0
+    return result
+
+
+def record_batch(
+    stats: dict,
+    stats_lock: threading.Lock,
+    concurrency: AdaptiveConcurrency,
+    future: Future,
+):
+    """
+    Completion callback of a batch: fold its result into `stats`
+    and hand its concurrency slot back, shrinking the limit if throttled.
+    """
+    try:
+        result = future.result()
+    except Exception as e:
+        with stats_lock:
+            stats["errors"].append(e)
+        concurrency.release()
+        return
+
+    latency = result.pop("latency")
+    with stats_lock:
+        for k, v in result.items():
+            stats[k] += v
+        stats["batches"] += 1
+        stats["batch_latency_total"] += latency
+        stats["batch_latency_max"] = max(stats["batch_latency_max"], latency)
+    concurrency.release(throttled=result["throttled"] > 0)
 
 
 def process_queue(
     table,
     data_queue: queue.Queue,
     executor: ThreadPoolExecutor,
+    stats: dict,
+    rate_limiter: TokenBucket,
+    concurrency: AdaptiveConcurrency,
+    should_stop: Callable[[], bool],
+    shard_count: int = 0,
 ):
-    now_utc = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    stats_lock = threading.Lock()
     while True:
         items = data_queue.get()
         if items is None:
             data_queue.task_done()
             break
 
-        to_update_items = [
-            x
-            for x in items
-            if x["expiry_date"] < now_utc
-            and x["invite_status"] != InvitationStatus.CONFIRMED
-        ]
+        if should_stop():
+            # out of time, keep draining so the reader is not blocked
+            stats["pending"].extend(to_keys(items))
+            data_queue.task_done()
+            continue
 
+        # items are already narrowed to expired ones by the GSI key condition
+        batches = [
+            items[i : i + BATCH_UPDATE_LIMIT]
+            for i in range(0, len(items), BATCH_UPDATE_LIMIT)
+        ]
         t0 = time.time()
-        executor.map(partial(update_expired_status, table), to_update_items)
-        print(f"Batch update of {len(to_update_items)} items took {time.time()-t0}s")
+        futures = []
+        try:
+            for i, batch in enumerate(batches):
+                if should_stop():
+                    stats["pending"].extend(
+                        to_keys([x for batch in batches[i:] for x in batch])
+                    )
+                    break
 
-        data_queue.task_done()
+                # blocks while the concurrency limit or the WCU budget is used up
+                concurrency.acquire()
+                stats["rate_limited_seconds"] += rate_limiter.acquire(
+                    WCU_PER_ITEM * len(batch)
+                )
+                future = executor.submit(
+                    update_expired_status, table, batch, shard_count
+                )
+                future.add_done_callback(
+                    partial(record_batch, stats, stats_lock, concurrency)
+                )
+                futures.append(future)
+
+        except Exception as e:
+            stats["errors"].append(e)
+
+        finally:
+            # page is done only once every submitted batch has completed
+            wait(futures)
+            data_queue.task_done()
+
+        elapsed = time.time() - t0
+        print(
+            f"Batch update of {len(items)} items in {len(batches)} batches "
+            f"took {elapsed:.3f}s ({len(items) / max(elapsed, 1e-9):.1f} items/s, "
+            f"concurrency limit {concurrency.limit})"
+        )
+
+
+def count_expired(table, updated: int):
+    """
+    Move `updated` invitations from the unconfirmed to the expired counter
+    and bump the table change version, once per run rather than per batch.
+    The expiry stands either way, so a failure is only logged,
+    `reconcile_counters` fixes the drift.
+    """
+    if not updated:
+        return
+
+    try:
+        add_to_counters(
+            table,
+            {InvitationStatus.UNCONFIRMED: -updated, InvitationStatus.EXPIRED: updated},
+            version=1,
+        )
+    except Exception as e:
+        print(f"Failed to count {updated} expired invitations. Err: {e}")
 
 
 def process_expired_unconfirmed_invitations(
     table,
     gsi_name: str,
-):
-    data_queue = queue.Queue()
-    items_generator = query_by_gsi(
-        table=table,
-        gsi_name=gsi_name,
-        invite_status=InvitationStatus.UNCONFIRMED,
-    )
+    use_watermark: bool = True,
+    max_workers: int = 10,
+    wcu_per_second: float = 0,
+    max_queued_pages: int = MAX_QUEUED_PAGES,
+    time_left_ms: Callable[[], int] = None,
+    safety_margin_ms: int = SAFETY_MARGIN_MS,
+    page_size: int = PAGE_SIZE,
+    shard_count: int = 0,
+    sharded_gsi_name: str = None,
+    pending_gsi_name: str = None,
+) -> dict:
+    """
+    Convert unconfirmed invitations expired since the last successful run.
+    The watermark only moves forward when no item in the window failed,
+    so failed items are retried on the next run. Items confirmed meanwhile
+    are skipped by the conditional update and do not hold it back.
+    Writes are capped at `wcu_per_second` (0 for no cap) and at an adaptive
+    number of concurrent batches, up to `max_workers`.
+    When `time_left_ms` (e.g. `context.get_remaining_time_in_millis`) drops
+    below `safety_margin_ms`, the run stops taking new work and saves its
+    GSI position and unprocessed keys to a checkpoint the next run resumes from.
+    With `pending_gsi_name`, the sparse pending expiry GSI is read instead
+    once `backfill_pending_shards` has completed (before that, it would miss
+    older invitations while the watermark moves past them), otherwise with
+    `shard_count`, the shards of `sharded_gsi_name`.
+    A checkpointed run resumes on the index it started on.
+    """
+    checkpoint = get_checkpoint(table)
+    if checkpoint:
+        window_start = checkpoint.get("window_start")
+        window_end = checkpoint["window_end"]
+        start_key = checkpoint.get("start_key")
+        pending = checkpoint.get("pending") or []
+        index = checkpoint.get("index")
+        print(
+            f"Resuming from checkpoint at {start_key} "
+            f"with {len(pending)} pending items"
+        )
+    else:
+        index = None
+        window_start = get_watermark(table) if use_watermark else None
+        window_end = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        start_key = None
+        pending = []
+    print(f"Processing invitations expired between {window_start} and {window_end}")
+
+    def should_stop() -> bool:
+        return time_left_ms is not None and time_left_ms() < safety_margin_ms
+
+    stats = {
+        "read": 0,
+        "updated": 0,
+        "skipped": 0,
+        # failures of the checkpointed runs still hold the watermark back
+        "failed": int(checkpoint.get("failed", 0)) if checkpoint else 0,
+        "api_calls": 0,
+        "throttled": 0,
+        "batches": 0,
+        "batch_latency_total": 0.0,
+        "batch_latency_max": 0.0,
+        "rate_limited_seconds": 0.0,
+        "resume_key": None,
+        "pending": [],
+        "errors": [],
+    }
+    # bounded, so a fast reader blocks instead of piling pages up in memory
+    data_queue = queue.Queue(maxsize=max_queued_pages)
+    rate_limiter = TokenBucket(rate=wcu_per_second)
+    concurrency = AdaptiveConcurrency(max_limit=max_workers)
+    if index is None:
+        if pending_gsi_name and pending_gsi_ready(table):
+            index = "pending"
+        else:
+            if pending_gsi_name:
+                print("Pending expiry GSI not backfilled yet, reading the status GSI")
+            index = "sharded" if shard_count else "status"
 
+    if index == "pending":
+        items_generator = query_pending_expiry(
+            table=table,
+            gsi_name=pending_gsi_name,
+            shard_count=shard_count,
+            expiry_before=window_end,
+            expiry_after=window_start,
+            start_keys=start_key,
+            page_size=page_size,
+        )
+    elif index == "sharded":
+        items_generator = query_by_sharded_gsi(
+            table=table,
+            gsi_name=sharded_gsi_name,
+            invite_status=InvitationStatus.UNCONFIRMED,
+            shard_count=shard_count,
+            expiry_before=window_end,
+            expiry_after=window_start,
+            start_keys=start_key,
+            page_size=page_size,
+        )
+    else:
+        items_generator = query_by_gsi(
+            table=table,
+            gsi_name=gsi_name,
+            invite_status=InvitationStatus.UNCONFIRMED,
+            expiry_before=window_end,
+            expiry_after=window_start,
+            start_key=start_key,
+            page_size=page_size,
+        )
+
+    t0 = time.time()
     try:
-        executor = ThreadPoolExecutor(max_workers=10)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
 
         producer = threading.Thread(
             target=send_to_queue,
-            args=(data_queue, items_generator),
+            args=(data_queue, items_generator, stats, should_stop, pending),
         )
         consumer = threading.Thread(
             target=process_queue,
-            args=(table, data_queue, executor),
+            args=(
+                table,
+                data_queue,
+                executor,
+                stats,
+                rate_limiter,
+                concurrency,
+                should_stop,
+                shard_count,
+            ),
         )
 
         producer.start()
@@ -94,3 +350,111 @@ def process_expired_unconfirmed_invitations(
 
     finally:
         executor.shutdown()
+        count_expired(table, stats["updated"])
+
+    stats["stopped"] = bool(stats["resume_key"] or stats["pending"])
+    if stats["stopped"]:
+        put_checkpoint(
+            table,
+            {
+                "window_start": window_start,
+                "window_end": window_end,
+                "index": index,
+                "start_key": stats["resume_key"],
+                "pending": stats["pending"],
+                "failed": stats["failed"],
+            },
+        )
+        stats["watermark"] = window_start
+    else:
+        if checkpoint:
+            delete_checkpoint(table)
+
+        if not stats["failed"] and not stats["errors"]:
+            put_watermark(table, window_end)
+            stats["watermark"] = window_end
+        else:
+            stats["watermark"] = window_start
+
+    # the per-item path costs one UpdateItem call per item read
+    stats["api_calls_saved"] = stats["read"] - stats["api_calls"]
+    stats["elapsed"] = time.time() - t0
+    stats["items_per_second"] = stats["updated"] / max(stats["elapsed"], 1e-9)
+    stats["batch_latency_avg"] = stats["batch_latency_total"] / max(stats["batches"], 1)
+    print(f"stats={ {k: v for k, v in stats.items() if k != 'pending'} }")
+    print(f"{len(stats['pending'])} items left pending")
+    return stats
+
+
+def process_expiry_timer_records(
+    table,
+    records: list[dict],
+    shard_count: int = 0,
+) -> dict:
+    """
+    Expire the invitations whose expiry timers DynamoDB TTL deleted, as
+    reported by a batch of table stream `records`, BATCH_UPDATE_LIMIT per call.
+    Confirmed or invalidated invitations are skipped by the conditional update.
+    return a partial batch response: on failure, the sequence number the
+    stream is retried from (already expired items are skipped on retry)
+    """
+    removals = []
+    for record in records:
+        key = parse_expiry_timer_removal(record)
+        if key:
+            removals.append((record["dynamodb"]["SequenceNumber"], key))
+
+    stats = {"read": len(records), "timers": len(removals), "updated": 0, "skipped": 0}
+    failures = []
+    for i in range(0, len(removals), BATCH_UPDATE_LIMIT):
+        batch = removals[i : i + BATCH_UPDATE_LIMIT]
+        try:
+            result = batch_update_status(
+                table=table,
+                items=[key for _, key in batch],
+                from_status=InvitationStatus.UNCONFIRMED,
+                to_status=InvitationStatus.EXPIRED,
+                shard_count=shard_count,
+            )
+        except Exception as e:
+            print(f"Failed to expire invitations. Err: {e}")
+            result = {"failed": len(batch)}
+
+        if result["failed"]:
+            # later records are redelivered from here anyway, stop
+            failures.append({"itemIdentifier": batch[0][0]})
+            break
+        stats["updated"] += result["updated"]
+        stats["skipped"] += result["skipped"]
+
+    count_expired(table, stats["updated"])
+    print(f"{stats=}")
+    return {"batchItemFailures": failures}
+
+
+def reconcile_counters(
+    table,
+    gsi_name: str,
+    shard_count: int = 0,
+    sharded_gsi_name: str = None,
+) -> dict:
+    """
+    Fix drift of the per-status counters, e.g. from a counter update lost
+    after the write it counts: count every status on the status GSI (with
+    `shard_count`, every shard of `sharded_gsi_name`) and ADD the difference
+    to the counters. ADD keeps the increments made meanwhile, only
+    transitions racing with the count itself are off until the next run.
+    """
+    if shard_count:
+        gsi_name = sharded_gsi_name
+    counted = {
+        x.value: count_by_gsi(table, gsi_name, x, shard_count=shard_count)
+        for x in InvitationStatus
+    }
+    counters = get_counters(table)
+    drift = {k: v - counters.get(k, 0) for k, v in counted.items()}
+    add_to_counters(table, drift)
+
+    stats = {"counted": counted, "drift": drift}
+    print(f"{stats=}")
+    return stats
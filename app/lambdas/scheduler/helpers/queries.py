@@ -1,40 +1,415 @@
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import random
+import time
 from typing import Union, Generator
+import zlib
 
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import ConditionExpressionBuilder, Key
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 from botocore.exceptions import ClientError
 
-from .schemas import Invitation
+from .clients import get_client
+from .schemas import (
+    Invitation,
+    InvitationStatus,
+    COMPACT_CREATED_DATE,
+    COUNTER_CODE,
+    COUNTER_EMAIL_PREFIX,
+    COUNTER_SHARD_COUNT,
+    CHANGE_VERSION_ATTRIBUTE,
+    META_EMAIL,
+    PENDING_GSI_READY_CODE,
+)
+
+WATERMARK_CODE = "scheduler#watermark"
+CHECKPOINT_CODE = "scheduler#checkpoint"
+
+# max conditional updates per BatchExecuteStatement call
+BATCH_UPDATE_LIMIT = 25
+# per-statement errors worth retrying, anything else is final
+RETRYABLE_STATEMENT_ERRORS = {
+    "InternalServerError",
+    "ProvisionedThroughputExceeded",
+    "RequestLimitExceeded",
+    "ThrottlingError",
+    "TransactionConflict",
+}
+THROTTLING_ERRORS = {
+    "ProvisionedThroughputExceeded",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "ThrottlingError",
+    "ThrottlingException",
+}
 
 
 # TODO table type hinting
 
+__serializer = TypeSerializer()
+__deserializer = TypeDeserializer()
+
+
+def decode_item(item: dict) -> dict:
+    """
+    Decode a low-level DynamoDB item. Invitation attributes are plain strings,
+    so `{"S": value}` is unwrapped directly, any other item falls back to
+    the generic TypeDeserializer. The epoch `created_date` of compact items
+    is left as its number string, the scheduler does not read it.
+    """
+    try:
+        return {
+            k: v["N"] if k == COMPACT_CREATED_DATE else v["S"] for k, v in item.items()
+        }
+    except KeyError:
+        return {k: __deserializer.deserialize(v) for k, v in item.items()}
+
+
+def encode_item(item: dict) -> dict:
+    return {k: __serializer.serialize(v) for k, v in item.items()}
+
+
+def __read(table, operation: str, **kwargs) -> dict:
+    """
+    `table.query` or `table.scan` (`operation`) through the low-level client:
+    same kwargs and response as the resource, but items are decoded by
+    `decode_item` instead of the resource's generic per-attribute walk.
+    """
+    builder = ConditionExpressionBuilder()
+    names, values = {}, {}
+    for name, is_key_condition in (
+        ("KeyConditionExpression", True),
+        ("FilterExpression", False),
+    ):
+        if kwargs.get(name) is None:
+            continue
+        expr = builder.build_expression(kwargs[name], is_key_condition=is_key_condition)
+        kwargs[name] = expr.condition_expression
+        names.update(expr.attribute_name_placeholders)
+        values.update(expr.attribute_value_placeholders)
+    if names:
+        kwargs["ExpressionAttributeNames"] = names
+    if values:
+        kwargs["ExpressionAttributeValues"] = encode_item(values)
+    if kwargs.get("ExclusiveStartKey"):
+        kwargs["ExclusiveStartKey"] = encode_item(kwargs["ExclusiveStartKey"])
+
+    client = get_client("dynamodb")
+    resp = getattr(client, operation)(TableName=table.name, **kwargs)
+    resp["Items"] = [decode_item(x) for x in resp.get("Items", [])]
+    if "LastEvaluatedKey" in resp:
+        resp["LastEvaluatedKey"] = decode_item(resp["LastEvaluatedKey"])
+    return resp
+
+
+def status_shard(invite_status: str, email: str, code: str, shard_count: int) -> str:
+    """
+    Partition key of the sharded status GSI, e.g. `unconfirmed#07`.
+    Must match `status_shard` of the invitation Lambda.
+    """
+    invite_status = getattr(invite_status, "value", invite_status)
+    shard = zlib.crc32(f"{email}#{code}".encode()) % shard_count
+    return f"{invite_status}#{shard:02d}"
+
+
+def __expiry_condition(
+    expr,
+    expiry_before: str = None,
+    expiry_after: str = None,
+):
+    if expiry_before is not None and expiry_after is not None:
+        expr &= Key("expiry_date").between(expiry_after, expiry_before)
+    elif expiry_before is not None:
+        expr &= Key("expiry_date").lte(expiry_before)
+    elif expiry_after is not None:
+        expr &= Key("expiry_date").gte(expiry_after)
+    return expr
+
+
+def __counter_key(shard: int) -> dict:
+    return {"email": f"{COUNTER_EMAIL_PREFIX}{shard:02d}", "code": COUNTER_CODE}
+
+
+def add_to_counters(table, deltas: dict, version: int = 0):
+    """
+    Atomically ADD `deltas` (invite_status -> change) to the per-status
+    counters, and `version` to the table change version, on one random
+    counter shard. Zero changes are left out.
+    """
+    deltas = {getattr(k, "value", k): v for k, v in deltas.items() if v}
+    if version:
+        deltas[CHANGE_VERSION_ATTRIBUTE] = version
+    if not deltas:
+        return
+
+    try:
+        table.update_item(
+            Key=__counter_key(random.randrange(COUNTER_SHARD_COUNT)),
+            UpdateExpression="ADD "
+            + ", ".join(f"#s{i} :s{i}" for i in range(len(deltas))),
+            ExpressionAttributeNames={f"#s{i}": k for i, k in enumerate(deltas)},
+            ExpressionAttributeValues={
+                f":s{i}": v for i, v in enumerate(deltas.values())
+            },
+        )
+
+    except ClientError as e:
+        print(f"Failed to update counters. Err: {e}")
+        raise
+
+
+def __counter_items(table, consistent: bool = False) -> list[dict]:
+    keys = [encode_item(__counter_key(i)) for i in range(COUNTER_SHARD_COUNT)]
+    items = []
+    try:
+        client = get_client("dynamodb")
+        while keys:
+            resp = client.batch_get_item(
+                RequestItems={table.name: {"Keys": keys, "ConsistentRead": consistent}}
+            )
+            items.extend(decode_item(x) for x in resp["Responses"].get(table.name, []))
+            keys = resp.get("UnprocessedKeys", {}).get(table.name, {}).get("Keys", [])
+        return items
+
+    except ClientError as e:
+        print(f"Failed to get counters. Err: {e}")
+        raise
+
+
+def get_counters(table) -> dict:
+    """
+    Invitation count of every status, summed over the counter shards.
+    """
+    counts = {x.value: 0 for x in InvitationStatus}
+    for item in __counter_items(table):
+        for k, v in item.items():
+            if k not in ("email", "code", CHANGE_VERSION_ATTRIBUTE):
+                counts[k] = counts.get(k, 0) + int(v)
+    return counts
+
+
+def count_by_gsi(
+    table,
+    gsi_name: str,
+    invite_status: str,
+    shard_count: int = 0,
+) -> int:
+    """
+    Number of invitations with `invite_status`, counted on the status GSI,
+    or with `shard_count`, summed over every shard of the sharded GSI.
+    """
+    invite_status = getattr(invite_status, "value", invite_status)
+    if shard_count:
+        partitions = [
+            ("status_shard", f"{invite_status}#{shard:02d}")
+            for shard in range(shard_count)
+        ]
+    else:
+        partitions = [("invite_status", invite_status)]
+
+    count = 0
+    try:
+        for key_name, value in partitions:
+            query_kwargs = {
+                "IndexName": gsi_name,
+                "KeyConditionExpression": Key(key_name).eq(value),
+                "Select": "COUNT",
+            }
+            while True:
+                resp = __read(table, "query", **query_kwargs)
+                count += resp["Count"]
+                if not resp.get("LastEvaluatedKey"):
+                    break
+                query_kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+        return count
+
+    except ClientError as e:
+        print(f"Failed to count table items. Err: {e}")
+        raise
+
 
 def query_by_gsi(
     table,
     gsi_name: str,
     invite_status: str,
-) -> Generator[Invitation, None, None]:
-    start_key = None
+    expiry_before: str = None,
+    expiry_after: str = None,
+    start_key: dict = None,
+    page_size: int = None,
+) -> Generator[tuple[list[Invitation], Union[None, dict]], None, None]:
+    """
+    Yield (items, last_evaluated_key) pages of invitations with `invite_status`,
+    optionally narrowed to `expiry_after` <= expiry_date <= `expiry_before`
+    via the GSI sort key, starting after `start_key`.
+    """
+    expr = __expiry_condition(
+        Key("invite_status").eq(invite_status), expiry_before, expiry_after
+    )
+    query_kwargs = {"IndexName": gsi_name, "KeyConditionExpression": expr}
+    if page_size:
+        query_kwargs["Limit"] = page_size
+
     try:
-        expr = Key("invite_status").eq(invite_status)
-        resp = table.query(
-            IndexName=gsi_name,
-            KeyConditionExpression=expr,
-        )
-        yield resp["Items"]
-        start_key = resp.get("LastEvaluatedKey")
-
-        while start_key:
-            resp = table.query(
-                IndexName=gsi_name,
-                KeyConditionExpression=expr,
-                ExclusiveStartKey=start_key,
-            )
-            yield resp["Items"]
+        while True:
+            if start_key:
+                query_kwargs["ExclusiveStartKey"] = start_key
+            resp = __read(table, "query", **query_kwargs)
             start_key = resp.get("LastEvaluatedKey")
+            yield resp["Items"], start_key
+            if not start_key:
+                break
 
     except ClientError as e:
         print(f"Failed to query table. Err: {e}")
+        raise
+
+
+def query_by_sharded_gsi(
+    table,
+    gsi_name: str,
+    invite_status: str,
+    shard_count: int,
+    expiry_before: str = None,
+    expiry_after: str = None,
+    start_keys: list = None,
+    page_size: int = None,
+    key_name: str = "status_shard",
+) -> Generator[tuple[list[Invitation], Union[None, list]], None, None]:
+    """
+    Like `query_by_gsi`, over every `invite_status` shard of the sharded GSI
+    (partition key `key_name`, values `<invite_status>#<shard>`).
+    Each round queries one page of every unfinished shard concurrently and
+    yields them merged by expiry_date, along with one start key per shard
+    (None once exhausted) to resume from. The cursor is None after the last page.
+    `page_size` is split across the shards, so a round stays within it.
+    """
+    if start_keys is None:
+        start_keys = [{}] * shard_count
+    if len(start_keys) != shard_count:
+        raise ValueError(f"Expected {shard_count} shard keys.")
+
+    invite_status = getattr(invite_status, "value", invite_status)
+    shard_page_size = page_size and max(1, page_size // shard_count)
+
+    def query_shard(shard: int):
+        start_key = start_keys[shard]
+        if start_key is None:
+            return [], None
+
+        query_kwargs = {
+            "IndexName": gsi_name,
+            "KeyConditionExpression": __expiry_condition(
+                Key(key_name).eq(f"{invite_status}#{shard:02d}"),
+                expiry_before,
+                expiry_after,
+            ),
+        }
+        if shard_page_size:
+            query_kwargs["Limit"] = shard_page_size
+        if start_key:
+            query_kwargs["ExclusiveStartKey"] = start_key
+        resp = __read(table, "query", **query_kwargs)
+        return resp["Items"], resp.get("LastEvaluatedKey")
+
+    try:
+        with ThreadPoolExecutor(max_workers=shard_count) as executor:
+            while True:
+                results = list(executor.map(query_shard, range(shard_count)))
+                start_keys = [last_key for _, last_key in results]
+                done = all(key is None for key in start_keys)
+
+                items = list(
+                    heapq.merge(
+                        *[items for items, _ in results],
+                        key=lambda x: x["expiry_date"],
+                    )
+                )
+                yield items, None if done else start_keys
+                if done:
+                    break
+
+    except ClientError as e:
+        print(f"Failed to query table. Err: {e}")
+        raise
+
+
+def query_pending_expiry(
+    table,
+    gsi_name: str,
+    shard_count: int = 0,
+    expiry_before: str = None,
+    expiry_after: str = None,
+    start_keys: list = None,
+    page_size: int = None,
+) -> Generator[tuple[list[Invitation], Union[None, list]], None, None]:
+    """
+    Read the sparse pending expiry GSI, which only holds live unconfirmed
+    invitations, so resolved ones are never touched.
+    Pages and cursor as in `query_by_sharded_gsi`.
+    """
+    return query_by_sharded_gsi(
+        table=table,
+        gsi_name=gsi_name,
+        invite_status="pending",
+        shard_count=max(shard_count, 1),
+        expiry_before=expiry_before,
+        expiry_after=expiry_after,
+        start_keys=start_keys,
+        page_size=page_size,
+        key_name="pending_shard",
+    )
+
+
+def pending_gsi_ready(table) -> bool:
+    """
+    Whether `backfill_pending_shards` has completed, so that the pending
+    expiry GSI holds every live invitation.
+    """
+    try:
+        resp = table.get_item(
+            Key={"email": META_EMAIL, "code": PENDING_GSI_READY_CODE},
+            ConsistentRead=True,
+        )
+        return "Item" in resp
+
+    except ClientError as e:
+        print(f"Failed to get pending expiry GSI marker. Err: {e}")
+        raise
+
+
+def get_watermark(table) -> Union[None, str]:
+    """
+    Get the expiry_date up to which the last successful run has processed.
+    """
+    try:
+        resp = table.get_item(
+            Key={"email": META_EMAIL, "code": WATERMARK_CODE},
+            ConsistentRead=True,
+        )
+        return resp.get("Item", {}).get("watermark")
+
+    except ClientError as e:
+        print(f"Failed to get watermark. Err: {e}")
+        raise
+
+
+def put_watermark(table, watermark: str):
+    """
+    Persist the watermark, never moving it backwards.
+    """
+    try:
+        table.put_item(
+            Item={"email": META_EMAIL, "code": WATERMARK_CODE, "watermark": watermark},
+            ConditionExpression="attribute_not_exists(watermark) OR watermark < :w",
+            ExpressionAttributeValues={":w": watermark},
+        )
+
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            print(f"Watermark already at or beyond {watermark}.")
+        else:
+            print(f"Failed to put watermark. Err: {e}")
+            raise
 
 
 def update(table, email: str, code: str, payload: dict) -> Union[None, Invitation]:
@@ -59,6 +434,144 @@ def update(table, email: str, code: str, payload: dict) -> Union[None, Invitatio
             print(f"Failed to update table item. Err: {e}")
 
 
+def get_checkpoint(table) -> Union[None, dict]:
+    """
+    Get the state left behind by a run that stopped before its deadline.
+    """
+    try:
+        resp = table.get_item(
+            Key={"email": META_EMAIL, "code": CHECKPOINT_CODE},
+            ConsistentRead=True,
+        )
+        return resp.get("Item")
+
+    except ClientError as e:
+        print(f"Failed to get checkpoint. Err: {e}")
+        raise
+
+
+def put_checkpoint(table, checkpoint: dict):
+    try:
+        table.put_item(
+            Item={**checkpoint, "email": META_EMAIL, "code": CHECKPOINT_CODE},
+        )
+
+    except ClientError as e:
+        print(f"Failed to put checkpoint. Err: {e}")
+        raise
+
+
+def delete_checkpoint(table):
+    try:
+        table.delete_item(Key={"email": META_EMAIL, "code": CHECKPOINT_CODE})
+
+    except ClientError as e:
+        print(f"Failed to delete checkpoint. Err: {e}")
+        raise
+
+
+def __status_update_statement(
+    table,
+    item: dict,
+    from_status: str,
+    to_status: str,
+    shard_count: int,
+) -> dict:
+    """
+    PartiQL update of `item` from `from_status` to `to_status`, conditional
+    on the current status, for BatchExecuteStatement.
+    """
+    to_status = getattr(to_status, "value", to_status)
+    from_status = getattr(from_status, "value", from_status)
+    statement = f'UPDATE "{table.name}" SET invite_status=?'
+    parameters = [to_status]
+    if shard_count:
+        # keep the sharded GSI key in step with the status
+        statement += " SET status_shard=?"
+        parameters.append(
+            status_shard(to_status, item["email"], item["code"], shard_count)
+        )
+    if to_status != InvitationStatus.UNCONFIRMED:
+        # resolved invitations leave the sparse pending expiry GSI
+        statement += " REMOVE pending_shard"
+    statement += " WHERE email=? AND code=? AND invite_status=?"
+    parameters.extend([item["email"], item["code"], from_status])
+    return {
+        "Statement": statement,
+        "Parameters": [__serializer.serialize(x) for x in parameters],
+    }
+
+
+def batch_update_status(
+    table,
+    items: list[Invitation],
+    from_status: str,
+    to_status: str,
+    max_retries: int = 3,
+    shard_count: int = 0,
+) -> dict:
+    """
+    Move up to BATCH_UPDATE_LIMIT items from `from_status` to `to_status`
+    in one BatchExecuteStatement call, 1 WCU per item. Each update is
+    conditional on the current status, so concurrently confirmed items are
+    left alone without holding back the others.
+    Statements fail one by one: only the ones with a retryable error are
+    resent, with backoff.
+    return counts of updated, skipped (condition failed), failed items,
+    api_calls and how many of them were throttled
+    """
+    if len(items) > BATCH_UPDATE_LIMIT:
+        raise ValueError(f"At most {BATCH_UPDATE_LIMIT} items per batch.")
+
+    result = {"updated": 0, "skipped": 0, "failed": 0, "api_calls": 0, "throttled": 0}
+    pending = list(items)
+    client = get_client("dynamodb")
+
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            time.sleep(0.05 * 2**attempt)
+
+        try:
+            result["api_calls"] += 1
+            resp = client.batch_execute_statement(
+                Statements=[
+                    __status_update_statement(
+                        table, item, from_status, to_status, shard_count
+                    )
+                    for item in pending
+                ]
+            )
+
+        except ClientError as e:
+            # whole request failed (e.g. throttled), resend as is
+            print(f"Failed to batch update table items. Err: {e}")
+            result["throttled"] += e.response["Error"]["Code"] in THROTTLING_ERRORS
+            continue
+
+        # responses are in the same order as the statements
+        codes = [x.get("Error", {}).get("Code") for x in resp["Responses"]]
+        result["throttled"] += any(code in THROTTLING_ERRORS for code in codes)
+
+        retry = []
+        for item, code in zip(pending, codes):
+            if code is None:
+                result["updated"] += 1
+            elif code == "ConditionalCheckFailed":
+                result["skipped"] += 1
+            elif code in RETRYABLE_STATEMENT_ERRORS:
+                retry.append(item)
+            else:
+                print(f"Failed to update {item['email']=} {item['code']=}: {code}")
+                result["failed"] += 1
+        pending = retry
+
+        if not pending:
+            break
+
+    result["failed"] += len(pending)
+    return result
+
+
 def __generate_update_expr(payload: dict):
     """
     Given key-value pairs, generate UpdateExpression
@@ -2,6 +2,27 @@ from datetime import datetime
 from enum import Enum
 from dataclasses import dataclass
 
+# partition key reserved for service bookkeeping items (e.g. scheduler watermark)
+# `#` never appears in a valid email, so it cannot clash with an invitation
+META_EMAIL = "#meta"
+# sort key, under META_EMAIL, of the marker `backfill_pending_shards` leaves
+# once done, the scheduler only reads the pending expiry GSI after it
+PENDING_GSI_READY_CODE = "pending_gsi#ready"
+# partition key prefix of expiry timers, e.g. `#timer#abc@gmail.com`
+# the timer of an invitation is deleted by DynamoDB TTL at its expiry
+TIMER_EMAIL_PREFIX = "#timer#"
+# TTL attribute of expiry timers, epoch seconds
+TIMER_TTL_ATTRIBUTE = "expires_at"
+# partition key prefix of the per-status invitation counters, e.g. `#counter#03`
+# increments go to a random one of COUNTER_SHARD_COUNT items, reads sum them all
+COUNTER_EMAIL_PREFIX = "#counter#"
+COUNTER_CODE = "counter"
+COUNTER_SHARD_COUNT = 8
+# counter attribute summed into the table change version, see `add_to_counters`
+CHANGE_VERSION_ATTRIBUTE = "version"
+# short name of `created_date` (epoch seconds) in the compact storage format
+COMPACT_CREATED_DATE = "cd"
+
 
 class InvitationStatus(str, Enum):
     UNCONFIRMED = "unconfirmed"
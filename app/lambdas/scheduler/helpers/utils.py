@@ -0,0 +1,111 @@
+import threading
+import time
+from typing import Union
+
+from .schemas import TIMER_EMAIL_PREFIX
+
+# principal of the deletions DynamoDB TTL makes on its own
+TTL_PRINCIPAL = "dynamodb.amazonaws.com"
+
+
+def parse_expiry_timer_removal(record: dict) -> Union[None, dict]:
+    """
+    Key of the invitation whose expiry timer a DynamoDB stream `record`
+    reports deleted by TTL, None for any other record.
+    """
+    identity = record.get("userIdentity") or {}
+    if (
+        record.get("eventName") != "REMOVE"
+        or identity.get("principalId") != TTL_PRINCIPAL
+    ):
+        return None
+
+    keys = record["dynamodb"]["Keys"]
+    email = keys["email"]["S"]
+    if not email.startswith(TIMER_EMAIL_PREFIX):
+        return None
+    return {"email": email[len(TIMER_EMAIL_PREFIX) :], "code": keys["code"]["S"]}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, e.g. to keep writes under a WCU budget.
+    `rate` tokens are added per second, up to `capacity`, and may go
+    negative for requests larger than `capacity`.
+    A non-positive `rate` disables limiting.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Block until `tokens` are available and take them.
+        return seconds spent waiting
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        # a request larger than the bucket would never fit: it goes once the
+        # bucket is full and is charged in full, the debt is waited out by
+        # the following requests, so the rate holds either way
+        needed = min(tokens, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return waited
+                wait = (needed - self.tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit with additive increase / multiplicative decrease:
+    halved on every throttled request, raised by one after
+    `increase_every` consecutive successful ones.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, increase_every: int = 10):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.increase_every = increase_every
+        self.limit = max_limit
+        self.in_flight = 0
+        self.successes = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self.successes = 0
+                print(f"Throttled, concurrency limit down to {self.limit}")
+            else:
+                self.successes += 1
+                if (
+                    self.successes >= self.increase_every
+                    and self.limit < self.max_limit
+                ):
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
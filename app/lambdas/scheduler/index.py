@@ -1,21 +1,57 @@
+import json
 import os
 
-import boto3
-
-from helpers.controllers import process_expired_unconfirmed_invitations
+from helpers.clients import get_client, get_table
+from helpers.controllers import (
+    process_expired_unconfirmed_invitations,
+    reconcile_counters,
+)
 
 TABLE_NAME = os.environ["TABLE_NAME"]
 TABLE_GSI_NAME = os.environ["TABLE_GSI_NAME"]
+TABLE_SHARDED_GSI_NAME = os.environ.get("TABLE_SHARDED_GSI_NAME")
+TABLE_PENDING_GSI_NAME = os.environ.get("TABLE_PENDING_GSI_NAME")
+# 0 keeps reading the unsharded status GSI
+STATUS_SHARD_COUNT = int(os.environ.get("STATUS_SHARD_COUNT") or 0)
+SCHEDULER_MAX_WORKERS = int(os.environ.get("SCHEDULER_MAX_WORKERS") or 10)
+# 0 disables the write rate limit
+SCHEDULER_WCU_PER_SECOND = float(os.environ.get("SCHEDULER_WCU_PER_SECOND") or 0)
+# how many times a run may re-invoke itself to finish a backlog, 0 to disable
+SCHEDULER_MAX_CONTINUATIONS = int(os.environ.get("SCHEDULER_MAX_CONTINUATIONS") or 0)
 
 
 def handler(event, context):
     print(event)
     print(context)
 
-    dynamodb = boto3.resource("dynamodb")
-    table = dynamodb.Table(TABLE_NAME)
+    table = get_table(TABLE_NAME)
+
+    if (event or {}).get("job") == "reconcile_counters":
+        return reconcile_counters(
+            table,
+            TABLE_GSI_NAME,
+            shard_count=STATUS_SHARD_COUNT,
+            sharded_gsi_name=TABLE_SHARDED_GSI_NAME,
+        )
 
-    process_expired_unconfirmed_invitations(
+    stats = process_expired_unconfirmed_invitations(
         table=table,
         gsi_name=TABLE_GSI_NAME,
+        max_workers=SCHEDULER_MAX_WORKERS,
+        wcu_per_second=SCHEDULER_WCU_PER_SECOND,
+        time_left_ms=context.get_remaining_time_in_millis,
+        shard_count=STATUS_SHARD_COUNT,
+        sharded_gsi_name=TABLE_SHARDED_GSI_NAME,
+        pending_gsi_name=TABLE_PENDING_GSI_NAME,
     )
+
+    # stopped before the deadline, pick the checkpoint up right away
+    # instead of waiting for the next scheduled run
+    continuation = (event or {}).get("continuation", 0)
+    if stats["stopped"] and continuation < SCHEDULER_MAX_CONTINUATIONS:
+        print(f"Continuing in a new invocation ({continuation + 1})")
+        get_client("lambda").invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType="Event",
+            Payload=json.dumps({"continuation": continuation + 1}),
+        )
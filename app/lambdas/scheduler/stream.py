@@ -0,0 +1,20 @@
+import os
+
+from helpers.clients import get_table
+from helpers.controllers import process_expiry_timer_records
+
+TABLE_NAME = os.environ["TABLE_NAME"]
+# 0 keeps the unsharded status GSI
+STATUS_SHARD_COUNT = int(os.environ.get("STATUS_SHARD_COUNT") or 0)
+
+
+def handler(event, context):
+    print(f"{len(event['Records'])} stream records")
+
+    table = get_table(TABLE_NAME)
+
+    return process_expiry_timer_records(
+        table=table,
+        records=event["Records"],
+        shard_count=STATUS_SHARD_COUNT,
+    )
@@ -0,0 +1,40 @@
+"""
+Set `pending_shard` on existing unconfirmed invitations so the sparse pending
+expiry GSI sees them. Run once after deploying the GSI, from `app/`:
+    python -m scripts.backfill_pending_shards
+The scheduler only switches to the pending expiry GSI once this completes.
+"""
+import argparse
+import os
+
+import boto3
+from dotenv import load_dotenv
+
+from lambdas.invitation.helpers.queries import backfill_pending_shards
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        default=int(os.environ.get("STATUS_SHARD_COUNT") or 0),
+    )
+    parser.add_argument("--total-segments", type=int, default=4)
+    parser.add_argument("--wcu-per-second", type=float, default=0)
+    args = parser.parse_args()
+
+    table = boto3.resource("dynamodb").Table(os.environ["TABLE_NAME"])
+    updated = backfill_pending_shards(
+        table=table,
+        shard_count=args.shard_count,
+        total_segments=args.total_segments,
+        wcu_per_second=args.wcu_per_second,
+    )
+    print(f"Backfilled pending_shard on {updated} invitations.")
+
+
+if __name__ == "__main__":
+    main()
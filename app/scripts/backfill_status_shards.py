@@ -0,0 +1,42 @@
+"""
+Set `status_shard` on existing invitations so the sharded status GSI sees them.
+Run after enabling STATUS_SHARD_COUNT (or changing it), from `app/`:
+    python -m scripts.backfill_status_shards
+"""
+import argparse
+import os
+
+import boto3
+from dotenv import load_dotenv
+
+from lambdas.invitation.helpers.queries import backfill_status_shards
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--shard-count",
+        type=int,
+        default=int(os.environ.get("STATUS_SHARD_COUNT") or 0),
+    )
+    parser.add_argument("--total-segments", type=int, default=4)
+    parser.add_argument("--wcu-per-second", type=float, default=0)
+    args = parser.parse_args()
+
+    if args.shard_count < 1:
+        parser.error("--shard-count (or STATUS_SHARD_COUNT) must be positive")
+
+    table = boto3.resource("dynamodb").Table(os.environ["TABLE_NAME"])
+    updated = backfill_status_shards(
+        table=table,
+        shard_count=args.shard_count,
+        total_segments=args.total_segments,
+        wcu_per_second=args.wcu_per_second,
+    )
+    print(f"Backfilled status_shard on {updated} invitations.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+Rewrite existing invitations in the compact storage format, with an epoch
+`created_date` under a short name. Run after setting ITEM_FORMAT=compact, from `app/`:
+    python -m scripts.compact_items
+"""
+import argparse
+import os
+
+import boto3
+from dotenv import load_dotenv
+
+from lambdas.invitation.helpers.queries import compact_items
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--total-segments", type=int, default=4)
+    parser.add_argument("--wcu-per-second", type=float, default=0)
+    args = parser.parse_args()
+
+    table = boto3.resource("dynamodb").Table(os.environ["TABLE_NAME"])
+    updated = compact_items(
+        table=table,
+        total_segments=args.total_segments,
+        wcu_per_second=args.wcu_per_second,
+    )
+    print(f"Compacted {updated} invitations.")
+
+
+if __name__ == "__main__":
+    main()
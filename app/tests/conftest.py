@@ -6,6 +6,7 @@ import pytest
 import moto
 from dotenv import load_dotenv
 
+from lambdas.invitation.helpers.queries import ITEM_CACHE
 from lambdas.invitation.helpers.utils import generate_invitation, generate_code
 from lambdas.invitation.helpers.schemas import Invitation, InvitationStatus
 
@@ -15,14 +16,20 @@ def lambda_environment():
     load_dotenv()
     print(os.environ["TABLE_NAME"])
     print(os.environ["TABLE_GSI_NAME"])
+    print(os.environ["TABLE_SHARDED_GSI_NAME"])
+    print(os.environ["TABLE_PENDING_GSI_NAME"])
 
 
 @pytest.fixture
 def create_table(lambda_environment):
     TABLE_NAME = os.environ["TABLE_NAME"]
     TABLE_GSI_NAME = os.environ["TABLE_GSI_NAME"]
+    TABLE_SHARDED_GSI_NAME = os.environ["TABLE_SHARDED_GSI_NAME"]
+    TABLE_PENDING_GSI_NAME = os.environ["TABLE_PENDING_GSI_NAME"]
 
-    with moto.mock_dynamodb():
+    # every test gets a fresh table, drop what the last one cached
+    ITEM_CACHE.clear()
+    with moto.mock_aws():
         client = boto3.client("dynamodb")
         client.create_table(
             TableName=TABLE_NAME,
@@ -35,6 +42,8 @@ def create_table(lambda_environment):
                 {"AttributeName": "code", "AttributeType": "S"},
                 {"AttributeName": "invite_status", "AttributeType": "S"},
                 {"AttributeName": "expiry_date", "AttributeType": "S"},
+                {"AttributeName": "status_shard", "AttributeType": "S"},
+                {"AttributeName": "pending_shard", "AttributeType": "S"},
             ],
             BillingMode="PAY_PER_REQUEST",
             GlobalSecondaryIndexes=[
@@ -47,7 +56,27 @@ def create_table(lambda_environment):
                     "Projection": {
                         "ProjectionType": "ALL",
                     },
-                }
+                },
+                {
+                    "IndexName": TABLE_SHARDED_GSI_NAME,
+                    "KeySchema": [
+                        {"AttributeName": "status_shard", "KeyType": "HASH"},
+                        {"AttributeName": "expiry_date", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {
+                        "ProjectionType": "ALL",
+                    },
+                },
+                {
+                    "IndexName": TABLE_PENDING_GSI_NAME,
+                    "KeySchema": [
+                        {"AttributeName": "pending_shard", "KeyType": "HASH"},
+                        {"AttributeName": "expiry_date", "KeyType": "RANGE"},
+                    ],
+                    "Projection": {
+                        "ProjectionType": "ALL",
+                    },
+                },
             ],
         )
 
@@ -171,3 +200,23 @@ def create_expired_invitation(create_table, invite_status: InvitationStatus = No
     if invite_status:
         invitation.invite_status = invite_status
     create_table.put_item(Item=invitation.__dict__)
+
+
+@pytest.fixture
+def populate_table(create_table):
+    """
+    Bulk load `count` unconfirmed invitations for benchmarks.
+    return the table
+    """
+
+    def populate(count: int):
+        with create_table.batch_writer() as batch:
+            for i in range(count):
+                invitation = generate_invitation(
+                    email=f"user{i:07d}@gmail.com",
+                    code=generate_code(),
+                )
+                batch.put_item(Item=invitation.__dict__)
+        return create_table
+
+    yield populate
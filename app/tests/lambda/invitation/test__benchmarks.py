@@ -0,0 +1,148 @@
+"""
+Opt-in benchmarks, run with:
+    RUN_BENCHMARKS=1 pytest -s tests/lambda/invitation/test__benchmarks.py
+
+moto answers in-process without network round trips, so a simulated
+per-request latency is added to get numbers closer to real DynamoDB.
+moto itself is CPU bound behind the GIL (every segment request walks the
+whole table), so the printed timings understate the gain seen against
+real DynamoDB, where a scan page is dominated by network latency.
+"""
+import math
+import os
+import time
+
+from boto3.dynamodb.types import TypeDeserializer
+import pytest
+
+from lambdas.invitation.helpers.clients import get_client
+from lambdas.invitation.helpers.queries import (
+    decode_item,
+    get_all,
+    pending_shard,
+    status_shard,
+)
+from lambdas.invitation.helpers.schemas import to_compact_item
+from lambdas.invitation.helpers.utils import generate_code, generate_invitation
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("RUN_BENCHMARKS"),
+    reason="set RUN_BENCHMARKS=1 to run benchmarks",
+)
+
+SIMULATED_LATENCY_SECONDS = 0.02
+
+
+def with_latency(table, monkeypatch):
+    # reads go through the low-level client
+    client = get_client("dynamodb")
+    scan = client.scan
+
+    def slow_scan(**kwargs):
+        time.sleep(SIMULATED_LATENCY_SECONDS)
+        return scan(**kwargs)
+
+    monkeypatch.setattr(client, "scan", slow_scan)
+    return table
+
+
+@pytest.mark.parametrize("item_count", [10_000, 100_000], ids=["10k", "100k"])
+def test_benchmark_parallel_scan(populate_table, monkeypatch, item_count: int):
+    table = with_latency(populate_table(item_count), monkeypatch)
+
+    timings = {}
+    for total_segments in (1, 4, 8, 16):
+        t0 = time.time()
+        data = get_all(table, total_segments=total_segments)
+        timings[total_segments] = time.time() - t0
+        assert len(data) == item_count
+
+    for total_segments, elapsed in timings.items():
+        print(
+            f"{item_count=} {total_segments=} took {elapsed:.2f}s "
+            f"(speedup x{timings[1] / elapsed:.2f})"
+        )
+
+
+def test_benchmark_item_decode():
+    """
+    Per-item decode cost of a full 1 MB Scan/Query page of invitations
+    """
+    invitation = generate_invitation(
+        "someone.with.a.long.name@gmail.com", generate_code()
+    )
+    low_level_item = {k: {"S": str(v)} for k, v in invitation.__dict__.items()}
+    item_size = sum(len(k) + len(v["S"]) for k, v in low_level_item.items())
+    page = [dict(low_level_item) for _ in range(1024 * 1024 // item_size)]
+
+    deserializer = TypeDeserializer()
+    decoders = {
+        "TypeDeserializer": lambda x: {
+            k: deserializer.deserialize(v) for k, v in x.items()
+        },
+        "decode_item": decode_item,
+    }
+    timings = {}
+    for name, decode in decoders.items():
+        t0 = time.perf_counter()
+        decoded = [decode(x) for x in page]
+        timings[name] = time.perf_counter() - t0
+        assert decoded[0] == {k: str(v) for k, v in invitation.__dict__.items()}
+
+    for name, elapsed in timings.items():
+        print(
+            f"{name}: {len(page)} items ({item_size}B each) in {elapsed * 1000:.1f}ms, "
+            f"{elapsed / len(page) * 1e9:.0f}ns/item "
+            f"(speedup x{timings['TypeDeserializer'] / elapsed:.1f})"
+        )
+    assert timings["decode_item"] < timings["TypeDeserializer"]
+
+
+def item_size(item: dict) -> int:
+    """
+    Billed size of an item: attribute names plus values, strings by their
+    UTF-8 length, numbers at 1 byte per 2 significant digits plus 1.
+    """
+    size = 0
+    for k, v in item.items():
+        size += len(k.encode())
+        if isinstance(v, str):
+            size += len(v.encode())
+        else:
+            digits = str(abs(v)).strip("0").replace(".", "")
+            size += math.ceil(len(digits) / 2) + 1
+    return size
+
+
+def test_benchmark_item_size():
+    """
+    Item size and capacity units of the standard vs the compact storage
+    format, for an unconfirmed invitation with both shard keys, which is
+    written to the table and the 3 ALL-projected GSIs.
+    """
+    invitation = generate_invitation(
+        "someone.with.a.long.name@gmail.com", generate_code()
+    )
+    standard = {
+        **invitation.__dict__,
+        "status_shard": status_shard(
+            invitation.invite_status, invitation.email, invitation.code, 16
+        ),
+        "pending_shard": pending_shard(invitation.email, invitation.code, 16),
+    }
+    formats = {"standard": standard, "compact": to_compact_item(standard)}
+
+    sizes = {}
+    for name, item in formats.items():
+        sizes[name] = size = item_size(item)
+        # 1 WCU per started 1 KB, on the table and on every GSI it lands in
+        wcu = 4 * math.ceil(size / 1024)
+        # eventually consistent reads: 0.5 RCU per started 4 KB of a page
+        items_per_page = 1024 * 1024 // size
+        rcu_per_10k = math.ceil(10_000 * size / 4096) / 2
+        print(
+            f"{name}: {size}B/item, {wcu} WCU per create, "
+            f"{items_per_page} items per 1 MB page, {rcu_per_10k} RCU per 10k items read"
+        )
+    print(f"compact saves {1 - sizes['compact'] / sizes['standard']:.1%} per item")
+    assert sizes["compact"] < sizes["standard"]
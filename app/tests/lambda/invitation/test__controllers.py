@@ -1,14 +1,27 @@
+from datetime import datetime, timedelta, timezone
 import json
 
 import pytest
 
+from lambdas.invitation.helpers import controllers
 from lambdas.invitation.helpers.controllers import (
     create_new_invitation,
+    create_new_invitations,
     confirm_invitation,
+    confirm_invitations,
+    invalidate_invitation,
+    invalidate_invitations,
     review_all_invitations,
+    review_invitation_stats,
     # invalidate_invitation,
 )
+from lambdas.invitation.helpers.queries import (
+    add_to_counters,
+    backfill_status_shards,
+    get_all,
+)
 from lambdas.invitation.helpers.schemas import InvitationStatus
+from lambdas.invitation.helpers.utils import generate_invitation
 
 
 @pytest.mark.parametrize(
@@ -50,6 +63,38 @@ def test_create_new_invitation(
     assert body["message"] == response_body["message"]
 
 
+def test_create_new_invitations(empty_table):
+    emails = [f"user{i}@gmail.com" for i in range(60)]
+    resp = create_new_invitations(empty_table, {"emails": emails})
+    body = json.loads(resp["body"])
+
+    assert resp["statusCode"] == 200
+    assert body["success"] is True
+    assert body["message"] == "60 of 60 invitations created!"
+    assert [x["email"] for x in body["data"]] == emails
+    assert all(x["success"] for x in body["data"])
+    assert len(get_all(empty_table)) == 60
+
+
+@pytest.mark.parametrize(
+    "request_body",
+    [
+        {"emails": "abc@gmail.com"},
+        {"emails": []},
+        {"emails": ["abc@gmail.com", 1]},
+        {"emails": ["abc@gmail.com"] * 20_001},
+        {"emails": ["abc@gmail.com", "not-an-email"]},
+        # reserved for bookkeeping partitions
+        {"emails": ["#meta@gmail.com"]},
+        {"emails": ["abc@gmail.com", "a b@gmail.com"]},
+    ],
+)
+def test_create_new_invitations_invalid(empty_table, request_body: dict):
+    resp = create_new_invitations(empty_table, request_body)
+    assert resp["statusCode"] == 422
+    assert get_all(empty_table) == []
+
+
 @pytest.mark.parametrize(
     "query_params, items_found",
     [
@@ -73,12 +118,19 @@ def test_create_new_invitation(
             },
             1,
         ),
-        # filter by invite status
+        # filter by invite status, not counting the expired "unconfirmed" one
         (
             {
                 "invite_status": "unconfirmed",
             },
-            3,
+            2,
+        ),
+        # filter by invite status, counting the expired "unconfirmed" one
+        (
+            {
+                "invite_status": "expired",
+            },
+            2,
         ),
         # filter by status, email
         (
@@ -97,6 +149,29 @@ def test_create_new_invitation(
             },
             1,
         ),
+        # filter by several statuses
+        (
+            {
+                "invite_status": "unconfirmed,expired",
+            },
+            4,
+        ),
+        # filter by several statuses, email, code
+        (
+            {
+                "invite_status": "expired,confirmed",
+                "email": "abc@gmail.com",
+                "code": "ABCD1200",
+            },
+            1,
+        ),
+        # empty pieces of the list are dropped
+        (
+            {
+                "invite_status": "unconfirmed,,expired,",
+            },
+            4,
+        ),
     ],
 )
 def test_review_all_invitations(
@@ -111,6 +186,428 @@ def test_review_all_invitations(
     assert len(data) == items_found
 
 
+@pytest.mark.parametrize(
+    "query_params, items_found",
+    [
+        # scan
+        ({}, 6),
+        # query by email
+        ({"email": "abc@gmail.com"}, 2),
+        # query by invite status
+        ({"invite_status": "unconfirmed"}, 2),
+        # query by invite status, over both the expired and unconfirmed partitions
+        ({"invite_status": "expired"}, 2),
+    ],
+)
+@pytest.mark.parametrize("total_segments", ["1", "3"])
+def test_review_all_invitations_paginated(
+    table_with_items,
+    monkeypatch,
+    query_params: dict,
+    items_found: int,
+    total_segments: str,
+):
+    monkeypatch.setenv("SCAN_TOTAL_SEGMENTS", total_segments)
+    data = []
+    pages = 0
+    next_token = None
+    while True:
+        params = {**query_params, "limit": "1"}
+        if next_token:
+            params["next_token"] = next_token
+
+        resp = review_all_invitations(table_with_items, params)
+        assert resp["statusCode"] == 200
+
+        body = json.loads(resp["body"])
+        assert len(body["data"]) <= 1
+        data.extend(body["data"])
+        pages += 1
+
+        next_token = body.get("next_token")
+        if next_token is None:
+            break
+
+    assert len(data) == items_found
+    assert len({(d["email"], d["code"]) for d in data}) == items_found
+
+
+def test_review_all_invitations_sharded(table_with_items, monkeypatch):
+    monkeypatch.setenv("STATUS_SHARD_COUNT", "4")
+
+    # new invitations carry their shard key from the start
+    resp = create_new_invitation(table_with_items, {"email": "new@gmail.com"})
+    assert json.loads(resp["body"])["success"] is True
+
+    # existing ones are backfilled
+    backfill_status_shards(table_with_items, shard_count=4)
+
+    data = []
+    next_token = None
+    while True:
+        params = {"invite_status": "unconfirmed", "limit": "2"}
+        if next_token:
+            params["next_token"] = next_token
+        body = json.loads(review_all_invitations(table_with_items, params)["body"])
+        data.extend(body["data"])
+        next_token = body.get("next_token")
+        if next_token is None:
+            break
+
+    assert len(data) == 3
+    assert all(x["status_shard"].startswith("unconfirmed#") for x in data)
+
+    # confirming moves the item to a confirmed shard, which is not returned
+    key = {"email": "abc@gmail.com", "code": "ABCD1234"}
+    data = json.loads(confirm_invitation(table_with_items, key)["body"])["data"]
+    assert data["invite_status"] == "confirmed"
+    assert "status_shard" not in data and "pending_shard" not in data
+    item = table_with_items.get_item(Key=key)["Item"]
+    assert item["status_shard"].startswith("confirmed#")
+
+
+def test_review_all_invitations_etag_sharded(table_with_items, monkeypatch):
+    monkeypatch.setenv("STATUS_SHARD_COUNT", "4")
+    backfill_status_shards(table_with_items, shard_count=4)
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    next_expiry = min(
+        x["expiry_date"]
+        for x in table_with_items.scan()["Items"]
+        if x.get("invite_status") == "unconfirmed" and x["expiry_date"] > now
+    )
+
+    # the status GSI is not read at all once sharding is on
+    monkeypatch.setenv("TABLE_GSI_NAME", "missing")
+    resp = review_all_invitations(table_with_items, {"invite_status": "confirmed"})
+    assert resp["statusCode"] == 200
+    fresh_until = int(resp["headers"]["ETag"].strip('"').split("-")[1])
+    assert fresh_until == int(
+        datetime.strptime(next_expiry, "%Y-%m-%dT%H:%M:%SZ")
+        .replace(tzinfo=timezone.utc)
+        .timestamp()
+    )
+
+
+def test_review_all_invitations_effective_status(table_with_items):
+    # "unconfirmed" in the table, but already past its expiry date
+    resp = review_all_invitations(
+        table_with_items, {"email": "abc@gmail.com", "code": "ABCD1200"}
+    )
+    data = json.loads(resp["body"])["data"]
+    assert [x["invite_status"] for x in data] == ["expired"]
+
+    resp = review_all_invitations(table_with_items, {"invite_status": "expired"})
+    data = json.loads(resp["body"])["data"]
+    assert {x["code"] for x in data} == {"EXPIRED01", "ABCD1200"}
+    assert all(x["invite_status"] == "expired" for x in data)
+
+
+@pytest.mark.parametrize(
+    "query_params",
+    [
+        # non-numeric limit
+        {"limit": "abc"},
+        # non-positive limit
+        {"limit": "0"},
+        # garbage token
+        {"next_token": "not-a-token"},
+    ],
+)
+def test_review_all_invitations_invalid_pagination(
+    table_with_items,
+    query_params: dict,
+):
+    resp = review_all_invitations(table_with_items, query_params)
+    assert resp["statusCode"] == 422
+
+
+@pytest.fixture
+def table_with_confirmed(empty_table):
+    # confirmed invitations expiring 1..6 days from now, two emails
+    for days in range(1, 7):
+        invitation = generate_invitation(
+            "abc@gmail.com" if days % 2 else "def@yahoo.com", f"CODE000{days}", days
+        )
+        invitation.invite_status = InvitationStatus.CONFIRMED
+        empty_table.put_item(Item=invitation.__dict__)
+    yield empty_table
+
+
+def __expiring_in(days: int) -> str:
+    return (datetime.now(timezone.utc) + timedelta(days=days)).strftime(
+        "%Y-%m-%dT%H:%M:%SZ"
+    )
+
+
+def __review_all_pages(table, query_params: dict) -> list[dict]:
+    data = []
+    next_token = None
+    while True:
+        params = {**query_params}
+        if next_token:
+            params["next_token"] = next_token
+        resp = review_all_invitations(table, params)
+        assert resp["statusCode"] == 200
+        body = json.loads(resp["body"])
+        data.extend(body["data"])
+        next_token = body.get("next_token")
+        if next_token is None:
+            return data
+
+
+@pytest.mark.parametrize(
+    "query_params, codes",
+    [
+        # email pushed down as a filter, across pages
+        (
+            {"email": "def@yahoo.com", "limit": "2"},
+            ["CODE0002", "CODE0004", "CODE0006"],
+        ),
+        # expiry range
+        (
+            {
+                "expiring_after": __expiring_in(2.5),
+                "expiring_before": __expiring_in(5.5),
+            },
+            ["CODE0003", "CODE0004", "CODE0005"],
+        ),
+        # expiry range and email
+        (
+            {"expiring_before": __expiring_in(4.5), "email": "abc@gmail.com"},
+            ["CODE0001", "CODE0003"],
+        ),
+        # latest first
+        (
+            {"order": "desc", "limit": "4"},
+            ["CODE0006", "CODE0005", "CODE0004", "CODE0003", "CODE0002", "CODE0001"],
+        ),
+        # empty range
+        (
+            {"expiring_after": __expiring_in(3), "expiring_before": __expiring_in(2)},
+            [],
+        ),
+    ],
+)
+@pytest.mark.parametrize("shard_count", ["0", "4"])
+def test_review_all_invitations_pushed_down(
+    table_with_confirmed,
+    monkeypatch,
+    query_params: dict,
+    codes: list,
+    shard_count: str,
+):
+    monkeypatch.setenv("STATUS_SHARD_COUNT", shard_count)
+    if shard_count != "0":
+        backfill_status_shards(table_with_confirmed, shard_count=int(shard_count))
+
+    data = __review_all_pages(
+        table_with_confirmed, {"invite_status": "confirmed", **query_params}
+    )
+    assert [x["code"] for x in data] == codes
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("shard_count", ["0", "4"])
+def test_review_all_invitations_many_statuses(
+    table_with_items,
+    monkeypatch,
+    order: str,
+    shard_count: str,
+):
+    monkeypatch.setenv("STATUS_SHARD_COUNT", shard_count)
+    if shard_count != "0":
+        backfill_status_shards(table_with_items, shard_count=int(shard_count))
+
+    data = __review_all_pages(
+        table_with_items,
+        {
+            "invite_status": "confirmed,expired,unconfirmed",
+            "order": order,
+            "limit": "2",
+        },
+    )
+    assert {x["invite_status"] for x in data} == {"confirmed", "expired", "unconfirmed"}
+    assert len(data) == 5
+    # one expiry_date order across statuses
+    assert [x["expiry_date"] for x in data] == sorted(
+        (x["expiry_date"] for x in data), reverse=order == "desc"
+    )
+
+
+def test_review_all_invitations_top_n(table_with_confirmed):
+    resp = review_all_invitations(
+        table_with_confirmed,
+        {"invite_status": "confirmed", "order": "desc", "limit": "2"},
+    )
+    body = json.loads(resp["body"])
+    assert [x["code"] for x in body["data"]] == ["CODE0006", "CODE0005"]
+    assert body["next_token"]
+
+
+@pytest.mark.parametrize(
+    "query_params",
+    [
+        {"invite_status": "confirmed", "expiring_before": "tomorrow"},
+        {"invite_status": "confirmed", "expiring_after": "2024-01-31"},
+        # not zero-padded, would compare wrong as a string
+        {"invite_status": "confirmed", "expiring_after": "2024-1-5T0:0:0Z"},
+        {"invite_status": "confirmed", "order": "newest"},
+        # need an invite status
+        {"order": "desc"},
+        {"email": "abc@gmail.com", "expiring_before": "2024-01-31T00:00:00Z"},
+    ],
+)
+def test_review_all_invitations_invalid_range(
+    table_with_confirmed,
+    query_params: dict,
+):
+    resp = review_all_invitations(table_with_confirmed, query_params)
+    assert resp["statusCode"] == 422
+
+
+@pytest.mark.parametrize(
+    "query_params",
+    [
+        {},
+        {"email": "abc@gmail.com"},
+        {"email": "abc@gmail.com", "code": "ABCD1234"},
+        {"invite_status": "expired"},
+        {"invite_status": "unconfirmed", "limit": "1"},
+    ],
+)
+@pytest.mark.parametrize("shard_count", ["0", "4"])
+def test_review_all_invitations_fields(
+    table_with_items,
+    monkeypatch,
+    query_params: dict,
+    shard_count: str,
+):
+    monkeypatch.setenv("STATUS_SHARD_COUNT", shard_count)
+    if shard_count != "0":
+        backfill_status_shards(table_with_items, shard_count=int(shard_count))
+
+    expected = __review_all_pages(table_with_items, query_params)
+    data = __review_all_pages(
+        table_with_items, {**query_params, "fields": "email,invite_status"}
+    )
+    assert data
+    assert data == [
+        {"email": x["email"], "invite_status": x["invite_status"]} for x in expected
+    ]
+
+
+def test_review_all_invitations_unknown_fields(table_with_items):
+    resp = review_all_invitations(table_with_items, {"fields": "email,status_shard"})
+    assert resp["statusCode"] == 422
+
+
+def test_review_latest_invitation(table_with_items, monkeypatch):
+    monkeypatch.setenv("CODE_FORMAT", "time")
+    codes = []
+    for _ in range(3):
+        resp = create_new_invitation(table_with_items, {"email": "abc@gmail.com"})
+        codes.append(json.loads(resp["body"])["data"]["code"])
+    assert all(x[0].isdigit() for x in codes)
+
+    resp = review_all_invitations(
+        table_with_items, {"email": "abc@gmail.com", "latest": "true"}
+    )
+    assert [x["code"] for x in json.loads(resp["body"])["data"]] == [max(codes)]
+
+    # newest active one
+    confirm_invitation(table_with_items, {"email": "abc@gmail.com", "code": max(codes)})
+    resp = review_all_invitations(
+        table_with_items,
+        {
+            "email": "abc@gmail.com",
+            "latest": "true",
+            "invite_status": "unconfirmed",
+            "fields": "code",
+        },
+    )
+    assert json.loads(resp["body"])["data"] == [{"code": sorted(codes)[1]}]
+
+    # only legacy codes match
+    resp = review_all_invitations(
+        table_with_items,
+        {"email": "abc@gmail.com", "latest": "true", "invite_status": "expired"},
+    )
+    assert [x["code"] for x in json.loads(resp["body"])["data"]] == ["ABCD1200"]
+
+
+@pytest.mark.parametrize(
+    "query_params",
+    [
+        {"latest": "true"},
+        {"latest": "true", "email": "abc@gmail.com", "code": "ABCD1234"},
+    ],
+)
+def test_review_latest_invitation_invalid(table_with_items, query_params: dict):
+    resp = review_all_invitations(table_with_items, query_params)
+    assert resp["statusCode"] == 422
+
+
+@pytest.mark.parametrize(
+    "invite_status",
+    ["pending", "unconfirmed,pending", "Expired", ",", ""],
+)
+def test_review_all_invitations_invalid_status(table_with_items, invite_status):
+    resp = review_all_invitations(table_with_items, {"invite_status": invite_status})
+    assert resp["statusCode"] == 422
+
+
+def test_review_all_invitations_cursor_keeps_first_page_now(
+    table_with_items, monkeypatch
+):
+    partitions = []
+    query_by_gsi_merged_page = controllers.query_by_gsi_merged_page
+
+    def spy(**kwargs):
+        partitions.append(kwargs["partitions"])
+        return query_by_gsi_merged_page(**kwargs)
+
+    monkeypatch.setattr(controllers, "query_by_gsi_merged_page", spy)
+    params = {"invite_status": "unconfirmed", "limit": "1"}
+    next_token = json.loads(review_all_invitations(table_with_items, params)["body"])[
+        "next_token"
+    ]
+
+    class Later(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(days=30)
+
+    # the next page is requested after every unconfirmed one has expired
+    monkeypatch.setattr(controllers, "datetime", Later)
+    resp = review_all_invitations(
+        table_with_items, {**params, "next_token": next_token}
+    )
+
+    # same key conditions as the first page, so its start key is still inside
+    assert resp["statusCode"] == 200
+    assert partitions[1] == partitions[0]
+    # but nothing expired since is returned as unconfirmed
+    assert json.loads(resp["body"])["data"] == []
+
+
+def test_review_all_invitations_rejects_foreign_token(table_with_items):
+    resp = review_all_invitations(table_with_items, {"limit": "1"})
+    next_token = json.loads(resp["body"])["next_token"]
+
+    # tampered token
+    resp = review_all_invitations(
+        table_with_items, {"limit": "1", "next_token": next_token[:-2] + "xx"}
+    )
+    assert resp["statusCode"] == 422
+
+    # token issued for a scan cannot be replayed on a status query
+    resp = review_all_invitations(
+        table_with_items,
+        {"invite_status": "unconfirmed", "next_token": next_token},
+    )
+    assert resp["statusCode"] == 422
+
+
 @pytest.mark.parametrize(
     "request_body, status_code, message, invite_status",
     [
@@ -202,5 +699,236 @@ def test_confirm_invitation(
         assert body["data"]["invite_status"] == invite_status
 
 
-# def test_invalidate_invitation():
-#     ...
+def test_confirm_invitation_only_once(table_with_items):
+    request_body = {"email": "abc@gmail.com", "code": "ABCD1234"}
+    first = json.loads(confirm_invitation(table_with_items, request_body)["body"])
+    second = json.loads(confirm_invitation(table_with_items, request_body)["body"])
+
+    assert first["message"] == "Invitate code: ABCD1234 status changed to confirmed."
+    assert second["message"] == "Invite code: ABCD1234 already confirmed."
+
+
+@pytest.mark.parametrize(
+    "request_body, status_code, message, invite_status",
+    [
+        # Missing request body key-value
+        ({"code": "ABCD1234"}, 422, "Missing 'code' or 'email'.", None),
+        # Code does not exist
+        (
+            {"email": "abc@gmail.com", "code": "DONTEXIST"},
+            404,
+            "Invite code: DONTEXIST is invalid or does not exist.",
+            None,
+        ),
+        # Code already confirmed
+        (
+            {"email": "confirmed@gmail.com", "code": "CONFIRM01"},
+            200,
+            "Invite code: CONFIRM01 already confirmed.",
+            InvitationStatus.CONFIRMED,
+        ),
+        # Code expired but status still "unconfirmed"
+        (
+            {"email": "abc@gmail.com", "code": "ABCD1200"},
+            200,
+            "Invite code: ABCD1200 already expired.",
+            InvitationStatus.UNCONFIRMED,
+        ),
+        # Invitation invalidated!
+        (
+            {"email": "abc@gmail.com", "code": "ABCD1234"},
+            200,
+            "Invitate code: ABCD1234 status changed to invalidated.",
+            InvitationStatus.INVALIDATED,
+        ),
+    ],
+)
+def test_invalidate_invitation(
+    table_with_items,
+    request_body: dict,
+    status_code: int,
+    message: str,
+    invite_status: InvitationStatus,
+):
+    resp = invalidate_invitation(table_with_items, request_body)
+    assert resp["statusCode"] == status_code
+
+    body = json.loads(resp["body"])
+    assert body["message"] == message
+
+    if invite_status is not None:
+        assert body["data"]["invite_status"] == invite_status
+
+
+BULK_KEYS = [
+    {"email": "abc@gmail.com", "code": "ABCD1234"},
+    {"email": "def@yahoo.com", "code": "DEFG5678"},
+    {"email": "confirmed@gmail.com", "code": "CONFIRM01"},
+    {"email": "abc@gmail.com", "code": "DONTEXIST"},
+]
+
+
+def test_invalidate_invitations(table_with_items):
+    resp = invalidate_invitations(table_with_items, {"keys": BULK_KEYS})
+    body = json.loads(resp["body"])
+
+    assert resp["statusCode"] == 200
+    assert body["message"] == "2 of 4 invitations invalidated."
+    assert [x["message"] for x in body["data"]["results"]] == [
+        "Invitate code: ABCD1234 status changed to invalidated.",
+        "Invitate code: DEFG5678 status changed to invalidated.",
+        "Invite code: CONFIRM01 already confirmed.",
+        "Invite code: DONTEXIST is invalid or does not exist.",
+    ]
+    assert body["data"]["latency_ms"] >= 0
+
+
+def test_invalidate_invitations_transactional(table_with_items):
+    resp = invalidate_invitations(
+        table_with_items, {"keys": BULK_KEYS, "transactional": True}
+    )
+    body = json.loads(resp["body"])
+
+    # one failed condition rolls the whole group back
+    assert body["data"]["updated"] == 0
+    assert not any(x["success"] for x in body["data"]["results"])
+
+    resp = invalidate_invitations(
+        table_with_items, {"keys": BULK_KEYS[:2], "transactional": True}
+    )
+    assert json.loads(resp["body"])["data"]["updated"] == 2
+
+
+def test_invalidate_invitations_by_domain(table_with_items):
+    resp = invalidate_invitations(table_with_items, {"email_domain": "gmail.com"})
+    body = json.loads(resp["body"])
+
+    # the expired "unconfirmed" one is left alone
+    assert [x["code"] for x in body["data"]["results"]] == ["ABCD1234"]
+    assert body["data"]["updated"] == 1
+    assert "next_token" not in body
+
+
+@pytest.mark.parametrize("shard_count", ["0", "4"])
+def test_invalidate_invitations_by_domain_paged(
+    empty_table, monkeypatch, shard_count: str
+):
+    monkeypatch.setenv("STATUS_SHARD_COUNT", shard_count)
+    emails = [f"user{i}@gmail.com" for i in range(5)] + [
+        "other@yahoo.com",
+        "user@gmail.com.au",
+    ]
+    create_new_invitations(empty_table, {"emails": emails})
+    # pages of 2
+    monkeypatch.setattr(controllers, "MAX_BULK_INVITATIONS", 2)
+
+    invalidated = []
+    request_body = {"email_domain": "gmail.com"}
+    while True:
+        body = json.loads(invalidate_invitations(empty_table, request_body)["body"])
+        assert len(body["data"]["results"]) <= 2
+        invalidated.extend(x["email"] for x in body["data"]["results"])
+        if "next_token" not in body:
+            break
+        request_body = {**request_body, "next_token": body["next_token"]}
+
+    assert sorted(invalidated) == emails[:5]
+    # a cursor for another domain is rejected
+    resp = invalidate_invitations(
+        empty_table,
+        {"email_domain": "yahoo.com", "next_token": request_body["next_token"]},
+    )
+    assert resp["statusCode"] == 422
+
+
+@pytest.mark.parametrize(
+    "request_body",
+    [
+        {"keys": []},
+        {"keys": [{"email": "abc@gmail.com"}]},
+        {"email_domain": ""},
+    ],
+)
+def test_invalidate_invitations_invalid(table_with_items, request_body: dict):
+    resp = invalidate_invitations(table_with_items, request_body)
+    assert resp["statusCode"] == 422
+
+
+def test_confirm_invitations_capped(table_with_items):
+    keys = [{"email": "abc@gmail.com", "code": f"CODE{i:04d}"} for i in range(1001)]
+    resp = confirm_invitations(table_with_items, {"keys": keys})
+    assert resp["statusCode"] == 422
+
+    resp = confirm_invitations(table_with_items, {"keys": BULK_KEYS})
+    assert json.loads(resp["body"])["data"]["updated"] == 2
+
+
+def test_review_invitation_stats(empty_table):
+    for email in ("a@gmail.com", "b@gmail.com"):
+        create_new_invitation(empty_table, {"email": email})
+    create_new_invitations(empty_table, {"emails": ["c@gmail.com", "d@gmail.com"]})
+    keys = [{"email": x["email"], "code": x["code"]} for x in get_all(empty_table)]
+    keys.sort(key=lambda x: x["email"])
+
+    confirm_invitation(empty_table, keys[0])
+    # already confirmed ones are not counted twice
+    invalidate_invitations(empty_table, {"keys": keys[:3]})
+
+    resp = review_invitation_stats(empty_table)
+    body = json.loads(resp["body"])
+    assert resp["statusCode"] == 200
+    assert body["data"] == {
+        "unconfirmed": 1,
+        "confirmed": 1,
+        "invalidated": 2,
+        "expired": 0,
+        "total": 4,
+    }
+
+
+def test_review_all_invitations_not_modified(table_with_items, monkeypatch):
+    query_params = {"invite_status": "unconfirmed", "limit": "2"}
+    resp = review_all_invitations(table_with_items, query_params)
+    etag = resp["headers"]["ETag"]
+    assert resp["statusCode"] == 200
+
+    # nothing changed: 304 without listing anything
+    monkeypatch.setattr(
+        controllers, "query_by_gsi_merged_page", lambda **kwargs: pytest.fail("listed")
+    )
+    resp = review_all_invitations(table_with_items, query_params, if_none_match=etag)
+    assert resp["statusCode"] == 304
+    assert resp["headers"]["ETag"] == etag
+    assert "body" not in resp
+    monkeypatch.undo()
+
+    # other parameters, other ETag
+    resp = review_all_invitations(
+        table_with_items, {**query_params, "limit": "3"}, if_none_match=etag
+    )
+    assert resp["statusCode"] == 200
+    assert resp["headers"]["ETag"] != etag
+
+    # any write changes the version
+    create_new_invitation(table_with_items, {"email": "new@gmail.com"})
+    resp = review_all_invitations(table_with_items, query_params, if_none_match=etag)
+    assert resp["statusCode"] == 200
+    assert resp["headers"]["ETag"] != etag
+
+
+def test_review_all_invitations_not_modified_point_read(table_with_items):
+    query_params = {"email": "abc@gmail.com", "code": "ABCD1234"}
+    resp = review_all_invitations(table_with_items, query_params)
+    assert json.loads(resp["body"])["data"][0]["invite_status"] == "unconfirmed"
+
+    # confirmed by another container, whose cache this one does not see
+    table_with_items.update_item(
+        Key=query_params,
+        UpdateExpression="SET invite_status = :s",
+        ExpressionAttributeValues={":s": "confirmed"},
+    )
+    add_to_counters(table_with_items, {}, version=1)
+
+    # the cached item predates the new version, it is read again
+    resp = review_all_invitations(table_with_items, query_params)
+    assert json.loads(resp["body"])["data"][0]["invite_status"] == "confirmed"
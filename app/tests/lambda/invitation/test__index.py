@@ -0,0 +1,91 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), "../../../lambdas/invitation")
+
+
+@pytest.fixture
+def invitation_index(lambda_environment, monkeypatch):
+    """
+    Import the handler module the way Lambda does, with its own `helpers`
+    """
+    monkeypatch.syspath_prepend(os.path.abspath(LAMBDA_DIR))
+    yield importlib.import_module("index")
+
+    for name in list(sys.modules):
+        if name in ("index", "helpers") or name.startswith("helpers."):
+            del sys.modules[name]
+
+
+def test_handler_uses_injected_table(invitation_index, table_with_items):
+    clients = sys.modules["helpers.clients"]
+    clients.set_table(os.environ["TABLE_NAME"], table_with_items)
+
+    event = {
+        "requestContext": {"http": {"method": "GET"}},
+        "queryStringParameters": {"email": "abc@gmail.com"},
+    }
+    resp = invitation_index.handler(event, None)
+    assert resp["statusCode"] == 200
+    assert len(json.loads(resp["body"])["data"]) == 2
+
+    # the same table (and client) serves every warm invocation
+    assert clients.get_table(os.environ["TABLE_NAME"]) is table_with_items
+    clients.reset()
+
+
+def test_handler_routes_stats(invitation_index, empty_table):
+    clients = sys.modules["helpers.clients"]
+    clients.set_table(os.environ["TABLE_NAME"], empty_table)
+
+    event = {"requestContext": {"http": {"method": "GET", "path": "/invitation/stats"}}}
+    resp = invitation_index.handler(event, None)
+    assert resp["statusCode"] == 200
+    assert json.loads(resp["body"])["data"]["total"] == 0
+    clients.reset()
+
+
+def test_handler_answers_conditional_get(invitation_index, table_with_items):
+    clients = sys.modules["helpers.clients"]
+    clients.set_table(os.environ["TABLE_NAME"], table_with_items)
+
+    event = {
+        "requestContext": {"http": {"method": "GET"}},
+        "queryStringParameters": {"email": "abc@gmail.com"},
+    }
+    etag = invitation_index.handler(event, None)["headers"]["ETag"]
+    resp = invitation_index.handler({**event, "headers": {"if-none-match": etag}}, None)
+    assert resp["statusCode"] == 304
+    clients.reset()
+
+
+def test_get_table_is_reused(invitation_index, create_table):
+    clients = sys.modules["helpers.clients"]
+    table = clients.get_table(os.environ["TABLE_NAME"])
+
+    assert clients.get_table(os.environ["TABLE_NAME"]) is table
+    assert table.meta.client.meta.config.max_pool_connections == (
+        clients.MAX_POOL_CONNECTIONS
+    )
+    clients.reset()
+
+
+def test_handler_routes_bulk_confirm(invitation_index, table_with_items):
+    clients = sys.modules["helpers.clients"]
+    clients.set_table(os.environ["TABLE_NAME"], table_with_items)
+
+    body = json.dumps({"keys": [{"email": "abc@gmail.com", "code": "ABCD1234"}]})
+    # not on the public route
+    event = {"requestContext": {"http": {"method": "PUT", "path": "/invitation"}}}
+    resp = invitation_index.handler({**event, "body": body}, None)
+    assert resp["statusCode"] == 422
+
+    event = {"requestContext": {"http": {"method": "PUT", "path": "/invitation/bulk"}}}
+    resp = invitation_index.handler({**event, "body": body}, None)
+    assert resp["statusCode"] == 200
+    assert json.loads(resp["body"])["data"]["updated"] == 1
+    clients.reset()
@@ -1,21 +1,58 @@
+from datetime import datetime, timedelta, timezone
 import os
 
+from botocore.exceptions import ClientError
 import pytest
 
+from lambdas.invitation.helpers import queries
+
 from lambdas.invitation.helpers.queries import (
+    ITEM_CACHE,
+    decode_item,
+    get,
     get_all,
+    update_status,
+    get_page,
+    get_parallel_page,
+    query_page,
+    query_by_gsi_merged_page,
+    backfill_status_shards,
+    backfill_pending_shards,
+    compact_items,
+    get_migration_checkpoint,
+    migrate,
+    pending_shard,
+    status_shard,
     create,
+    batch_create,
+    expiry_timer,
     update,
     query,
     query_by_gsi,
+    query_latest,
+    status_filter,
 )
 from lambdas.invitation.helpers.utils import (
     generate_invitation,
     generate_code,
+    time_code_prefix,
 )
 from lambdas.invitation.helpers.schemas import InvitationStatus
 
 
+def test_decode_item():
+    # plain strings, the fast path
+    assert decode_item({"email": {"S": "abc@gmail.com"}, "code": {"S": "X"}}) == {
+        "email": "abc@gmail.com",
+        "code": "X",
+    }
+    # anything else falls back to the generic deserializer
+    assert decode_item({"code": {"S": "X"}, "expires_at": {"N": "17"}}) == {
+        "code": "X",
+        "expires_at": 17,
+    }
+
+
 def test_get_all_from_empty_table(empty_table):
     data = get_all(empty_table)
     assert len(data) == 0
@@ -26,6 +63,39 @@ def test_get_all_from_table(table_with_items):
     assert len(data) == 6
 
 
+@pytest.mark.parametrize("total_segments", [2, 4, 16])
+def test_get_all_parallel(table_with_many_items, total_segments: int):
+    serial = get_all(table_with_many_items)
+    parallel = get_all(table_with_many_items, total_segments=total_segments)
+
+    key = lambda x: (x["email"], x["code"])
+    assert len(parallel) == len(serial)
+    assert sorted(map(key, parallel)) == sorted(map(key, serial))
+
+    # merge order is stable between runs
+    again = get_all(table_with_many_items, total_segments=total_segments)
+    assert list(map(key, again)) == list(map(key, parallel))
+
+
+def test_get_parallel_page(table_with_many_items):
+    data = []
+    start_keys = None
+    while True:
+        items, start_keys = get_parallel_page(
+            table_with_many_items,
+            limit=40,
+            total_segments=4,
+            start_keys=start_keys,
+        )
+        assert len(items) <= 40
+        data.extend(items)
+        if start_keys is None:
+            break
+
+    assert len(data) == len(get_all(table_with_many_items))
+    assert len({(x["email"], x["code"]) for x in data}) == len(data)
+
+
 @pytest.mark.parametrize(
     "invite_status, items_found",
     [
@@ -58,6 +128,139 @@ def test_create(empty_table):
     assert resp is True
 
 
+def test_create_with_expiry_timer(empty_table):
+    invitation = generate_invitation("peter88@gmail.com", generate_code())
+    assert create(empty_table, invitation, with_expiry_timer=True) is True
+
+    timer = expiry_timer(invitation.email, invitation.code, invitation.expiry_date)
+    item = empty_table.get_item(Key={"email": timer["email"], "code": timer["code"]})
+    assert item["Item"]["expires_at"] == timer["expires_at"]
+    # timers are not invitations
+    assert [x["email"] for x in get_all(empty_table)] == [invitation.email]
+
+
+def test_create_compact(empty_table):
+    invitation = generate_invitation("peter88@gmail.com", generate_code())
+    expected = dict(invitation.__dict__)
+    key = {"email": invitation.email, "code": invitation.code}
+    assert create(empty_table, invitation, compact=True) is True
+
+    stored = empty_table.get_item(Key=key)["Item"]
+    assert "created_date" not in stored
+    assert stored["cd"] == int(
+        datetime.strptime(expected["created_date"], "%Y-%m-%dT%H:%M:%SZ")
+        .replace(tzinfo=timezone.utc)
+        .timestamp()
+    )
+
+    # every read path maps it back to the standard format
+    ITEM_CACHE.clear()
+    item = get(empty_table, invitation.email, invitation.code)
+    assert {k: item[k] for k in expected} == expected
+    for items in (
+        get_all(empty_table),
+        query(empty_table, invitation.email),
+        query_by_gsi(empty_table, os.environ["TABLE_GSI_NAME"], "unconfirmed"),
+    ):
+        assert [{k: x[k] for k in expected} for x in items] == [expected]
+        assert "cd" not in items[0]
+
+    updated, item = update_status(
+        empty_table, invitation.email, invitation.code, "unconfirmed", "confirmed"
+    )
+    assert updated is True
+    assert item["created_date"] == expected["created_date"]
+    assert "cd" not in item
+
+
+def test_batch_create_resends_unprocessed(empty_table, monkeypatch):
+    invitations = [
+        generate_invitation(f"user{i}@gmail.com", generate_code()) for i in range(30)
+    ]
+    client = empty_table.meta.client
+    batch_write_item = client.batch_write_item
+    calls = []
+
+    def flaky_batch_write_item(RequestItems):
+        calls.append(RequestItems)
+        requests = RequestItems[empty_table.name]
+        # the first call of each chunk leaves its last item unprocessed
+        if len(requests) > 1:
+            batch_write_item(RequestItems={empty_table.name: requests[:-1]})
+            return {"UnprocessedItems": {empty_table.name: requests[-1:]}}
+        return batch_write_item(RequestItems=RequestItems)
+
+    monkeypatch.setattr(client, "batch_write_item", flaky_batch_write_item)
+    assert batch_create(empty_table, invitations, max_workers=1) == [True] * 30
+
+    # 2 chunks of 25 and 5, then 1 resend each
+    assert len(calls) == 4
+    assert len(get_all(empty_table)) == 30
+
+
+def test_get_point_read_is_cached(table_with_items, monkeypatch):
+    client = table_with_items.meta.client
+    get_item = client.get_item
+    calls = []
+
+    def counting_get_item(**kwargs):
+        calls.append(kwargs)
+        return get_item(**kwargs)
+
+    monkeypatch.setattr(client, "get_item", counting_get_item)
+
+    item = get(table_with_items, "abc@gmail.com", "ABCD1234")
+    assert item["invite_status"] == InvitationStatus.UNCONFIRMED
+    assert get(table_with_items, "abc@gmail.com", "ABCD1234") == item
+    assert get(table_with_items, "abc@gmail.com", "DONTEXIST") is None
+    assert len(calls) == 2
+
+    # local writes drop the key, the version they landed in is unknown
+    update_status(
+        table_with_items,
+        "abc@gmail.com",
+        "ABCD1234",
+        InvitationStatus.UNCONFIRMED,
+        InvitationStatus.CONFIRMED,
+    )
+    cache_key = (table_with_items.name, "abc@gmail.com", "ABCD1234")
+    assert ITEM_CACHE.get(cache_key) is None
+    item = get(table_with_items, "abc@gmail.com", "ABCD1234", min_version=1)
+    assert item["invite_status"] == InvitationStatus.CONFIRMED
+    assert len(calls) == 3
+    # served again to reads at that version or earlier
+    get(table_with_items, "abc@gmail.com", "ABCD1234", min_version=1)
+    get(table_with_items, "abc@gmail.com", "ABCD1234", min_version=0)
+    assert len(calls) == 3
+    get(table_with_items, "abc@gmail.com", "ABCD1234", min_version=2)
+    assert len(calls) == 4
+
+
+def test_failed_change_version_bump_is_retried_and_reported(
+    table_with_items, monkeypatch, capsys
+):
+    calls = []
+
+    def failing_add_to_counters(*args, **kwargs):
+        calls.append(kwargs)
+        raise ClientError({"Error": {"Code": "InternalServerError"}}, "UpdateItem")
+
+    monkeypatch.setattr(queries, "add_to_counters", failing_add_to_counters)
+    monkeypatch.setattr(queries.time, "sleep", lambda _: None)
+
+    # the write itself stands
+    updated, _ = update_status(
+        table_with_items,
+        "abc@gmail.com",
+        "ABCD1234",
+        InvitationStatus.UNCONFIRMED,
+        InvitationStatus.CONFIRMED,
+    )
+    assert updated is True
+    assert len(calls) == 4
+    assert "ERROR: Failed to bump the change version" in capsys.readouterr().out
+
+
 def test_update_success(table_with_items):
     email = "abc@gmail.com"
     code = "ABCD1234"
@@ -87,6 +290,85 @@ def test_update_failed(table_with_items):
     assert data is None
 
 
+def test_read_fields(table_with_items):
+    gsi_name = os.environ["TABLE_GSI_NAME"]
+    for items, expected in (
+        (get_all(table_with_items, fields=["invite_status"]), {"invite_status"}),
+        (query(table_with_items, "abc@gmail.com", fields=[]), set()),
+        (
+            query_by_gsi(table_with_items, gsi_name, "unconfirmed", fields=[]),
+            {"invite_status", "expiry_date"},
+        ),
+        (
+            get_page(table_with_items, limit=10, fields=["expiry_date"])[0],
+            {"expiry_date"},
+        ),
+    ):
+        assert items
+        # the table key is always read
+        assert all(set(x) == {"email", "code", *expected} for x in items)
+
+
+def test_read_fields_compact(empty_table):
+    invitation = generate_invitation("peter88@gmail.com", generate_code())
+    assert create(empty_table, invitation, compact=True) is True
+
+    assert query(empty_table, invitation.email, fields=["created_date"]) == [
+        {
+            "email": invitation.email,
+            "code": invitation.code,
+            "created_date": invitation.created_date,
+        }
+    ]
+
+
+def test_query_latest(empty_table):
+    now = datetime.now(timezone.utc)
+    now_utc = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def put(code: str, invite_status: str, minutes: int):
+        invitation = generate_invitation("abc@gmail.com", code)
+        invitation.invite_status = invite_status
+        invitation.created_date = (now + timedelta(minutes=minutes)).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        )
+        empty_table.put_item(Item=invitation.__dict__)
+
+    # legacy codes only, by created_date
+    put("ZZZZ0001", "unconfirmed", -2)
+    put("AAAA0001", "invalidated", -1)
+    assert query_latest(empty_table, "abc@gmail.com")["code"] == "AAAA0001"
+    assert query_latest(empty_table, "nobody@gmail.com") is None
+
+    # time-ordered codes come after every legacy one
+    codes = {
+        m: time_code_prefix(now + timedelta(minutes=m)) + "ABCD" for m in (1, 2, 3)
+    }
+    put(codes[1], "unconfirmed", 1)
+    put(codes[3], "confirmed", 3)
+    put(codes[2], "unconfirmed", 2)
+    latest = query_latest(empty_table, "abc@gmail.com", fields=["invite_status"])
+    assert latest["code"] == codes[3]
+    assert set(latest) == {"email", "code", "created_date", "invite_status"}
+
+    # newest active
+    active = status_filter([("unconfirmed", None, now_utc)])
+    assert query_latest(empty_table, "abc@gmail.com", active)["code"] == codes[2]
+
+    # no time-ordered match, back to the legacy ones
+    invalidated = status_filter([("invalidated", None, None)])
+    assert query_latest(empty_table, "abc@gmail.com", invalidated)["code"] == "AAAA0001"
+    expired = status_filter([("expired", None, None), ("unconfirmed", now_utc, None)])
+    assert query_latest(empty_table, "abc@gmail.com", expired) is None
+
+
+def test_status_filter():
+    assert status_filter([]) is None
+    # empty range
+    assert status_filter([("unconfirmed", "2024-01-01", "2024-02-01")]) is None
+    assert status_filter([("confirmed", None, None)]) is not None
+
+
 def test_query_empty_table(empty_table):
     data = query(empty_table, "ABCD1234")
     assert isinstance(data, list)
@@ -100,3 +382,218 @@ def test_query(table_with_items):
     # proper sorting (`code` is sort key)
     assert data[0]["code"] == "ABCD1200"
     assert data[1]["code"] == "ABCD1234"
+
+
+def test_get_page(table_with_items):
+    data, last_key = get_page(table_with_items, limit=4)
+    assert len(data) == 4
+    assert last_key is not None
+
+    data, last_key = get_page(table_with_items, limit=4, start_key=last_key)
+    assert len(data) == 2
+    assert last_key is None
+
+
+def test_query_page(table_with_items):
+    data, last_key = query_page(table_with_items, "abc@gmail.com", limit=1)
+    assert len(data) == 1
+    assert last_key is not None
+    codes = [data[0]["code"]]
+
+    data, last_key = query_page(
+        table_with_items, "abc@gmail.com", limit=1, start_key=last_key
+    )
+    assert len(data) == 1
+    codes.append(data[0]["code"])
+    assert sorted(codes) == ["ABCD1200", "ABCD1234"]
+
+
+def test_status_shard():
+    shard_key = status_shard(InvitationStatus.UNCONFIRMED, "abc@gmail.com", "X", 8)
+    assert shard_key.startswith("unconfirmed#")
+    assert 0 <= int(shard_key.split("#")[1]) < 8
+    # stable for the same item key, whatever the status
+    assert status_shard("expired", "abc@gmail.com", "X", 8).split("#")[1] == (
+        shard_key.split("#")[1]
+    )
+
+
+def test_backfill_status_shards(table_with_items):
+    assert backfill_status_shards(table_with_items, shard_count=4) == 6
+    # already backfilled
+    assert backfill_status_shards(table_with_items, shard_count=4) == 0
+
+    item = table_with_items.get_item(
+        Key={"email": "abc@gmail.com", "code": "ABCD1234"}
+    )["Item"]
+    assert item["status_shard"] == status_shard(
+        "unconfirmed", "abc@gmail.com", "ABCD1234", 4
+    )
+
+
+def test_backfill_pending_shards(table_with_items):
+    unconfirmed = query_by_gsi(
+        table_with_items, os.environ["TABLE_GSI_NAME"], InvitationStatus.UNCONFIRMED
+    )
+    assert backfill_pending_shards(table_with_items) == len(unconfirmed)
+    # already backfilled
+    assert backfill_pending_shards(table_with_items) == 0
+
+    items = get_all(table_with_items)
+    for item in items:
+        if item["invite_status"] == InvitationStatus.UNCONFIRMED:
+            assert item["pending_shard"] == pending_shard(item["email"], item["code"])
+        else:
+            assert "pending_shard" not in item
+
+
+def test_update_removes_pending_shard(empty_table):
+    invitation = generate_invitation("peter88@gmail.com", generate_code())
+    create(empty_table, invitation)
+    key = {"email": invitation.email, "code": invitation.code}
+    assert "pending_shard" in empty_table.get_item(Key=key)["Item"]
+
+    update(
+        table=empty_table,
+        payload={"invite_status": InvitationStatus.CONFIRMED},
+        **key,
+    )
+    assert "pending_shard" not in empty_table.get_item(Key=key)["Item"]
+
+
+def test_query_by_gsi_merged_page_sharded(table_with_many_items):
+    backfill_status_shards(table_with_many_items, shard_count=4)
+    sharded_gsi_name = os.environ["TABLE_SHARDED_GSI_NAME"]
+
+    data = []
+    start_keys = None
+    while True:
+        items, start_keys = query_by_gsi_merged_page(
+            table_with_many_items,
+            sharded_gsi_name,
+            partition_key="status_shard",
+            partitions=[(f"unconfirmed#{shard:02d}", None, None) for shard in range(4)],
+            limit=7,
+            start_keys=start_keys,
+        )
+        assert len(items) <= 7
+        data.extend(items)
+        if start_keys is None:
+            break
+
+    expected = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"]) + int(
+        os.environ["NEW_UNCONFIRMED_COUNT"]
+    )
+    assert len({(x["email"], x["code"]) for x in data}) == len(data) == expected
+    # pages are in global expiry_date order
+    assert [x["expiry_date"] for x in data] == sorted(x["expiry_date"] for x in data)
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_query_by_gsi_merged_page(table_with_many_items, descending: bool):
+    gsi_name = os.environ["TABLE_GSI_NAME"]
+    statuses = [InvitationStatus.CONFIRMED.value, InvitationStatus.EXPIRED.value]
+    expected = sorted(
+        (
+            x["expiry_date"]
+            for status in statuses
+            for x in query_by_gsi(table_with_many_items, gsi_name, status)
+        ),
+        reverse=descending,
+    )
+
+    data = []
+    start_keys = None
+    while True:
+        items, start_keys = query_by_gsi_merged_page(
+            table_with_many_items,
+            gsi_name,
+            partition_key="invite_status",
+            partitions=[(status, None, None) for status in statuses],
+            limit=9,
+            start_keys=start_keys,
+            descending=descending,
+        )
+        assert len(items) <= 9
+        data.extend(items)
+        if start_keys is None:
+            break
+
+    assert len({(x["email"], x["code"]) for x in data}) == len(data)
+    # pages are in expiry_date order across both statuses
+    assert [x["expiry_date"] for x in data] == expected
+
+
+def test_migrate_resumes_from_checkpoint(table_with_many_items):
+    total = len(get_all(table_with_many_items))
+    calls = []
+
+    def flaky_transform(item: dict) -> dict:
+        calls.append(item["email"])
+        if len(calls) == 120:
+            raise RuntimeError("interrupted")
+        return {"migrated": "yes"}
+
+    with pytest.raises(RuntimeError):
+        migrate(table_with_many_items, "test", flaky_transform, page_size=25)
+
+    # every segment has moved past some pages, the migrated ones are kept
+    checkpoint = get_migration_checkpoint(table_with_many_items, "test")
+    assert checkpoint["total_segments"] == 4
+    assert any(x["start_key"] or x["done"] for x in checkpoint["segments"])
+    migrated = sum("migrated" in x for x in get_all(table_with_many_items))
+    assert 0 < migrated < total
+
+    stats = migrate(table_with_many_items, "test", lambda x: {"migrated": "yes"})
+    # checkpointed pages are not scanned again
+    assert stats["scanned"] < total
+    assert stats["updated"] == total - migrated
+    assert stats["items_per_second"] > 0
+    assert get_migration_checkpoint(table_with_many_items, "test") is None
+    assert all(x["migrated"] == "yes" for x in get_all(table_with_many_items))
+
+
+def test_migrate_retries_on_concurrent_write(table_with_items):
+    key = {"email": "abc@gmail.com", "code": "ABCD1234"}
+    seen = []
+
+    def transform(item: dict) -> dict:
+        if item["email"] != key["email"] or item["code"] != key["code"]:
+            return {}
+        seen.append(item["invite_status"])
+        if len(seen) == 1:
+            # a concurrent writer changes the item after it was read
+            update(table_with_items, **key, payload={"invite_status": "confirmed"})
+        return {"status_copy": item["invite_status"]}
+
+    stats = migrate(table_with_items, "test", transform)
+    assert stats["updated"] == 1
+    # transformed again from the item as it is now
+    assert seen == ["unconfirmed", "confirmed"]
+    item = table_with_items.get_item(Key=key)["Item"]
+    assert item["status_copy"] == "confirmed"
+
+
+def test_migrate_with_wcu_budget(table_with_items):
+    stats = migrate(
+        table_with_items, "test", lambda x: {"migrated": "yes"}, wcu_per_second=4
+    )
+    assert stats["updated"] == 6
+    # 6 writes and 4 checkpoints, 4 WCU up front then 4 WCU per second
+    assert stats["elapsed"] >= 1.4
+    assert stats["rate_limited_seconds"] > 0
+
+
+def test_compact_items(table_with_items):
+    expected = sorted(get_all(table_with_items), key=lambda x: (x["email"], x["code"]))
+    assert compact_items(table_with_items) == len(expected)
+    # already compact
+    assert compact_items(table_with_items) == 0
+
+    stored = [
+        x for x in table_with_items.scan()["Items"] if not x["email"].startswith("#")
+    ]
+    assert all("created_date" not in x and "cd" in x for x in stored)
+    # reads are unchanged
+    items = sorted(get_all(table_with_items), key=lambda x: (x["email"], x["code"]))
+    assert items == expected
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+import time
+
+import pytest
+
+from lambdas.invitation.helpers.utils import (
+    LRUCache,
+    build_etag,
+    generate_code,
+    matching_etag,
+    parse_date,
+    parse_fields,
+    time_code_prefix,
+)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_size=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    # touch "a", so "b" is the least recently used
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(max_size=2, ttl_seconds=0.05)
+    cache.put("a", 1)
+    assert cache.get("a") == 1
+
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+
+def test_lru_cache_disabled():
+    cache = LRUCache(max_size=0, ttl_seconds=60)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+
+
+def test_matching_etag():
+    etag = build_etag(version=7, fresh_until=1000, scope="unconfirmed|100")
+    assert matching_etag(etag, 7, "unconfirmed|100", now=1000) == etag
+    # weak comparison and lists of ETags
+    assert (
+        matching_etag(f'W/{etag}, "other"', 7, "unconfirmed|100", now=0) == f"W/{etag}"
+    )
+
+    # table changed, another request, or statuses changed with time
+    assert matching_etag(etag, 8, "unconfirmed|100", now=1000) is None
+    assert matching_etag(etag, 7, "expired|100", now=1000) is None
+    assert matching_etag(etag, 7, "unconfirmed|100", now=1001) is None
+
+    # no time limit
+    etag = build_etag(version=7, fresh_until=0, scope="unconfirmed|100")
+    assert matching_etag(etag, 7, "unconfirmed|100", now=10**10) == etag
+
+    for if_none_match in (None, "", "*", '"abc"', '"a-b-c"'):
+        assert matching_etag(if_none_match, 7, "unconfirmed|100", now=0) is None
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields("email, invite_status,email") == ["email", "invite_status"]
+    for fields in ("", "email,status_shard", "email,,code"):
+        with pytest.raises(ValueError):
+            parse_fields(fields)
+
+
+def test_parse_date():
+    assert parse_date(None) is None
+    assert parse_date("2024-01-31T00:00:00Z") == "2024-01-31T00:00:00Z"
+    for date in ("2024-01-31", "2024-1-5T0:0:0Z", "2024-01-31T00:00:00"):
+        with pytest.raises(ValueError):
+            parse_date(date)
+
+
+def test_time_ordered_codes():
+    now = datetime.now(timezone.utc)
+    prefixes = [time_code_prefix(now + timedelta(milliseconds=x)) for x in (0, 1, 32)]
+    assert prefixes == sorted(prefixes)
+    assert len(set(prefixes)) == 3
+    assert time_code_prefix(datetime(1970, 1, 1, tzinfo=timezone.utc)) == "0" * 9
+
+    code = generate_code(time_ordered=True)
+    assert len(code) == 17
+    # below every legacy, letters-only code
+    assert code[0].isdigit()
+    assert code < generate_code()
@@ -0,0 +1,69 @@
+import re
+
+import boto3
+import pytest
+
+from lambdas.scheduler.helpers import queries
+
+# the only statement form `batch_update_status` sends
+STATUS_UPDATE = re.compile(
+    r'UPDATE "(?P<table>[^"]+)" SET invite_status=\?(?P<shard> SET status_shard=\?)?'
+    r"(?P<remove> REMOVE pending_shard)? WHERE email=\? AND code=\? AND invite_status=\?"
+)
+
+
+class StatementClient:
+    """
+    DynamoDB client whose `batch_execute_statement` runs the scheduler's
+    status updates as conditional `update_item` calls, as moto cannot
+    execute PartiQL updates. Everything else goes to the real client.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def batch_execute_statement(self, Statements):
+        return {"Responses": [self.execute(x) for x in Statements]}
+
+    def execute(self, statement: dict) -> dict:
+        match = STATUS_UPDATE.fullmatch(statement["Statement"])
+        params = list(statement["Parameters"])
+        to_status = params.pop(0)
+        update_expr = "SET invite_status=:to_status"
+        expr_attr_value = {":to_status": to_status}
+        if match["shard"]:
+            update_expr += ", status_shard=:status_shard"
+            expr_attr_value[":status_shard"] = params.pop(0)
+        if match["remove"]:
+            update_expr += " REMOVE pending_shard"
+        email, code, expr_attr_value[":from_status"] = params
+        try:
+            self.client.update_item(
+                TableName=match["table"],
+                Key={"email": email, "code": code},
+                UpdateExpression=update_expr,
+                ConditionExpression="invite_status=:from_status",
+                ExpressionAttributeValues=expr_attr_value,
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return {"Error": {"Code": "ConditionalCheckFailed"}}
+        return {}
+
+
+@pytest.fixture(autouse=True)
+def statement_client(monkeypatch):
+    clients = {}
+
+    def get_client(service_name: str):
+        # created on first use, inside the test's mocked AWS
+        if service_name not in clients:
+            clients[service_name] = boto3.client(service_name)
+            if service_name == "dynamodb":
+                clients[service_name] = StatementClient(clients[service_name])
+        return clients[service_name]
+
+    monkeypatch.setattr(queries, "get_client", get_client)
+    return get_client
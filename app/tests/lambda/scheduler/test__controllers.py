@@ -1,16 +1,32 @@
 """
 Only testing controllers because queries etc. are similar to /lambdas/invitation/
 """
+from datetime import datetime, timezone
 import os
 
+from botocore.exceptions import ClientError
+
 from lambdas.scheduler.helpers.schemas import InvitationStatus
+from lambdas.scheduler.helpers import controllers
+from lambdas.scheduler.helpers.queries import (
+    count_by_gsi,
+    get_checkpoint,
+    get_counters,
+    get_watermark,
+    put_watermark,
+)
 
 # import from 'invitation', reason: get ALL for items count validation
 from lambdas.invitation.helpers.queries import (
+    backfill_pending_shards,
+    backfill_status_shards,
+    get_all,
     query_by_gsi,
 )
 from lambdas.scheduler.helpers.controllers import (
     process_expired_unconfirmed_invitations,
+    process_expiry_timer_records,
+    reconcile_counters,
 )
 
 
@@ -53,3 +69,358 @@ def test_convert_expired_unconfirmed_invitations(
     )
     assert len(expired_after) == EXPIRED_COUNT + UNCONFIRMED_BUT_EXPIRED_COUNT
     assert len(unconfirmed_after) == NEW_UNCONFIRMED_COUNT
+
+
+def test_watermark_limits_reads_to_newly_expired(
+    table_with_many_items,
+):
+    gsi_name = os.environ["TABLE_GSI_NAME"]
+    UNCONFIRMED_BUT_EXPIRED_COUNT = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"])
+
+    assert get_watermark(table_with_many_items) is None
+
+    # only expired items are read, not every unconfirmed one
+    stats = process_expired_unconfirmed_invitations(
+        table=table_with_many_items, gsi_name=gsi_name
+    )
+    assert stats["read"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+    assert stats["updated"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+    # 25 transitions per BatchExecuteStatement call
+    assert stats["api_calls"] == -(-UNCONFIRMED_BUT_EXPIRED_COUNT // 25)
+    assert stats["api_calls_saved"] == stats["read"] - stats["api_calls"]
+    assert get_watermark(table_with_many_items) == stats["watermark"]
+
+    # nothing expired since the last run
+    stats = process_expired_unconfirmed_invitations(
+        table=table_with_many_items, gsi_name=gsi_name
+    )
+    assert stats["read"] == 0
+
+    # watermark item stays out of invitation listings
+    assert all(x["email"] != "#meta" for x in get_all(table_with_many_items))
+
+
+def test_watermark_never_moves_backwards(empty_table):
+    put_watermark(empty_table, "2024-01-02T00:00:00Z")
+    put_watermark(empty_table, "2024-01-01T00:00:00Z")
+    assert get_watermark(empty_table) == "2024-01-02T00:00:00Z"
+
+
+def test_throttling_shrinks_concurrency_and_is_retried(
+    table_with_many_items,
+    monkeypatch,
+    statement_client,
+):
+    client = statement_client("dynamodb")
+    batch_execute_statement = client.batch_execute_statement
+    calls = []
+
+    def throttled_batch_execute_statement(Statements):
+        calls.append(len(Statements))
+        # throttle every other call
+        if len(calls) % 2:
+            raise ClientError(
+                {"Error": {"Code": "ProvisionedThroughputExceededException"}},
+                "BatchExecuteStatement",
+            )
+        return batch_execute_statement(Statements=Statements)
+
+    monkeypatch.setattr(
+        client, "batch_execute_statement", throttled_batch_execute_statement
+    )
+    UNCONFIRMED_BUT_EXPIRED_COUNT = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"])
+
+    stats = process_expired_unconfirmed_invitations(
+        table=table_with_many_items,
+        gsi_name=os.environ["TABLE_GSI_NAME"],
+        max_workers=4,
+        wcu_per_second=2000,
+        max_queued_pages=1,
+    )
+
+    assert stats["throttled"] > 0
+    assert stats["updated"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+    assert stats["failed"] == 0
+    assert stats["batches"] == -(-UNCONFIRMED_BUT_EXPIRED_COUNT // 25)
+    assert stats["batch_latency_max"] > 0
+
+
+class FakeLambdaContext:
+    """Lambda context whose time runs out after `budget_calls` checks."""
+
+    def __init__(self, budget_calls: int):
+        self.budget_calls = budget_calls
+
+    def get_remaining_time_in_millis(self) -> int:
+        self.budget_calls -= 1
+        return 60_000 if self.budget_calls > 0 else 0
+
+
+def test_checkpoint_and_resume_on_small_time_budget(
+    table_with_many_items,
+):
+    gsi_name = os.environ["TABLE_GSI_NAME"]
+    UNCONFIRMED_BUT_EXPIRED_COUNT = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"])
+
+    # out of time after a few pages of 10
+    context = FakeLambdaContext(budget_calls=3)
+    first = process_expired_unconfirmed_invitations(
+        table=table_with_many_items,
+        gsi_name=gsi_name,
+        time_left_ms=context.get_remaining_time_in_millis,
+        page_size=10,
+    )
+    assert first["stopped"]
+    assert first["updated"] < UNCONFIRMED_BUT_EXPIRED_COUNT
+    assert get_watermark(table_with_many_items) is None
+
+    checkpoint = get_checkpoint(table_with_many_items)
+    assert checkpoint is not None
+    assert checkpoint["start_key"] or checkpoint["pending"]
+
+    # resume with enough time, picks up where the first run stopped
+    second = process_expired_unconfirmed_invitations(
+        table=table_with_many_items,
+        gsi_name=gsi_name,
+        page_size=10,
+    )
+    assert not second["stopped"]
+    assert first["updated"] + second["updated"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+    assert get_checkpoint(table_with_many_items) is None
+    assert get_watermark(table_with_many_items) == checkpoint["window_end"]
+
+    expired = query_by_gsi(
+        table=table_with_many_items,
+        gsi_name=gsi_name,
+        invite_status=InvitationStatus.EXPIRED,
+    )
+    assert len(expired) == int(os.environ["EXPIRED_COUNT"]) + (
+        UNCONFIRMED_BUT_EXPIRED_COUNT
+    )
+
+
+def test_convert_expired_unconfirmed_invitations_sharded(
+    table_with_many_items,
+):
+    backfill_status_shards(table_with_many_items, shard_count=4)
+    sharded_gsi_name = os.environ["TABLE_SHARDED_GSI_NAME"]
+    UNCONFIRMED_BUT_EXPIRED_COUNT = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"])
+
+    stats = process_expired_unconfirmed_invitations(
+        table=table_with_many_items,
+        gsi_name=os.environ["TABLE_GSI_NAME"],
+        shard_count=4,
+        sharded_gsi_name=sharded_gsi_name,
+        page_size=10,
+    )
+    assert stats["read"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+    assert stats["updated"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+
+    # shard keys follow the status change
+    expired = count_by_gsi(
+        table_with_many_items, sharded_gsi_name, InvitationStatus.EXPIRED, 4
+    )
+    assert expired == int(os.environ["EXPIRED_COUNT"]) + (UNCONFIRMED_BUT_EXPIRED_COUNT)
+
+
+def test_checkpoint_stays_small_with_sharding(table_with_many_items):
+    backfill_status_shards(table_with_many_items, shard_count=8)
+    page_size = 16
+    max_queued_pages = 1
+
+    # out of time after reading a few pages, everything read goes pending
+    context = FakeLambdaContext(budget_calls=3)
+    stats = process_expired_unconfirmed_invitations(
+        table=table_with_many_items,
+        gsi_name=os.environ["TABLE_GSI_NAME"],
+        time_left_ms=context.get_remaining_time_in_millis,
+        page_size=page_size,
+        max_queued_pages=max_queued_pages,
+        shard_count=8,
+        sharded_gsi_name=os.environ["TABLE_SHARDED_GSI_NAME"],
+    )
+    assert stats["stopped"]
+
+    # a page holds `page_size` items across all shards, not per shard, so
+    # the pending keys stay bounded by the pages queued and in flight
+    checkpoint = get_checkpoint(table_with_many_items)
+    assert checkpoint["pending"]
+    assert len(checkpoint["pending"]) <= page_size * (max_queued_pages + 2)
+    assert stats["read"] <= page_size * 3
+
+
+def test_convert_expired_unconfirmed_invitations_pending_gsi(
+    table_with_many_items,
+):
+    backfill_pending_shards(table_with_many_items, shard_count=4)
+    UNCONFIRMED_BUT_EXPIRED_COUNT = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"])
+
+    stats = process_expired_unconfirmed_invitations(
+        table=table_with_many_items,
+        gsi_name=os.environ["TABLE_GSI_NAME"],
+        shard_count=4,
+        pending_gsi_name=os.environ["TABLE_PENDING_GSI_NAME"],
+        page_size=10,
+    )
+    assert stats["read"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+    assert stats["updated"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+
+    # expired invitations left the sparse index
+    for item in get_all(table_with_many_items):
+        assert ("pending_shard" in item) == (
+            item["invite_status"] == InvitationStatus.UNCONFIRMED
+        )
+
+
+def test_pending_gsi_is_only_read_after_backfill(table_with_many_items):
+    UNCONFIRMED_BUT_EXPIRED_COUNT = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"])
+
+    # deployed but not backfilled: the sparse index would look empty and the
+    # watermark would move past the invitations it is missing
+    stats = process_expired_unconfirmed_invitations(
+        table=table_with_many_items,
+        gsi_name=os.environ["TABLE_GSI_NAME"],
+        pending_gsi_name=os.environ["TABLE_PENDING_GSI_NAME"],
+    )
+    assert stats["read"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+    assert stats["updated"] == UNCONFIRMED_BUT_EXPIRED_COUNT
+
+    # once backfilled, the status GSI is not read any more
+    backfill_pending_shards(table_with_many_items)
+    stats = process_expired_unconfirmed_invitations(
+        table=table_with_many_items,
+        gsi_name="missing",
+        use_watermark=False,
+        pending_gsi_name=os.environ["TABLE_PENDING_GSI_NAME"],
+    )
+    assert stats["read"] == 0
+    assert not stats["errors"]
+
+
+def __timer_removal_records(items: list[dict], by_ttl: bool = True) -> list[dict]:
+    """Stream records as DynamoDB TTL deleting the expiry timers of `items`"""
+    principal = "dynamodb.amazonaws.com" if by_ttl else "AIDAEXAMPLE"
+    return [
+        {
+            "eventName": "REMOVE",
+            "userIdentity": {"type": "Service", "principalId": principal},
+            "dynamodb": {
+                "Keys": {
+                    "email": {"S": f"#timer#{x['email']}"},
+                    "code": {"S": x["code"]},
+                },
+                "SequenceNumber": str(100 + i),
+            },
+        }
+        for i, x in enumerate(items)
+    ]
+
+
+def test_process_expiry_timer_records(table_with_many_items):
+    gsi_name = os.environ["TABLE_GSI_NAME"]
+    UNCONFIRMED_BUT_EXPIRED_COUNT = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"])
+    expired = [
+        x
+        for x in query_by_gsi(
+            table_with_many_items, gsi_name, InvitationStatus.UNCONFIRMED
+        )
+        if x["expiry_date"] < datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    ]
+    assert len(expired) == UNCONFIRMED_BUT_EXPIRED_COUNT
+    confirmed = query_by_gsi(
+        table_with_many_items, gsi_name, InvitationStatus.CONFIRMED
+    )
+
+    records = (
+        __timer_removal_records(expired)
+        # deleted by hand, not expired
+        + __timer_removal_records(confirmed[:5], by_ttl=False)
+        # confirmed after its timer was written
+        + __timer_removal_records(confirmed[5:10])
+    )
+    resp = process_expiry_timer_records(table_with_many_items, records)
+    assert resp == {"batchItemFailures": []}
+
+    assert (
+        len(query_by_gsi(table_with_many_items, gsi_name, InvitationStatus.EXPIRED))
+        == int(os.environ["EXPIRED_COUNT"]) + UNCONFIRMED_BUT_EXPIRED_COUNT
+    )
+    assert len(
+        query_by_gsi(table_with_many_items, gsi_name, InvitationStatus.CONFIRMED)
+    ) == len(confirmed)
+
+
+def test_process_expiry_timer_records_reports_failure(
+    table_with_many_items,
+    monkeypatch,
+):
+    gsi_name = os.environ["TABLE_GSI_NAME"]
+    unconfirmed = query_by_gsi(
+        table_with_many_items, gsi_name, InvitationStatus.UNCONFIRMED
+    )
+    records = __timer_removal_records(unconfirmed[:60])
+
+    calls = []
+
+    def failing_second_batch(**kwargs):
+        calls.append(kwargs)
+        if len(calls) == 2:
+            return {"updated": 0, "skipped": 0, "failed": 25}
+        return {"updated": len(kwargs["items"]), "skipped": 0, "failed": 0}
+
+    monkeypatch.setattr(controllers, "batch_update_status", failing_second_batch)
+    resp = process_expiry_timer_records(table_with_many_items, records)
+
+    # retried from the first record of the failed batch, nothing after it sent
+    assert resp == {"batchItemFailures": [{"itemIdentifier": "125"}]}
+    assert len(calls) == 2
+
+
+def test_counters_follow_transitions_and_reconcile(table_with_many_items):
+    gsi_name = os.environ["TABLE_GSI_NAME"]
+    unconfirmed = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"]) + int(
+        os.environ["NEW_UNCONFIRMED_COUNT"]
+    )
+    expected = {
+        "unconfirmed": unconfirmed,
+        "confirmed": int(os.environ["CONFIRMED_COUNT"]),
+        "invalidated": int(os.environ["INVALIDATED_COUNT"]),
+        "expired": int(os.environ["EXPIRED_COUNT"]),
+    }
+
+    # items written directly by the fixture were never counted
+    stats = reconcile_counters(table_with_many_items, gsi_name)
+    assert stats["counted"] == expected
+    assert stats["drift"] == expected
+    assert get_counters(table_with_many_items) == expected
+
+    process_expired_unconfirmed_invitations(table_with_many_items, gsi_name)
+    moved = int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"])
+    expected["unconfirmed"] -= moved
+    expected["expired"] += moved
+    assert get_counters(table_with_many_items) == expected
+
+    # in step, nothing to fix
+    stats = reconcile_counters(table_with_many_items, gsi_name)
+    assert set(stats["drift"].values()) == {0}
+
+
+def test_reconcile_counters_sharded(table_with_many_items):
+    backfill_status_shards(table_with_many_items, shard_count=4)
+    expected = {
+        "unconfirmed": int(os.environ["UNCONFIRMED_BUT_EXPIRED_COUNT"])
+        + int(os.environ["NEW_UNCONFIRMED_COUNT"]),
+        "confirmed": int(os.environ["CONFIRMED_COUNT"]),
+        "invalidated": int(os.environ["INVALIDATED_COUNT"]),
+        "expired": int(os.environ["EXPIRED_COUNT"]),
+    }
+
+    # counted on the shards of the sharded GSI, the status GSI is not read
+    stats = reconcile_counters(
+        table_with_many_items,
+        "missing",
+        shard_count=4,
+        sharded_gsi_name=os.environ["TABLE_SHARDED_GSI_NAME"],
+    )
+    assert stats["counted"] == expected
+    assert get_counters(table_with_many_items) == expected
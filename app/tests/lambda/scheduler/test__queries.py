@@ -0,0 +1,137 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from lambdas.scheduler.helpers import queries
+from lambdas.scheduler.helpers.queries import batch_update_status
+from lambdas.scheduler.helpers.schemas import InvitationStatus
+
+
+def get_status(table, email: str, code: str):
+    item = table.get_item(Key={"email": email, "code": code}).get("Item")
+    return item["invite_status"] if item else None
+
+
+def test_batch_update_status(table_with_items):
+    items = [
+        {"email": "abc@gmail.com", "code": "ABCD1200"},
+        {"email": "abc@gmail.com", "code": "ABCD1234"},
+        # already confirmed, condition on current status protects it
+        {"email": "confirmed@gmail.com", "code": "CONFIRM01"},
+    ]
+    result = batch_update_status(
+        table=table_with_items,
+        items=items,
+        from_status=InvitationStatus.UNCONFIRMED,
+        to_status=InvitationStatus.EXPIRED,
+    )
+
+    # the conditional failure only fails its own statement
+    assert result == {
+        "updated": 2,
+        "skipped": 1,
+        "failed": 0,
+        "api_calls": 1,
+        "throttled": 0,
+    }
+    assert get_status(table_with_items, "abc@gmail.com", "ABCD1200") == "expired"
+    assert get_status(table_with_items, "abc@gmail.com", "ABCD1234") == "expired"
+    assert get_status(table_with_items, "confirmed@gmail.com", "CONFIRM01") == (
+        "confirmed"
+    )
+
+
+def status_update(table_name: str, code: str) -> dict:
+    return {
+        "Statement": f'UPDATE "{table_name}" SET invite_status=? '
+        "REMOVE pending_shard WHERE email=? AND code=? AND invite_status=?",
+        "Parameters": [
+            {"S": "expired"},
+            {"S": "abc@gmail.com"},
+            {"S": code},
+            {"S": "unconfirmed"},
+        ],
+    }
+
+
+def test_batch_update_status_retries_only_failed(empty_table, monkeypatch):
+    client = boto3.client("dynamodb")
+    monkeypatch.setattr(queries, "get_client", lambda service_name: client)
+    monkeypatch.setattr(queries.time, "sleep", lambda seconds: None)
+    codes = ["ABCD1200", "ABCD1234", "ABCD5678"]
+
+    with Stubber(client) as stubber:
+        # first statement throttled, second rejected by its condition
+        stubber.add_response(
+            "batch_execute_statement",
+            {
+                "Responses": [
+                    {"Error": {"Code": "ThrottlingError"}},
+                    {"Error": {"Code": "ConditionalCheckFailed"}},
+                    {},
+                ]
+            },
+            {"Statements": [status_update(empty_table.name, x) for x in codes]},
+        )
+        # only the throttled statement is resent
+        stubber.add_response(
+            "batch_execute_statement",
+            {"Responses": [{}]},
+            {"Statements": [status_update(empty_table.name, codes[0])]},
+        )
+        result = batch_update_status(
+            table=empty_table,
+            items=[{"email": "abc@gmail.com", "code": x} for x in codes],
+            from_status=InvitationStatus.UNCONFIRMED,
+            to_status=InvitationStatus.EXPIRED,
+        )
+        stubber.assert_no_pending_responses()
+
+    assert result == {
+        "updated": 2,
+        "skipped": 1,
+        "failed": 0,
+        "api_calls": 2,
+        "throttled": 1,
+    }
+
+
+def test_batch_update_status_reports_final_errors(empty_table, monkeypatch):
+    client = boto3.client("dynamodb")
+    monkeypatch.setattr(queries, "get_client", lambda service_name: client)
+    monkeypatch.setattr(queries.time, "sleep", lambda seconds: None)
+
+    with Stubber(client) as stubber:
+        # a validation error is final, the other statement is not held back
+        stubber.add_response(
+            "batch_execute_statement",
+            {"Responses": [{"Error": {"Code": "ValidationError"}}, {}]},
+        )
+        result = batch_update_status(
+            table=empty_table,
+            items=[
+                {"email": "abc@gmail.com", "code": "ABCD1200"},
+                {"email": "abc@gmail.com", "code": "ABCD1234"},
+            ],
+            from_status=InvitationStatus.UNCONFIRMED,
+            to_status=InvitationStatus.EXPIRED,
+        )
+        stubber.assert_no_pending_responses()
+
+    assert result == {
+        "updated": 1,
+        "skipped": 0,
+        "failed": 1,
+        "api_calls": 1,
+        "throttled": 0,
+    }
+
+
+def test_batch_update_status_too_many_items(empty_table):
+    with pytest.raises(ValueError):
+        batch_update_status(
+            table=empty_table,
+            items=[{"email": "a", "code": str(i)} for i in range(26)],
+            from_status=InvitationStatus.UNCONFIRMED,
+            to_status=InvitationStatus.EXPIRED,
+        )
@@ -0,0 +1,103 @@
+import threading
+import time
+
+from lambdas.scheduler.helpers import utils
+from lambdas.scheduler.helpers.queries import BATCH_UPDATE_LIMIT
+from lambdas.scheduler.helpers.utils import (
+    AdaptiveConcurrency,
+    TokenBucket,
+    parse_expiry_timer_removal,
+)
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, capacity=10)
+
+    t0 = time.monotonic()
+    # 10 tokens available up front, the next 20 take ~0.2s to refill
+    for _ in range(30):
+        bucket.acquire(1)
+    elapsed = time.monotonic() - t0
+
+    assert 0.15 < elapsed < 1
+
+
+def test_token_bucket_charges_requests_larger_than_capacity(monkeypatch):
+    # fake clock, sleeping moves it forward
+    clock = [0.0]
+    monkeypatch.setattr(utils.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(
+        utils.time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+    )
+
+    # a WCU budget below one batch of 2 WCU per item
+    rate = 10
+    batch_wcu = 2 * BATCH_UPDATE_LIMIT
+    bucket = TokenBucket(rate=rate)
+    for _ in range(10):
+        bucket.acquire(batch_wcu)
+
+    # past the initial burst, every batch but the last (in debt) was paid
+    # for at `rate`, rather than `rate` per batch
+    assert clock[0] >= (9 * batch_wcu - rate) / rate
+
+
+def test_token_bucket_disabled():
+    bucket = TokenBucket(rate=0)
+    assert bucket.acquire(1_000_000) == 0.0
+
+
+def test_adaptive_concurrency_backs_off_and_recovers():
+    concurrency = AdaptiveConcurrency(max_limit=8, increase_every=2)
+
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 4
+
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == 2
+
+    for _ in range(4):
+        concurrency.acquire()
+        concurrency.release()
+    assert concurrency.limit == 4
+
+
+def test_adaptive_concurrency_bounds_in_flight():
+    concurrency = AdaptiveConcurrency(max_limit=2)
+    concurrency.acquire()
+    concurrency.acquire()
+
+    acquired = threading.Event()
+
+    def acquire_third():
+        concurrency.acquire()
+        acquired.set()
+
+    threading.Thread(target=acquire_third, daemon=True).start()
+    assert not acquired.wait(0.1)
+
+    concurrency.release()
+    assert acquired.wait(1)
+
+
+def test_parse_expiry_timer_removal():
+    record = {
+        "eventName": "REMOVE",
+        "userIdentity": {"type": "Service", "principalId": "dynamodb.amazonaws.com"},
+        "dynamodb": {
+            "Keys": {"email": {"S": "#timer#abc@gmail.com"}, "code": {"S": "ABCD1234"}},
+            "SequenceNumber": "100",
+        },
+    }
+    assert parse_expiry_timer_removal(record) == {
+        "email": "abc@gmail.com",
+        "code": "ABCD1234",
+    }
+
+    # deleted by a user, not by TTL
+    assert parse_expiry_timer_removal({**record, "userIdentity": None}) is None
+    # an invitation, not a timer
+    record["dynamodb"]["Keys"]["email"]["S"] = "abc@gmail.com"
+    assert parse_expiry_timer_removal(record) is None
@@ -0,0 +1,88 @@
+"""
+Cold start import budget of each Lambda: `index` is imported in a fresh
+interpreter, the way the Lambda runtime does, and timed with `-X importtime`.
+Wall-clock budgets depend on the machine, so they are opt-in, run with:
+    RUN_BENCHMARKS=1 pytest -s tests/lambda/test__import_time.py
+The lean import path is checked on every run.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import pytest
+
+LAMBDAS_DIR = os.path.join(os.path.dirname(__file__), "../../lambdas")
+# cumulative import time of `index`, median of RUNS
+IMPORT_TIME_BUDGET_MS = {
+    "api_key_authorizer": 20,
+    # boto3 is only loaded by the first request that needs it
+    "invitation": 100,
+    # every run needs boto3, so it is loaded eagerly
+    "scheduler": 800,
+}
+# modules `index` may load beyond a bare interpreter, None for no limit
+ALLOWED_MODULES = {
+    "api_key_authorizer": {"index"},
+    "invitation": None,
+    "scheduler": None,
+}
+RUNS = 3
+
+
+def __run(lambda_name: str, code: str, *args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args, "-c", code],
+        cwd=os.path.join(LAMBDAS_DIR, lambda_name),
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def __import_times(lambda_name: str) -> tuple[int, list[tuple[int, str]]]:
+    """
+    return cumulative microseconds of `index`, and its slowest imports
+    """
+    stderr = __run(lambda_name, "import index", "-X", "importtime").stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        imports.append((int(cumulative), name.rstrip()))
+
+    total = next(us for us, name in imports if name.strip() == "index")
+    return total, sorted(imports, reverse=True)[:10]
+
+
+@pytest.mark.skipif(
+    not os.environ.get("RUN_BENCHMARKS"),
+    reason="set RUN_BENCHMARKS=1 to run benchmarks",
+)
+@pytest.mark.parametrize("lambda_name", sorted(IMPORT_TIME_BUDGET_MS))
+def test_import_time_budget(lambda_environment, lambda_name: str):
+    runs = [__import_times(lambda_name) for _ in range(RUNS)]
+    median_ms = statistics.median(total for total, _ in runs) / 1000
+    print(f"{lambda_name}: {median_ms:.1f}ms")
+
+    breakdown = "\n".join(f"{us / 1000:8.1f}ms {name}" for us, name in runs[0][1])
+    assert median_ms <= IMPORT_TIME_BUDGET_MS[lambda_name], (
+        f"{lambda_name} imports in {median_ms:.1f}ms, "
+        f"over its {IMPORT_TIME_BUDGET_MS[lambda_name]}ms budget:\n{breakdown}"
+    )
+
+
+@pytest.mark.parametrize("lambda_name", ["api_key_authorizer", "invitation"])
+def test_lean_import_path(lambda_environment, lambda_name: str):
+    code = (
+        "import json, sys; before = set(sys.modules); import index; "
+        "print(json.dumps(sorted(set(sys.modules) - before)))"
+    )
+    loaded = set(json.loads(__run(lambda_name, code).stdout.splitlines()[-1]))
+
+    assert not any(name.split(".")[0] in ("boto3", "botocore") for name in loaded)
+    if ALLOWED_MODULES[lambda_name] is not None:
+        assert loaded <= ALLOWED_MODULES[lambda_name]